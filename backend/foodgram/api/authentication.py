@@ -0,0 +1,48 @@
+import time
+
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from foodgram.instrumentation import phase
+from foodgram.metrics import inc
+
+
+class TimedTokenAuthentication(TokenAuthentication):
+    '''Аутентификация по токену с замером времени для Server-Timing
+    и учетом результатов в метриках. Счетчики пользователя выбираются
+    вместе с токеном, и /users/me/ отдается без запросов к базе.
+    '''
+
+    def authenticate(self, request):
+        start = time.perf_counter()
+        result = 'failed'
+        try:
+            with phase('auth'):
+                user = super().authenticate(request)
+            result = 'anonymous' if user is None else 'token'
+            return user
+        finally:
+            inc('foodgram_auth_requests_total', result=result)
+            inc(
+                'foodgram_auth_duration_seconds_total',
+                time.perf_counter() - start,
+                result=result,
+            )
+
+    def authenticate_credentials(self, key):
+        model = self.get_model()
+        try:
+            token = (
+                model
+                .objects
+                .select_related('user', 'user__stats')
+                .get(key=key)
+            )
+        except model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        return (token.user, token)
@@ -0,0 +1,355 @@
+import statistics
+import time
+from collections import Counter
+from contextlib import contextmanager
+from io import BytesIO
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Prefetch
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import Serializer
+
+from recipes.models import Ingredient, IngredientInRecipe, Recipe, Tag
+from recipes.pages import build_page
+from users.models import User
+
+from .parsers import FastJSONParser
+from .renderers import FastJSONRenderer
+from .serializers import (IngredientSerializer, IngredientValuesSerializer,
+                          RecipeSerializer, RecipeSnapshotSerializer,
+                          TagSerializer, TagValuesSerializer, UserSerializer,
+                          UserValuesSerializer)
+
+
+def measure(func, repeat):
+    '''Вызывает func repeat раз и возвращает медиану времени в секундах.'''
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def serializer_cases(page_size):
+    '''Сравнение сериализаторов DRF с быстрыми сериализаторами.
+    Каждый случай - (название, текущая реализация, быстрая реализация).
+    Время включает запросы к базе: быстрые сериализаторы
+    не создают экземпляры моделей.
+    '''
+    yield (
+        'ingredients',
+        lambda: IngredientSerializer(
+            Ingredient.objects.all(), many=True
+        ).data,
+        lambda: IngredientValuesSerializer(
+            IngredientValuesSerializer.values(Ingredient.objects.all()),
+            many=True,
+        ).data,
+    )
+    yield (
+        'tags',
+        lambda: TagSerializer(Tag.objects.all(), many=True).data,
+        lambda: TagValuesSerializer(
+            TagValuesSerializer.values(Tag.objects.all()), many=True
+        ).data,
+    )
+    yield (
+        f'users[:{page_size}]',
+        lambda: UserSerializer(
+            User.objects.all()[:page_size], many=True
+        ).data,
+        lambda: UserValuesSerializer(
+            UserValuesSerializer.values(User.objects.all())[:page_size],
+            many=True,
+        ).data,
+    )
+    yield (
+        f'recipes[:{page_size}]',
+        lambda: RecipeSerializer(
+            Recipe
+            .objects
+            .select_related('author')
+            .prefetch_related(
+                'tags',
+                Prefetch(
+                    'ingredient_list',
+                    IngredientInRecipe.objects.select_related('ingredients'),
+                ),
+            )[:page_size],
+            many=True,
+        ).data,
+        lambda: RecipeSnapshotSerializer(
+            Recipe
+            .objects
+            .select_related('snapshot')
+            .only('id', 'author', 'snapshot__data')[:page_size],
+            many=True,
+        ).data,
+    )
+
+
+def renderer_cases(page_size):
+    '''Сравнение JSONRenderer/JSONParser с FastJSONRenderer/FastJSONParser
+    на реальных ответах: весь список ингредиентов и страница рецептов.
+    '''
+    payloads = {
+        'ingredients': IngredientValuesSerializer(
+            IngredientValuesSerializer.values(Ingredient.objects.all()),
+            many=True,
+        ).data,
+        f'recipes[:{page_size}]': RecipeSnapshotSerializer(
+            Recipe.objects.select_related('snapshot')[:page_size], many=True
+        ).data,
+    }
+    for name, data in payloads.items():
+        yield (
+            f'render {name}',
+            lambda data=data: JSONRenderer().render(data),
+            lambda data=data: FastJSONRenderer().render(data),
+        )
+        content = JSONRenderer().render(data)
+        yield (
+            f'parse {name}',
+            lambda content=content: JSONParser().parse(BytesIO(content)),
+            lambda content=content: FastJSONParser().parse(BytesIO(content)),
+        )
+
+
+def page_cases(page_size):
+    '''Страница списка рецептов от выборки до байтов ответа:
+    сериализаторы DRF и готовые представления против сборки JSON
+    в PostgreSQL одним запросом. Время включает подсчет рецептов.
+    '''
+    def render_page(serializer_class, queryset):
+        Recipe.objects.count()
+        return FastJSONRenderer().render(
+            serializer_class(queryset[:page_size], many=True).data
+        )
+
+    def build_sql_page():
+        return build_page(
+            Recipe.objects.all(), None, settings.MEDIA_URL, 0, page_size
+        )
+
+    yield (
+        f'serializer -> sql[:{page_size}]',
+        lambda: render_page(
+            RecipeSerializer,
+            Recipe.objects.select_related('author').prefetch_related(
+                'tags',
+                Prefetch(
+                    'ingredient_list',
+                    IngredientInRecipe.objects.select_related('ingredients'),
+                ),
+            ),
+        ),
+        build_sql_page,
+    )
+    yield (
+        f'snapshot -> sql[:{page_size}]',
+        lambda: render_page(
+            RecipeSnapshotSerializer,
+            Recipe.objects.select_related('snapshot').only(
+                'id', 'author', 'snapshot__data'
+            ),
+        ),
+        build_sql_page,
+    )
+
+
+SUITES = {
+    'serializers': serializer_cases,
+    'renderers': renderer_cases,
+    'pages': page_cases,
+}
+
+
+ENDPOINTS = (
+    ('recipes', '/api/recipes/?limit={page_size}', False),
+    ('recipes_cards',
+     '/api/recipes/?limit={page_size}'
+     '&fields=id,name,image,cooking_time,tags&expand=tags', False),
+    ('recipes_by_tag', '/api/recipes/?limit={page_size}&tags={tag}', False),
+    ('recipes_by_author',
+     '/api/recipes/?limit={page_size}&author={author}', False),
+    ('recipes_favorited',
+     '/api/recipes/?limit={page_size}&is_favorited=1', True),
+    ('recipes_in_shopping_cart',
+     '/api/recipes/?limit={page_size}&is_in_shopping_cart=1', True),
+    ('recipe_detail', '/api/recipes/{recipe}/', True),
+    ('subscriptions',
+     '/api/users/subscriptions/?limit={page_size}&recipes_limit=3', True),
+    ('download_shopping_cart', '/api/recipes/download_shopping_cart/', True),
+    ('ingredients_search', '/api/ingredients/?name={ingredient}', False),
+    ('tags', '/api/tags/', False),
+    ('users', '/api/users/?limit={page_size}', True),
+)
+
+
+class FieldProbe:
+    '''Обертка над полем сериализатора, отмечающая его в стеке
+    на время получения и преобразования значения.
+    '''
+
+    def __init__(self, field, stack):
+        self._field = field
+        self._stack = stack
+        self._label = f'{type(field.parent).__name__}.{field.field_name}'
+
+    def __getattr__(self, name):
+        return getattr(self._field, name)
+
+    def _call(self, method, value):
+        self._stack.append(self._label)
+        try:
+            return method(value)
+        finally:
+            self._stack.pop()
+
+    def get_attribute(self, instance):
+        return self._call(self._field.get_attribute, instance)
+
+    def to_representation(self, value):
+        return self._call(self._field.to_representation, value)
+
+
+@contextmanager
+def track_field_queries():
+    '''Считает SQL-запросы, выполненные полями сериализаторов.
+    Отдает Counter "Сериализатор.поле" -> число запросов.
+    Запрос относится к самому вложенному из выполняемых полей.
+    '''
+    queries = Counter()
+    stack = []
+    readable_fields = Serializer._readable_fields
+
+    def probe_fields(serializer):
+        for field in readable_fields.fget(serializer):
+            yield FieldProbe(field, stack)
+
+    def count_query(execute, sql, params, many, context):
+        if stack:
+            queries[stack[-1]] += 1
+        return execute(sql, params, many, context)
+
+    Serializer._readable_fields = property(probe_fields)
+    try:
+        with connection.execute_wrapper(count_query):
+            yield queries
+    finally:
+        Serializer._readable_fields = readable_fields
+
+
+def percentile(values, share):
+    '''Перцентиль по отсортированному списку значений.'''
+    return values[min(len(values) - 1, round(share * (len(values) - 1)))]
+
+
+def get_endpoint_context(page_size):
+    '''Подбирает параметры запросов по данным из базы.
+    Запросы с авторизацией выполняются от имени самого активного
+    пользователя, чтобы фильтры и подписки возвращали данные.
+    '''
+    user = (
+        User
+        .objects
+        .annotate(favorites=Count('favorite_recipes'))
+        .order_by('-favorites')
+        .first()
+    )
+    author = (
+        User
+        .objects
+        .annotate(recipes_count=Count('recipes'))
+        .order_by('-recipes_count')
+        .first()
+    )
+    return user, {
+        'page_size': page_size,
+        'tag': Tag.objects.values_list('slug', flat=True).first(),
+        'author': author.id if author else 0,
+        'recipe': Recipe.objects.values_list('id', flat=True).first(),
+        'ingredient': (
+            Ingredient.objects.values_list('name', flat=True).first() or ''
+        )[:2],
+    }
+
+
+def get_client(user=None):
+    '''Тестовый клиент Django с допустимым хостом и токеном.'''
+    host = next(
+        (host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'),
+        'localhost',
+    )
+    headers = {'HTTP_HOST': host}
+    if user is not None:
+        token, _ = Token.objects.get_or_create(user=user)
+        headers['HTTP_AUTHORIZATION'] = f'Token {token.key}'
+    return Client(**headers)
+
+
+def run_endpoints(requests, page_size, only=None, warmup=2, fields=False):
+    '''Прогоняет основные запросы API через тестовый клиент.
+    Возвращает для каждого запроса перцентили задержки в мс
+    и число SQL-запросов, а с fields - и запросы по полям сериализаторов.
+    '''
+    user, context = get_endpoint_context(page_size)
+    clients = {False: get_client(), True: get_client(user)}
+    results = {}
+    for name, url, auth in ENDPOINTS:
+        if only and name not in only:
+            continue
+        url = url.format(**context)
+        client = clients[auth]
+        for _ in range(warmup):
+            client.get(url)
+        timings = []
+        queries = []
+        for _ in range(requests):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(captured))
+        timings.sort()
+        results[name] = {
+            'url': url,
+            'status': response.status_code,
+            'p50': round(percentile(timings, 0.5), 3),
+            'p90': round(percentile(timings, 0.9), 3),
+            'p99': round(percentile(timings, 0.99), 3),
+            'max': round(timings[-1], 3),
+            'queries': max(queries),
+        }
+        if fields:
+            with track_field_queries() as field_queries:
+                client.get(url)
+            results[name]['fields'] = dict(field_queries.most_common())
+    return results
+
+
+def compare_results(results, baseline, tolerance):
+    '''Сравнивает замеры с сохраненными ранее.
+    Возвращает список (запрос, метрика, было, стало, регрессия).
+    Регрессия - рост p50/p90 больше чем на tolerance
+    или любое увеличение числа SQL-запросов.
+    '''
+    rows = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in ('p50', 'p90', 'queries'):
+            before, after = previous[metric], current[metric]
+            if metric == 'queries':
+                regression = after > before
+            else:
+                regression = after > before * (1 + tolerance)
+            rows.append((name, metric, before, after, regression))
+    return rows
@@ -0,0 +1,51 @@
+import hashlib
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from foodgram.cache import get_or_compute, get_version
+
+
+def get_cache_key(request, namespace):
+    '''Ключ ответа: версия пространства, хост и путь запроса
+    и параметры в порядке имен. Хост нужен из-за абсолютных
+    ссылок на картинки и страницы в ответе.
+    '''
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    url = f'{request.get_host()}{request.path}?{query}'
+    digest = hashlib.sha256(url.encode()).hexdigest()
+    return f'view:{namespace}:{get_version(namespace)}:{digest}'
+
+
+def cached_list(namespace, timeout, anonymous_only=False):
+    '''Кэширует данные ответа метода list в пространстве namespace.
+    timeout - имя настройки со сроком кэша в секундах, 0 отключает кэш.
+    С anonymous_only кэшируются только запросы без аутентификации:
+    ответ зависит от пользователя. Ответы для браузерного API
+    не кэшируются.
+    '''
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            seconds = getattr(settings, timeout)
+            if (
+                not seconds
+                or anonymous_only and request.user.is_authenticated
+                or not isinstance(request.accepted_renderer, JSONRenderer)
+            ):
+                return method(self, request, *args, **kwargs)
+
+            def compute():
+                response = method(self, request, *args, **kwargs)
+                return response.status_code, response.data
+
+            status, data = get_or_compute(
+                get_cache_key(request, namespace), compute, seconds,
+                name=f'{namespace}_list',
+            )
+            return Response(data, status=status)
+        return wrapper
+    return decorator
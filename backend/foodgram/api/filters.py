@@ -1,14 +1,19 @@
 from django_filters.rest_framework import FilterSet, filters
-from rest_framework.filters import SearchFilter
+from rest_framework.filters import BaseFilterBackend, SearchFilter
 
-from recipes.models import Recipe
+from recipes.models import Recipe, Tag
+from users.search import search_users
 
 
 class RecipeFilter(FilterSet):
     """"Фильтр для сортировки рецептов."""""
-    tags = filters.AllValuesMultipleFilter(
+    # Варианты берутся из таблицы тегов, а не из DISTINCT по всем рецептам.
+    tags = filters.ModelMultipleChoiceFilter(
+        queryset=Tag.objects.all(),
         field_name='tags__slug',
-        label='tags'
+        to_field_name='slug',
+        label='tags',
+        method='get_tags',
     )
     is_favorited = filters.BooleanFilter(method='get_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
@@ -24,6 +29,18 @@ class RecipeFilter(FilterSet):
             'is_in_shopping_cart'
         )
 
+    def get_tags(self, queryset, name, value):
+        '''Рецепты хотя бы с одним из тегов.
+        Подзапрос вместо JOIN не дает дублей, и DISTINCT не нужен.
+        '''
+        if not value:
+            return queryset
+        return queryset.filter(
+            id__in=Recipe.tags.through.objects.filter(
+                tag__in=value
+            ).values('recipe_id')
+        )
+
     def get_is_favorited(self, queryset, name, value):
         if value:
             return queryset.filter(favorite_users__user=self.request.user)
@@ -39,3 +56,14 @@ class RecipeFilter(FilterSet):
 
 class IngredientSearchFilter(SearchFilter):
     search_param = 'name'
+
+
+class UserSearchFilter(BaseFilterBackend):
+    '''Поиск пользователей по параметру search.'''
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, '').strip()
+        if not text:
+            return queryset
+        return search_users(queryset, text)
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import SUITES, measure
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает скорость текущей и быстрой реализаций '
+        'на данных из базы.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'suites',
+            nargs='*',
+            help=f'Наборы замеров: {", ".join(SUITES)}. По умолчанию - все.',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Сколько раз повторять каждый замер.',
+        )
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=100,
+            help='Размер страницы для постраничных выборок.',
+        )
+
+    def handle(self, *args, **options):
+        unknown = set(options['suites']) - set(SUITES)
+        if unknown:
+            raise CommandError(f'Неизвестные наборы: {", ".join(unknown)}')
+        for suite in options['suites'] or SUITES:
+            self.stdout.write(self.style.MIGRATE_HEADING(suite))
+            for name, baseline, candidate in SUITES[suite](
+                options['page_size']
+            ):
+                baseline_time = measure(baseline, options['repeat'])
+                candidate_time = measure(candidate, options['repeat'])
+                self.stdout.write(
+                    f'  {name:<24} {baseline_time * 1000:9.2f} ms '
+                    f'-> {candidate_time * 1000:9.2f} ms '
+                    f'(x{baseline_time / candidate_time:.1f})'
+                )
@@ -0,0 +1,111 @@
+import json
+import platform
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.benchmarks import ENDPOINTS, compare_results, run_endpoints
+from recipes.models import Recipe
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет задержку и число SQL-запросов основных запросов API '
+        'и сравнивает их с сохраненным ранее результатом.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=30,
+            help='Сколько раз выполнять каждый запрос.',
+        )
+        parser.add_argument('--page-size', type=int, default=6)
+        parser.add_argument(
+            '--only',
+            nargs='+',
+            metavar='NAME',
+            help=f'Запросы: {", ".join(name for name, _, _ in ENDPOINTS)}.',
+        )
+        parser.add_argument(
+            '--fields',
+            action='store_true',
+            help='Показать поля сериализаторов, выполняющие SQL-запросы.',
+        )
+        parser.add_argument(
+            '--save', metavar='PATH', help='Сохранить результат в JSON.'
+        )
+        parser.add_argument(
+            '--compare',
+            metavar='PATH',
+            help='Сравнить с результатом, сохраненным ранее.',
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.25,
+            help='Допустимый рост задержки при сравнении.',
+        )
+        parser.add_argument(
+            '--fail-on-regression',
+            action='store_true',
+            help='Завершиться с ошибкой, если есть регрессии.',
+        )
+
+    def handle(self, *args, **options):
+        results = run_endpoints(
+            options['requests'],
+            options['page_size'],
+            options['only'],
+            fields=options['fields'],
+        )
+        self.stdout.write(
+            f'{"endpoint":<26} {"status":>6} {"p50":>9} {"p90":>9} '
+            f'{"p99":>9} {"queries":>7}'
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<26} {result["status"]:>6} {result["p50"]:>9.2f} '
+                f'{result["p90"]:>9.2f} {result["p99"]:>9.2f} '
+                f'{result["queries"]:>7}'
+            )
+            for field, queries in result.get('fields', {}).items():
+                self.stdout.write(f'  {field:<40} {queries:>7}')
+
+        if options['save']:
+            with open(options['save'], 'w', encoding='utf-8') as file:
+                json.dump(
+                    {
+                        'created': timezone.now().isoformat(),
+                        'python': platform.python_version(),
+                        'requests': options['requests'],
+                        'page_size': options['page_size'],
+                        'dataset': {
+                            'users': User.objects.count(),
+                            'recipes': Recipe.objects.count(),
+                        },
+                        'endpoints': results,
+                    },
+                    file,
+                    ensure_ascii=False,
+                    indent=2,
+                )
+            self.stdout.write(f'Результат сохранен в {options["save"]}')
+
+        if not options['compare']:
+            return
+        with open(options['compare'], encoding='utf-8') as file:
+            baseline = json.load(file)['endpoints']
+        regressions = 0
+        for name, metric, before, after, regression in compare_results(
+            results, baseline, options['tolerance']
+        ):
+            style = self.style.ERROR if regression else self.style.SUCCESS
+            self.stdout.write(style(
+                f'{name:<26} {metric:<8} {before:>9} -> {after:>9}'
+            ))
+            regressions += regression
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'Регрессий: {regressions}')
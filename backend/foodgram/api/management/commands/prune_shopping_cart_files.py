@@ -0,0 +1,29 @@
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет готовые файлы списков покупок, которые не скачивали '
+        'дольше SHOPPING_CART_CACHE_DAYS дней.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=float,
+            default=settings.SHOPPING_CART_CACHE_DAYS,
+            help='Сколько дней хранить файл после последней выдачи.',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = time.time() - options['days'] * 24 * 60 * 60
+        deleted = 0
+        for path in Path(settings.SHOPPING_CART_CACHE_DIR).glob('*.txt'):
+            if path.stat().st_mtime < cutoff:
+                path.unlink(missing_ok=True)
+                deleted += 1
+        self.stdout.write(self.style.SUCCESS(f'Удалено файлов: {deleted}'))
@@ -1,4 +1,14 @@
+import json
+from collections import OrderedDict
+from math import ceil
+
+from django.utils.translation import gettext as _
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .renderers import RawJSON
 
 
 class PageLimitPagination(PageNumberPagination):
@@ -6,3 +16,93 @@ class PageLimitPagination(PageNumberPagination):
     количество объектов на странице.
     '''
     page_size_query_param = 'limit'
+
+    def get_json_paginated_response(self, request, number, count, results):
+        '''Ответ страницы number из готового JSON списка results
+        (например, собранного в PostgreSQL) и общего числа записей count.
+        Ответ и ссылки те же, что у get_paginated_response.
+        '''
+        num_pages = max(ceil(count / self.get_page_size(request)), 1)
+        if number > num_pages:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=number,
+                message=_('That page contains no results'),
+            ))
+        url = request.build_absolute_uri()
+        next_link = previous_link = None
+        if number < num_pages:
+            next_link = replace_query_param(
+                url, self.page_query_param, number + 1
+            )
+        if number == 2:
+            previous_link = remove_query_param(url, self.page_query_param)
+        elif number > 2:
+            previous_link = replace_query_param(
+                url, self.page_query_param, number - 1
+            )
+        return Response(RawJSON(
+            '{{"count":{},"next":{},"previous":{},"results":{}}}'.format(
+                count,
+                json.dumps(next_link),
+                json.dumps(previous_link),
+                results,
+            ).encode()
+        ))
+
+
+class KeysetPagination(PageLimitPagination):
+    '''Пагинатор с переходом по ключу.
+    С параметром cursor страница начинается после записи со значением
+    ключа cursor (пустое значение - с начала), без OFFSET и COUNT:
+    в ответе нет count, а next содержит cursor следующей страницы.
+    Без cursor работает как PageLimitPagination.
+    Ключ должен быть уникальным и совпадать с порядком выборки.
+    '''
+    cursor_query_param = 'cursor'
+    key_field = 'id'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor = request.query_params.get(self.cursor_query_param)
+        if self.cursor is None:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        page_size = self.get_page_size(request)
+        if self.cursor:
+            queryset = queryset.filter(
+                **{f'{self.key_field}__gt': self.cursor}
+            )
+        rows = list(queryset.order_by(self.key_field)[:page_size + 1])
+        self.next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last = rows[-1]
+            self.next_cursor = (
+                last[self.key_field] if isinstance(last, dict)
+                else getattr(last, self.key_field)
+            )
+        return rows
+
+    def get_next_link(self):
+        if self.cursor is None:
+            return super().get_next_link()
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.next_cursor,
+        )
+
+    def get_paginated_response(self, data):
+        if self.cursor is None:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', None),
+            ('results', data),
+        ]))
+
+
+class UserPagination(KeysetPagination):
+    '''Пагинатор списка пользователей: ключ - уникальное имя пользователя.'''
+    key_field = 'username'
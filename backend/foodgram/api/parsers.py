@@ -0,0 +1,78 @@
+import codecs
+
+from django.conf import settings
+from django.core.files.uploadhandler import (StopUpload,
+                                             TemporaryFileUploadHandler)
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError
+from rest_framework.parsers import JSONParser, MultiPartParser
+
+from .renderers import FastJSONRenderer, orjson
+
+
+class FastJSONParser(JSONParser):
+    '''JSON-парсер на orjson.
+    Если orjson не установлен или тело не в utf-8,
+    работает как обычный JSONParser.
+    '''
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or codecs.lookup(encoding).name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+# Запас на заголовки частей и прочие поля формы.
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Файл слишком большой.'
+    default_code = 'upload_too_large'
+
+
+class LimitedUploadHandler(TemporaryFileUploadHandler):
+    '''Пишет файл во временный файл по частям и обрывает загрузку,
+    как только она превышает max_size.
+    '''
+
+    def __init__(self, max_size, request=None):
+        super().__init__(request)
+        self.max_size = max_size
+        self.exceeded = False
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.max_size:
+            self.exceeded = True
+            raise StopUpload(connection_reset=True)
+        return super().receive_data_chunk(raw_data, start)
+
+
+class ImageUploadParser(MultiPartParser):
+    '''multipart/form-data с ограничением размера файла.
+    Файл не держится в памяти целиком, превышение IMAGE_UPLOAD_MAX_SIZE
+    обрывает чтение тела и отдает 413.
+    '''
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        max_size = settings.IMAGE_UPLOAD_MAX_SIZE
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        if content_length > max_size + MULTIPART_OVERHEAD:
+            raise UploadTooLarge()
+        handler = LimitedUploadHandler(max_size, request)
+        request.upload_handlers = [handler]
+        data_and_files = super().parse(stream, media_type, parser_context)
+        if handler.exceeded:
+            raise UploadTooLarge()
+        return data_and_files
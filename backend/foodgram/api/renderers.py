@@ -0,0 +1,55 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class RawJSON(bytes):
+    '''Готовый JSON, например собранный в PostgreSQL.
+    FastJSONRenderer отдает его без разбора и повторной сборки.
+    '''
+
+
+class FastJSONRenderer(JSONRenderer):
+    '''JSON-рендерер на orjson.
+    Если orjson не установлен или запрошен отступ, работает
+    как обычный JSONRenderer. Даты, Decimal и ленивые строки отдаются
+    кодировщику DRF, поэтому ответ совпадает с JSONRenderer побайтно
+    (кроме записи очень малых и очень больших float). RawJSON
+    отдается как есть.
+    '''
+    options = (
+        orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if orjson else 0
+    )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, RawJSON):
+            return self.escape(bytes(data))
+        fallback = (
+            orjson is None
+            or data is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {})
+        )
+        if fallback:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(
+                data, default=self.encoder_class().default, option=self.options
+            )
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        return self.escape(ret)
+
+    @staticmethod
+    def escape(ret):
+        # Как и JSONRenderer, экранируем \u2028 и \u2029 для JavaScript.
+        return (
+            ret
+            .replace('\u2028'.encode(), b'\\u2028')
+            .replace('\u2029'.encode(), b'\\u2029')
+        )
@@ -1,18 +1,72 @@
+import json
+
 from django.db import transaction
+from django.db.models import Manager, Prefetch, prefetch_related_objects
 from djoser.serializers import UserCreateSerializer
 from djoser.serializers import UserSerializer as DjoserUserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
-from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                            ShoppingCart, Tag)
-from users.models import Follow, User
+from foodgram.instrumentation import phase
+from recipes.models import (AuthorStats, Favorite, Ingredient,
+                            IngredientInRecipe, Recipe, ShoppingCart, Tag)
+from recipes.snapshots import ensure_snapshots
+from recipes.uploads import TOKEN_PREFIX, open_upload
+from users.follow_set import FollowSet, get_follow_set
+from users.models import User
+
+
+def get_context_follow_set(context):
+    '''Подписки текущего пользователя, одни на весь ответ.'''
+    if 'follow_set' not in context:
+        request = context.get('request')
+        context['follow_set'] = (
+            get_follow_set(request.user) if request else FollowSet()
+        )
+    return context['follow_set']
+
+
+class TimedSerializerMixin:
+    '''Замеряет построение ответа сериализатором (фаза serialize
+    в Server-Timing). Для замера списков many=True в Meta задается
+    list_serializer_class = TimedListSerializer, вложенные
+    сериализаторы входят во время внешнего.
+    '''
+
+    @property
+    def data(self):
+        with phase('serialize'):
+            return super().data
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    '''Список many=True, замеряемый целиком.'''
 
 
-class CreateUserSerializer(UserCreateSerializer):
+class ValuesSerializer(TimedSerializerMixin, serializers.BaseSerializer):
+    '''Быстрый сериализатор только для чтения.
+    Работает со строками queryset.values() и отдает их как есть,
+    минуя поля DRF. Ключи и порядок задаются в Meta.fields.
+    '''
+
+    class Meta:
+        list_serializer_class = TimedListSerializer
+        fields = ()
+
+    @classmethod
+    def values(cls, queryset):
+        '''Готовит выборку строк для сериализатора.'''
+        return queryset.values(*cls.Meta.fields)
+
+    def to_representation(self, row):
+        return row
+
+
+class CreateUserSerializer(TimedSerializerMixin, UserCreateSerializer):
     '''Сериализатор для создания пользователей.'''
 
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = User
         fields = (
             'email',
@@ -24,13 +78,32 @@ class CreateUserSerializer(UserCreateSerializer):
         )
 
 
-class UserSerializer(DjoserUserSerializer):
+class AuthorStatsSerializer(TimedSerializerMixin,
+                            serializers.ModelSerializer):
+    '''Сериализатор счетчиков автора.
+    Если строки счетчиков еще нет, отдает нули.
+    '''
+
+    class Meta:
+        list_serializer_class = TimedListSerializer
+        model = AuthorStats
+        fields = (
+            'recipes_count',
+            'followers_count',
+            'favorites_count',
+        )
+
+    def get_attribute(self, instance):
+        return super().get_attribute(instance) or AuthorStats()
+
+
+class UserSerializer(TimedSerializerMixin, DjoserUserSerializer):
     '''Сериализатор пользователей.'''
-    is_subscribed = serializers.BooleanField(
-        default=False, read_only=True, source='subscribed_exists'
-    )
+    is_subscribed = serializers.SerializerMethodField()
+    stats = AuthorStatsSerializer(read_only=True)
 
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = User
         fields = (
             'email',
@@ -39,8 +112,53 @@ class UserSerializer(DjoserUserSerializer):
             'first_name',
             'last_name',
             'is_subscribed',
+            'stats',
+        )
+
+    def get_is_subscribed(self, user):
+        request = self.context.get('request')
+        if request and request.user.id == user.id:
+            # На себя подписаться нельзя, кэш подписок не нужен.
+            return False
+        return user.id in get_context_follow_set(self.context)
+
+
+class AuthorSerializer(UserSerializer):
+    '''Сериализатор автора рецепта.
+    Без счетчиков: они меняются чаще, чем готовые представления рецептов.
+    '''
+
+    class Meta(UserSerializer.Meta):
+        fields = UserSerializer.Meta.fields[:-1]
+
+
+class UserValuesSerializer(ValuesSerializer):
+    '''Быстрый сериализатор пользователей для списка и профиля.
+    Признак подписки проверяется по кэшу подписок,
+    счетчики выбираются из AuthorStats тем же запросом.
+    '''
+    stats_fields = AuthorStatsSerializer.Meta.fields
+
+    class Meta(ValuesSerializer.Meta):
+        fields = AuthorSerializer.Meta.fields[:-1]
+
+    @classmethod
+    def values(cls, queryset):
+        return queryset.values(
+            *cls.Meta.fields,
+            *(f'stats__{name}' for name in cls.stats_fields),
         )
 
+    def to_representation(self, row):
+        row['is_subscribed'] = (
+            row['id'] in get_context_follow_set(self.context)
+        )
+        row['stats'] = {
+            name: row.pop(f'stats__{name}') or 0
+            for name in self.stats_fields
+        }
+        return row
+
 
 class RecipeMinifiedSerializer(serializers.ModelSerializer):
     '''Минифицированный сериализатор для рецептов.'''
@@ -60,6 +178,9 @@ class RecipeFollowUserField(serializers.Field):
     """Сериализатор для вывода рецептов в подписках."""
 
     def get_attribute(self, instance):
+        recipes = getattr(instance.author, 'subscription_recipes', None)
+        if recipes is not None:
+            return recipes
         request = self.context.get('request')
         recipes = Recipe.objects.filter(author=instance.author)
         if request:
@@ -82,7 +203,7 @@ class RecipeFollowUserField(serializers.Field):
         return recipes_data
 
 
-class FollowSerializer(serializers.ModelSerializer):
+class FollowSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     '''Сериализатор подписок.
     Для вывода авторов рецепта на которых подписан текущий пользователь.
     '''
@@ -94,21 +215,23 @@ class FollowSerializer(serializers.ModelSerializer):
     first_name = serializers.ReadOnlyField(source='author.first_name')
     last_name = serializers.ReadOnlyField(source='author.last_name')
     is_subscribed = serializers.SerializerMethodField()
+    stats = AuthorStatsSerializer(source='author.stats', read_only=True)
 
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = User
         fields = ('email', 'id', 'username',
                   'first_name', 'last_name',
                   'is_subscribed',
-                  'recipes', 'recipes_count')
+                  'recipes', 'recipes_count', 'stats')
 
     def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj.author).count()
+        stats = getattr(obj.author, 'stats', None)
+        return stats.recipes_count if stats else 0
 
     def get_is_subscribed(self, obj):
-        return Follow.objects.filter(
-            user=obj.user, author=obj.author
-        ).exists()
+        # Сохраненный объект подписки сам по себе означает, что она есть.
+        return obj.pk is not None
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -124,6 +247,13 @@ class TagSerializer(serializers.ModelSerializer):
         )
 
 
+class TagValuesSerializer(ValuesSerializer):
+    '''Быстрый сериализатор для списка тегов.'''
+
+    class Meta(ValuesSerializer.Meta):
+        fields = TagSerializer.Meta.fields
+
+
 class IngredientSerializer(serializers.ModelSerializer):
     '''Сериализатор для получения ингредиента
     или получения списка ингредиентов.
@@ -138,6 +268,13 @@ class IngredientSerializer(serializers.ModelSerializer):
         )
 
 
+class IngredientValuesSerializer(ValuesSerializer):
+    '''Быстрый сериализатор для списка ингредиентов.'''
+
+    class Meta(ValuesSerializer.Meta):
+        fields = IngredientSerializer.Meta.fields
+
+
 class ReadIngredientInRecipeSerializer(serializers.ModelSerializer):
     '''Сериализатор для вывода информации об ингредиенте в рецепте.'''
     id = serializers.ReadOnlyField(source='ingredients.id')
@@ -168,10 +305,29 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
         )
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeImageField(Base64ImageField):
+    '''Фото блюда: base64 в JSON или токен,
+    полученный от /api/recipes/images/.
+    '''
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) and data.startswith(TOKEN_PREFIX):
+            try:
+                return open_upload(data, self.context['request'].user.id)
+            except ValueError as error:
+                raise serializers.ValidationError(str(error))
+        return super().to_internal_value(data)
+
+
+class ImageUploadSerializer(serializers.Serializer):
+    '''Фото блюда, загруженное отдельным запросом.'''
+    image = serializers.ImageField()
+
+
+class RecipeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     '''Сериализатор для получения рецепта/рецептов.'''
     tags = TagSerializer(many=True)
-    author = UserSerializer(read_only=True)
+    author = AuthorSerializer(read_only=True)
     ingredients = ReadIngredientInRecipeSerializer(
         many=True,
         source='ingredient_list',
@@ -186,6 +342,7 @@ class RecipeSerializer(serializers.ModelSerializer):
     )
 
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = Recipe
         fields = (
             'id',
@@ -201,17 +358,89 @@ class RecipeSerializer(serializers.ModelSerializer):
         )
 
 
-class CreateRecipeSerializer(serializers.ModelSerializer):
+class SparseRecipeSerializer(RecipeSerializer):
+    '''Сериализатор рецепта с выбранными полями.
+    Поля берутся из context['fields'], связи (теги, автор, ингредиенты)
+    не из context['expand'] отдаются как id.
+    '''
+    related_fields = ('tags', 'author', 'ingredients')
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = self.context['fields']
+        expand = self.context['expand']
+        for name in list(fields):
+            if name not in requested:
+                del fields[name]
+            elif name in self.related_fields and name not in expand:
+                fields[name] = serializers.PrimaryKeyRelatedField(
+                    many=name != 'author', read_only=True
+                )
+        return fields
+
+
+class RecipeSnapshotListSerializer(TimedListSerializer):
+    '''Список рецептов: недостающие представления достраиваются пачкой.'''
+
+    def to_representation(self, data):
+        recipes = list(data.all() if isinstance(data, Manager) else data)
+        ensure_snapshots(recipes)
+        return super().to_representation(recipes)
+
+
+class RecipeSnapshotSerializer(TimedSerializerMixin,
+                               serializers.BaseSerializer):
+    '''Сериализатор для получения рецепта/рецептов.
+    Берет готовое представление рецепта из RecipeSnapshot и проставляет
+    в него флаги текущего пользователя. Ответ совпадает с RecipeSerializer.
+    '''
+    extra_fields = ()
+
+    class Meta:
+        list_serializer_class = RecipeSnapshotListSerializer
+
+    @property
+    def data(self):
+        # В списке представления достраивает RecipeSnapshotListSerializer.
+        if self.instance is not None and not hasattr(self, '_data'):
+            ensure_snapshots([self.instance])
+        return super().data
+
+    def to_representation(self, recipe):
+        data = json.loads(recipe.snapshot.data)
+        data['author']['is_subscribed'] = (
+            recipe.author_id in get_context_follow_set(self.context)
+        )
+        data['is_favorited'] = getattr(recipe, 'is_favorited', False)
+        data['is_in_shopping_cart'] = getattr(
+            recipe, 'is_in_shopping_cart', False
+        )
+        request = self.context.get('request')
+        if data['image'] and request is not None:
+            data['image'] = request.build_absolute_uri(data['image'])
+        for field in self.extra_fields:
+            data[field] = getattr(recipe, field)
+        return data
+
+
+class RecipeCoverageSerializer(RecipeSnapshotSerializer):
+    '''Сериализатор рецепта в поиске по имеющимся ингредиентам.'''
+    extra_fields = ('coverage', 'missing')
+
+
+class CreateRecipeSerializer(TimedSerializerMixin,
+                             serializers.ModelSerializer):
     '''Сериализатор для создания рецепта.'''
     ingredients = IngredientInRecipeSerializer(many=True)
     tags = serializers.PrimaryKeyRelatedField(
         queryset=Tag.objects.all(),
         many=True
     )
-    image = Base64ImageField()
-    author = UserSerializer(read_only=True)
+    image = RecipeImageField()
+    author = AuthorSerializer(read_only=True)
 
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = Recipe
         fields = (
             'id',
@@ -292,6 +521,14 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
 
     def to_representation(self, recipe):
         '''Для поддержки сериализации, для операций чтения.'''
+        prefetch_related_objects(
+            [recipe],
+            'tags',
+            Prefetch(
+                'ingredient_list',
+                IngredientInRecipe.objects.select_related('ingredients'),
+            ),
+        )
         data = RecipeSerializer(
             recipe,
             context={'request': self.context.get('request')}
@@ -299,9 +536,10 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
         return data
 
 
-class ShopListSerializer(serializers.ModelSerializer):
+class ShopListSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Серилизатор для списка покупок."""
     class Meta:
+        list_serializer_class = TimedListSerializer
         fields = (
             'recipe', 'user'
         )
@@ -322,10 +560,11 @@ class ShopListSerializer(serializers.ModelSerializer):
         ).data
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Серилизатор для избранных рецептов."""
 
     class Meta:
+        list_serializer_class = TimedListSerializer
         fields = (
             'recipe', 'user'
         )
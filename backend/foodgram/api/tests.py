@@ -1,6 +1,62 @@
+import base64
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
 from http import HTTPStatus
+from io import BytesIO, StringIO
+from unittest import mock
 
-from django.test import Client, TestCase
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Count, Exists, OuterRef, Value
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import BaseSerializer, ListSerializer
+from rest_framework.test import APIClient
+
+from foodgram.cache import get_or_compute, get_version, jitter
+from foodgram.invalidation import InvalidationBus, bus
+from foodgram.metrics import MetricsRegistry, format_labels
+from foodgram.metrics import registry as metrics_registry
+from recipes.deletion import delete_users
+from recipes.ingredient_index import ingredient_index
+from recipes.models import (AuthorStats, Favorite, FavoriteArchive, Ingredient,
+                            IngredientInRecipe, Recipe, RecipeSnapshot,
+                            ShoppingCart, ShoppingCartArchive, SyncEvent, Tag)
+from recipes.snapshots import refresh_snapshots
+from recipes.stats import rebuild_stats
+from recipes.storage import recipe_image_storage, walk_files
+from recipes.sync import make_cursor
+from recipes.uploads import UPLOAD_DIR
+from users.follow_set import FollowSet, evict_follow_sets, get_follow_set
+from users.models import Follow, User
+from users.search import has_trigram_index
+
+from . import serializers
+from .benchmarks import (ENDPOINTS, get_client, run_endpoints,
+                         track_field_queries)
+from .parsers import FastJSONParser
+from .renderers import FastJSONRenderer
+from .serializers import (IngredientSerializer, RecipeSerializer,
+                          TagSerializer, TimedListSerializer,
+                          TimedSerializerMixin, UserSerializer)
+from .urls import urlpatterns
 
 
 class RecipeAPITestCase(TestCase):
@@ -11,3 +67,1892 @@ class RecipeAPITestCase(TestCase):
         """Проверка доступности списка задач."""
         response = self.guest_client.get('/api/recipes/')
         self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+class FoodgramDataMixin:
+    '''Небольшой набор данных: автор, пользователь и три рецепта.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@ya.ru', password='pass'
+        )
+        cls.user = User.objects.create_user(
+            username='user', email='user@ya.ru', password='pass'
+        )
+        tag = Tag.objects.create(name='Обед', color='#000000', slug='lunch')
+        cls.tag = tag
+        salt, flour, sugar, meat = Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('соль', 'мука', 'сахар', 'мясо')
+        )
+        cls.pie, cls.cake, cls.steak = (
+            Recipe.objects.create(
+                author=cls.author, name=name, text=name, cooking_time=10
+            )
+            for name in ('Пирог', 'Торт', 'Стейк')
+        )
+        for recipe, ingredients in (
+            (cls.pie, (salt, flour, sugar)),
+            (cls.cake, (flour, sugar)),
+            (cls.steak, (salt, meat)),
+        ):
+            recipe.tags.add(tag)
+            IngredientInRecipe.objects.bulk_create(
+                IngredientInRecipe(recipe=recipe, ingredients=item, amount=1)
+                for item in ingredients
+            )
+        cls.salt, cls.flour, cls.sugar, cls.meat = salt, flour, sugar, meat
+        Favorite.objects.create(user=cls.user, recipe=cls.pie)
+
+    def setUp(self):
+        # Кэш процесса переживает откат данных между тестами.
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class RecommendationsTestCase(FoodgramDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        call_command('build_recommendations', stdout=StringIO())
+
+    def test_similar_recipes_ordered_by_score(self):
+        """Похожие рецепты отдаются от самого близкого."""
+        response = self.client.get(f'/api/recipes/{self.pie.id}/similar/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            [recipe['id'] for recipe in response.json()],
+            [self.cake.id, self.steak.id],
+        )
+
+    def test_recommended_excludes_seed_recipes(self):
+        """Рекомендации строятся по избранному и не повторяют его."""
+        response = self.client.get('/api/recipes/recommended/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        ids = [recipe['id'] for recipe in response.json()]
+        self.assertEqual(ids, [self.cake.id, self.steak.id])
+
+
+class IngredientSearchTestCase(FoodgramDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        ingredient_index.invalidate()
+
+    def search(self, *ingredients):
+        ids = ','.join(str(ingredient.id) for ingredient in ingredients)
+        response = self.client.get(
+            f'/api/recipes/by_ingredients/?ingredients={ids}'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [
+            (recipe['id'], recipe['missing'])
+            for recipe in response.json()['results']
+        ]
+
+    def test_ranked_by_coverage_and_missing(self):
+        """Рецепты ранжируются по доле найденных ингредиентов."""
+        self.assertEqual(
+            self.search(self.flour, self.sugar),
+            [(self.cake.id, 0), (self.pie.id, 1)],
+        )
+
+    def test_index_updated_on_recipe_write(self):
+        """Новый рецепт попадает в индекс после коммита."""
+        self.search(self.meat)
+        with self.captureOnCommitCallbacks(execute=True):
+            stew = Recipe.objects.create(
+                author=self.author, name='Рагу', text='Рагу', cooking_time=5
+            )
+            IngredientInRecipe.objects.create(
+                recipe=stew, ingredients=self.meat, amount=1
+            )
+        self.assertEqual(
+            self.search(self.meat), [(stew.id, 0), (self.steak.id, 1)]
+        )
+
+    def test_index_updated_on_ingredients_removal(self):
+        """Рецепт без найденных ингредиентов пропадает из выдачи."""
+        self.search(self.salt)
+        with self.captureOnCommitCallbacks(execute=True):
+            IngredientInRecipe.objects.filter(
+                recipe=self.steak, ingredients=self.salt
+            ).delete()
+        self.assertEqual(self.search(self.salt), [(self.pie.id, 2)])
+
+    def test_refresh_catches_up_from_sync_log(self):
+        """Изменения в обход сигналов подхватываются обновлением."""
+        self.search(self.meat)
+        IngredientInRecipe.objects.filter(
+            recipe=self.steak, ingredients=self.meat
+        ).update(ingredients=self.flour)
+        self.assertEqual(self.search(self.meat), [(self.steak.id, 1)])
+        with CaptureQueriesContext(connection) as captured:
+            ingredient_index.refresh()
+        # Индекс не читается заново целиком.
+        self.assertFalse([
+            query for query in captured
+            if 'ORDER BY "recipes_ingredientinrecipe"' in query['sql']
+        ])
+        self.assertEqual(self.search(self.meat), [])
+
+    def test_result_pages_match_full_ranking(self):
+        """Срезы результата совпадают с частями полной выдачи."""
+        result = ingredient_index.search(
+            [self.salt.id, self.flour.id, self.sugar.id]
+        )
+        ranking = [recipe_id for recipe_id, _, _ in result[0:len(result)]]
+        self.assertEqual(
+            ranking, [self.pie.id, self.cake.id, self.steak.id]
+        )
+        self.assertEqual(
+            [recipe_id for recipe_id, _, _ in result[1:2]], ranking[1:2]
+        )
+
+
+class RecipeSnapshotTestCase(FoodgramDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Recipe.objects.filter(id=cls.pie.id).update(image='recipes/pie.png')
+
+    def get_expected(self, request):
+        recipes = Recipe.objects.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=self.user, recipe=OuterRef('id'))
+            ),
+            is_in_shopping_cart=Value(False),
+        )
+        return RecipeSerializer(
+            recipes, many=True, context={'request': request}
+        ).data
+
+    def test_snapshot_matches_recipe_serializer(self):
+        """Ответ из готовых представлений совпадает с RecipeSerializer."""
+        response = self.client.get('/api/recipes/?limit=10')
+        self.assertEqual(
+            JSONRenderer().render(response.data['results']),
+            JSONRenderer().render(self.get_expected(response.wsgi_request)),
+        )
+
+    def test_snapshot_refreshed_on_tag_change(self):
+        """Переименование тега пересобирает представления рецептов."""
+        self.client.get('/api/recipes/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.name = 'Ужин'
+            self.tag.save()
+        response = self.client.get(f'/api/recipes/{self.pie.id}/')
+        self.assertEqual(response.json()['tags'][0]['name'], 'Ужин')
+
+    def test_snapshot_refreshed_on_tag_delete(self):
+        """Удаление тега убирает его из представлений рецептов."""
+        self.client.get('/api/recipes/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.delete()
+        response = self.client.get(f'/api/recipes/{self.pie.id}/')
+        self.assertEqual(response.json()['tags'], [])
+
+    def test_snapshot_built_for_single_recipe(self):
+        """Рецепт без представления отдается и получает представление."""
+        RecipeSnapshot.objects.filter(recipe=self.pie).delete()
+        response = self.client.get(f'/api/recipes/{self.pie.id}/')
+        self.assertEqual(response.json()['name'], self.pie.name)
+        self.assertTrue(
+            RecipeSnapshot.objects.filter(recipe=self.pie).exists()
+        )
+
+
+class ConcurrentSnapshotRefreshTestCase(TransactionTestCase):
+    def test_concurrent_refresh_of_same_recipe(self):
+        """Одновременные пересборки одного рецепта не падают
+        на уникальности.
+        """
+        author = User.objects.create_user(
+            username='author', email='author@ya.ru', password='pass'
+        )
+        recipe = Recipe.objects.create(
+            author=author, name='Пирог', text='Пирог', cooking_time=10
+        )
+        errors = []
+
+        def refresh():
+            try:
+                refresh_snapshots([recipe.id])
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            refresh_snapshots([recipe.id])
+            thread = threading.Thread(target=refresh)
+            thread.start()
+            # Второй поток ждет блокировку строки первой транзакции.
+            thread.join(0.5)
+            self.assertTrue(thread.is_alive())
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(errors, [])
+        self.assertEqual(
+            RecipeSnapshot.objects.filter(recipe=recipe).count(), 1
+        )
+
+
+class ValuesSerializerTestCase(FoodgramDataMixin, TestCase):
+    def assertSameJSON(self, url, expected):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.content, JSONRenderer().render(expected))
+
+    def test_ingredients_match_model_serializer(self):
+        """Быстрый список ингредиентов совпадает побайтно."""
+        self.assertSameJSON(
+            '/api/ingredients/',
+            IngredientSerializer(Ingredient.objects.all(), many=True).data,
+        )
+
+    def test_tags_match_model_serializer(self):
+        """Быстрый список тегов совпадает побайтно."""
+        self.assertSameJSON(
+            '/api/tags/', TagSerializer(Tag.objects.all(), many=True).data
+        )
+
+    def test_user_profile_matches_model_serializer(self):
+        """Быстрый профиль пользователя совпадает побайтно."""
+        self.assertSameJSON(
+            f'/api/users/{self.author.id}/', UserSerializer(self.author).data
+        )
+
+
+class FastJSONTestCase(FoodgramDataMixin, TestCase):
+    def get_payload(self):
+        return self.client.get('/api/recipes/').data
+
+    def test_renderer_matches_json_renderer(self):
+        """Быстрый рендерер совпадает с JSONRenderer побайтно."""
+        data = self.get_payload()
+        self.assertEqual(
+            FastJSONRenderer().render(data), JSONRenderer().render(data)
+        )
+
+    def test_fallback_without_orjson(self):
+        """Без orjson рендерер и парсер работают через stdlib json."""
+        data = self.get_payload()
+        with mock.patch('api.renderers.orjson', None), \
+                mock.patch('api.parsers.orjson', None):
+            content = FastJSONRenderer().render(data)
+            parsed = FastJSONParser().parse(BytesIO(content))
+        self.assertEqual(content, JSONRenderer().render(data))
+        self.assertEqual(parsed['count'], data['count'])
+
+
+class LoadTestingToolsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(20)
+        )
+        call_command(
+            'generate_fake_data', users=30, recipes=60, seed=1,
+            stdout=StringIO(),
+        )
+
+    def test_fake_data_generated(self):
+        """Синтетические данные создаются вместе с представлениями."""
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Recipe.objects.count(), 60)
+        self.assertEqual(
+            Recipe.objects.filter(snapshot__isnull=True).count(), 0
+        )
+        self.assertTrue(Favorite.objects.exists())
+
+    def test_endpoints_benchmark(self):
+        """Все запросы нагрузочного прогона отвечают 200."""
+        results = run_endpoints(requests=2, page_size=6, warmup=0)
+        self.assertEqual(set(results), {name for name, _, _ in ENDPOINTS})
+        for name, result in results.items():
+            self.assertEqual(result['status'], HTTPStatus.OK, name)
+            self.assertGreater(result['queries'], 0, name)
+
+
+# Маршруты, для которых бюджет запросов не задается:
+# корень API и управление учетной записью через djoser.
+UNBUDGETED_ROUTES = {
+    ('api-root', 'get'),
+    ('login', 'post'),
+    ('logout', 'post'),
+    ('users-activation', 'post'),
+    ('users-resend-activation', 'post'),
+    ('users-reset-password', 'post'),
+    ('users-reset-password-confirm', 'post'),
+    ('users-reset-username', 'post'),
+    ('users-reset-username-confirm', 'post'),
+    ('users-set-password', 'post'),
+    ('users-set-username', 'post'),
+    ('users-me', 'put'),
+    ('users-me', 'patch'),
+    ('users-me', 'delete'),
+    ('users-detail', 'put'),
+    ('users-detail', 'patch'),
+    ('users-detail', 'delete'),
+}
+
+# Наибольшее допустимое число SQL-запросов: (маршрут, метод) -> бюджет.
+# Для постраничных выдач число запросов еще и не должно
+# зависеть от размера страницы.
+QUERY_BUDGETS = {
+    ('users-list', 'get'): 3,
+    ('users-list', 'post'): 6,
+    ('users-me', 'get'): 1,
+    ('users-detail', 'get'): 2,
+    ('users-stats', 'get'): 2,
+    ('users-subscriptions', 'get'): 4,
+    ('users-subscribe', 'post'): 10,
+    ('users-subscribe', 'delete'): 6,
+    ('tags-list', 'get'): 2,
+    ('tags-detail', 'get'): 2,
+    ('ingredients-list', 'get'): 2,
+    ('ingredients-detail', 'get'): 2,
+    ('recipes-list', 'get'): 4,
+    ('recipes-list', 'post'): 19,
+    ('recipes-by-ingredients', 'get'): 2,
+    ('recipes-batch', 'get'): 2,
+    ('recipes-download-shopping-cart', 'get'): 2,
+    ('recipes-recommended', 'get'): 5,
+    ('recipes-detail', 'get'): 2,
+    ('recipes-detail', 'put'): 30,
+    ('recipes-detail', 'patch'): 30,
+    ('recipes-detail', 'delete'): 19,
+    ('recipes-favorite', 'post'): 7,
+    ('recipes-favorite', 'delete'): 5,
+    ('recipes-shopping-cart', 'post'): 6,
+    ('recipes-shopping-cart', 'delete'): 3,
+    ('recipes-similar', 'get'): 4,
+    ('recipes-images', 'post'): 1,
+    ('sync-list', 'get'): 3,
+}
+
+IMAGE = (
+    'data:image/gif;base64,'
+    'R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7'
+)
+
+
+def get_image_file(name='pie.gif'):
+    '''Картинка IMAGE как загружаемый файл.'''
+    return SimpleUploadedFile(
+        name, base64.b64decode(IMAGE.split(',')[1]), 'image/gif'
+    )
+
+
+def get_routes():
+    '''Все пары (маршрут, метод) из api/urls.py.'''
+    patterns = [
+        pattern for item in urlpatterns for pattern in item.url_patterns
+    ]
+    routes = set()
+    for pattern in patterns:
+        actions = getattr(pattern.callback, 'actions', None)
+        if actions:
+            methods = actions
+        else:
+            methods = pattern.callback.view_class.http_method_names
+            methods = [
+                method for method in methods
+                if method != 'options'
+                and hasattr(pattern.callback.view_class, method)
+            ]
+        routes.update(
+            (pattern.name, method) for method in methods if method != 'head'
+        )
+    return routes
+
+
+class TemporaryDirsMixin:
+    '''Подменяет настройки из temporary_dirs временными каталогами,
+    которые удаляются после тестов класса.
+    '''
+    temporary_dirs = ()
+
+    @classmethod
+    def setUpClass(cls):
+        directories = {}
+        for name in cls.temporary_dirs:
+            directories[name] = tempfile.mkdtemp()
+            cls.addClassCleanup(shutil.rmtree, directories[name], True)
+        overridden = override_settings(**directories)
+        overridden.enable()
+        cls.addClassCleanup(overridden.disable)
+        super().setUpClass()
+
+
+class QueryBudgetTestCase(TemporaryDirsMixin, TestCase):
+    '''Число SQL-запросов каждого маршрута API.
+    Если задан QUERY_BUDGET_REPORT, по окончании в этот файл
+    пишутся число запросов, время ответа и запросы по полям.
+    '''
+    temporary_dirs = ('MEDIA_ROOT', 'SHOPPING_CART_CACHE_DIR')
+
+    report = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(20)
+        )
+        call_command(
+            'generate_fake_data', users=60, recipes=120, authors_share=1,
+            follows_per_user=55, favorites_per_user=60, carts_per_user=60,
+            seed=1, stdout=StringIO(),
+        )
+        call_command('build_recommendations', stdout=StringIO())
+        cls.user = (
+            User
+            .objects
+            .annotate(follows=Count('follower'))
+            .order_by('-follows', 'id')
+            .first()
+        )
+        cls.author = Follow.objects.filter(user=cls.user).first().author
+        cls.recipe = Recipe.objects.filter(author=cls.user).first()
+        cls.other_recipe = (
+            Recipe
+            .objects
+            .exclude(author=cls.user)
+            .exclude(favorite_users__user=cls.user)
+            .exclude(shopping_cart_users__user=cls.user)
+            .first()
+        )
+        cls.tags = list(Tag.objects.values_list('id', flat=True))
+        cls.ingredients = list(
+            Ingredient.objects.values_list('id', flat=True)[:10]
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        path = os.environ.get('QUERY_BUDGET_REPORT')
+        if path:
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump(cls.report, file, ensure_ascii=False, indent=2)
+
+    def setUp(self):
+        ingredient_index.invalidate()
+        self.client = get_client(self.user)
+
+    def recipe_data(self, name):
+        return {
+            'ingredients': [
+                {'id': ingredient_id, 'amount': 10}
+                for ingredient_id in self.ingredients
+            ],
+            'tags': self.tags,
+            'image': IMAGE,
+            'name': name,
+            'text': name,
+            'cooking_time': 15,
+        }
+
+    def request(self, route, method, kwargs=None, data=None, limit=None,
+                multipart=False):
+        '''Выполняет запрос, проверяет бюджет и пишет замер в отчет.'''
+        url = reverse(f'api:{route}', kwargs=kwargs)
+        if method == 'get':
+            data = dict(data or {})
+            if limit:
+                data['limit'] = limit
+            send = lambda: self.client.get(url, data)  # noqa: E731
+        elif multipart:
+            send = lambda: getattr(self.client, method)(  # noqa: E731
+                url, data, format='multipart'
+            )
+        else:
+            send = lambda: getattr(self.client, method)(  # noqa: E731
+                url, json.dumps(data or {}), content_type='application/json'
+            )
+        # Отложенные до коммита пересчеты тоже входят в бюджет запроса.
+        with CaptureQueriesContext(connection) as captured, \
+                track_field_queries() as field_queries:
+            start = time.perf_counter()
+            with self.captureOnCommitCallbacks(execute=True):
+                response = send()
+            elapsed = (time.perf_counter() - start) * 1000
+        self.assertLess(
+            response.status_code, 400, f'{method} {url}: {response.getvalue()}'
+        )
+        budget = QUERY_BUDGETS[route, method]
+        key = f'{route} {method}' + (f' limit={limit}' if limit else '')
+        self.report[key] = {
+            'queries': len(captured),
+            'budget': budget,
+            'ms': round(elapsed, 3),
+            'fields': dict(field_queries),
+        }
+        self.assertLessEqual(
+            len(captured),
+            budget,
+            f'{method.upper()} {url}: запросов {len(captured)} > {budget}, '
+            f'по полям: {dict(field_queries)}\n'
+            + '\n'.join(query['sql'] for query in captured),
+        )
+        return len(captured)
+
+    def assertPageBudget(self, route, kwargs=None, data=None):
+        '''Число запросов страницы не растет с ее размером.
+        Первый запрос прогревает кэши и в замер не входит.
+        '''
+        self.client.get(reverse(f'api:{route}', kwargs=kwargs), data)
+        small = self.request(route, 'get', kwargs, data, limit=1)
+        large = self.request(route, 'get', kwargs, data, limit=50)
+        self.assertEqual(small, large, f'{route}: {small} -> {large}')
+
+    def test_every_route_has_budget(self):
+        """У каждого маршрута API есть бюджет запросов или исключение."""
+        routes = get_routes()
+        self.assertEqual(routes - UNBUDGETED_ROUTES, set(QUERY_BUDGETS))
+
+    def test_read_routes(self):
+        """Чтение укладывается в бюджет при любом размере страницы."""
+        self.assertPageBudget('users-list')
+        self.assertPageBudget('users-list', data={'cursor': ''})
+        self.assertPageBudget('users-list', data={'search': 'fake_1'})
+        self.assertPageBudget('users-subscriptions', data={'recipes_limit': 3})
+        self.assertPageBudget('recipes-list')
+        self.assertPageBudget('recipes-list', data={'is_favorited': 1})
+        self.assertPageBudget('recipes-list', data={
+            'fields': 'id,name,image,cooking_time,tags', 'expand': 'tags',
+        })
+        self.assertPageBudget(
+            'recipes-by-ingredients',
+            data={'ingredients': ','.join(map(str, self.ingredients))},
+        )
+        self.request('users-me', 'get')
+        self.request('users-detail', 'get', {'id': self.author.id})
+        self.request('users-stats', 'get', {'id': self.author.id})
+        self.request('tags-list', 'get')
+        self.request('tags-detail', 'get', {'pk': self.tags[0]})
+        self.request('ingredients-list', 'get')
+        self.request('ingredients-detail', 'get', {'pk': self.ingredients[0]})
+        self.request('recipes-detail', 'get', {'pk': self.recipe.id})
+        self.request('recipes-similar', 'get', {'pk': self.recipe.id})
+        ids = Recipe.objects.values_list('id', flat=True)
+        self.assertEqual(
+            self.request('recipes-batch', 'get', data={'ids': ids[0]}),
+            self.request(
+                'recipes-batch', 'get',
+                data={'ids': ','.join(map(str, ids[:100]))},
+            ),
+        )
+        self.request('recipes-recommended', 'get')
+        # Повторная выдача неизмененного списка берет готовый файл.
+        self.client.get(reverse('api:recipes-download-shopping-cart'))
+        self.request('recipes-download-shopping-cart', 'get')
+        cursor = self.client.get(reverse('api:sync-list')).json()['cursor']
+        self.request('sync-list', 'get')
+        self.request('sync-list', 'get', data={'since': cursor})
+
+    def test_write_routes(self):
+        """Запись укладывается в бюджет."""
+        self.request('users-list', 'post', data={
+            'email': 'new@ya.ru',
+            'username': 'new',
+            'first_name': 'Новый',
+            'last_name': 'Пользователь',
+            'password': 'Very-Strong-Pass-1',
+        })
+        self.request('recipes-list', 'post', data=self.recipe_data('Новый'))
+        self.request(
+            'recipes-images', 'post', data={'image': get_image_file()},
+            multipart=True,
+        )
+        self.request(
+            'recipes-detail', 'put', {'pk': self.recipe.id},
+            self.recipe_data('Обновленный'),
+        )
+        self.request(
+            'recipes-detail', 'patch', {'pk': self.recipe.id},
+            self.recipe_data('Исправленный'),
+        )
+        self.request('recipes-detail', 'delete', {'pk': self.recipe.id})
+        kwargs = {'pk': self.other_recipe.id}
+        for route in ('recipes-favorite', 'recipes-shopping-cart'):
+            self.request(route, 'post', kwargs)
+            self.request(route, 'delete', kwargs)
+        self.request('users-subscribe', 'delete', {'id': self.author.id})
+        self.request('users-subscribe', 'post', {'id': self.author.id})
+
+
+class PerformanceMiddlewareTestCase(FoodgramDataMixin, TestCase):
+    def setUp(self):
+        User.objects.filter(id=self.author.id).update(is_staff=True)
+        self.client = get_client(self.author)
+
+    def get_timings(self, response):
+        return {
+            name: params
+            for name, *params in (
+                item.strip().split(';')
+                for item in response['Server-Timing'].split(',')
+            )
+        }
+
+    def test_server_timing_phases(self):
+        """Ответ содержит время фаз и число SQL-запросов."""
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/api/recipes/')
+        timings = self.get_timings(response)
+        self.assertEqual(
+            set(timings),
+            {'auth', 'serialize', 'render', 'db', 'app', 'total'},
+        )
+        self.assertEqual(
+            timings['db'][1], f'desc="{len(captured)} queries"'
+        )
+
+    def test_timed_serializers_time_lists(self):
+        """Списки many=True замеряемых сериализаторов тоже замеряются."""
+        for serializer_class in vars(serializers).values():
+            if (
+                isinstance(serializer_class, type)
+                and issubclass(serializer_class, TimedSerializerMixin)
+                and issubclass(serializer_class, BaseSerializer)
+                and not issubclass(serializer_class, ListSerializer)
+            ):
+                with self.subTest(serializer_class.__name__):
+                    self.assertIsInstance(
+                        serializer_class(many=True), TimedListSerializer
+                    )
+
+    def test_server_timing_only_for_staff(self):
+        """Server-Timing не отдается обычным пользователям и анонимам."""
+        for client in (get_client(self.user), get_client()):
+            response = client.get('/api/recipes/')
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertNotIn('Server-Timing', response)
+
+    @override_settings(PERFORMANCE_SLOW_REQUEST_MS=0)
+    def test_slow_request_logged_with_sql(self):
+        """Медленный запрос пишется в лог вместе с SQL."""
+        with self.assertLogs('foodgram.performance', 'WARNING') as logs:
+            self.client.get(f'/api/recipes/{self.pie.id}/')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'api:recipes-detail')
+        self.assertEqual(len(record['sql']), record['queries'])
+        self.assertIn('authtoken_token', record['sql'][0]['sql'])
+
+
+class MetricsTestCase(FoodgramDataMixin, TestCase):
+    def setUp(self):
+        self.client = get_client(self.user)
+
+    def test_metrics_exposition(self):
+        """Метрики считают запросы, аутентификацию и кэши."""
+        self.client.get('/api/recipes/')
+        self.client.get(f'/api/recipes/{self.pie.id}/')
+        content = self.client.get('/metrics').content.decode()
+        self.assertIn(
+            'foodgram_http_requests_total{method="GET",status="200",'
+            'view="api:recipes-list"}',
+            content,
+        )
+        self.assertIn(
+            'foodgram_http_request_duration_seconds_bucket'
+            '{view="api:recipes-detail",le="+Inf"}',
+            content,
+        )
+        self.assertIn('foodgram_auth_requests_total{result="token"}', content)
+        self.assertIn(
+            'foodgram_cache_hit_ratio{cache="recipe_snapshot"}', content
+        )
+
+    def test_metrics_aggregated_across_processes(self):
+        """Значения других воркеров берутся из METRICS_DIR."""
+        key = format_labels({'cache': 'ingredient_index', 'result': 'miss'})
+        own = metrics_registry.collect()['foodgram_cache_requests_total']
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(METRICS_DIR=directory):
+            worker = MetricsRegistry()
+            worker.inc('foodgram_cache_requests_total', 3,
+                       cache='ingredient_index', result='miss')
+            totals = metrics_registry.collect()
+        self.assertEqual(
+            totals['foodgram_cache_requests_total'][key], own[key] + 3
+        )
+
+    def test_dead_process_metrics_archived(self):
+        """Значения завершившегося воркера переносятся в архив."""
+        key = format_labels({'cache': 'ingredient_index', 'result': 'miss'})
+        own = metrics_registry.collect()['foodgram_cache_requests_total']
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(METRICS_DIR=directory):
+            worker = MetricsRegistry()
+            worker.inc('foodgram_cache_requests_total', 3,
+                       cache='ingredient_index', result='miss')
+            dead_path = os.path.join(
+                directory, f'metrics_{process.pid}_0.json'
+            )
+            os.replace(worker.get_path(), dead_path)
+            for _ in range(2):
+                totals = metrics_registry.collect()
+                self.assertEqual(
+                    totals['foodgram_cache_requests_total'][key],
+                    own[key] + 3,
+                )
+            self.assertFalse(os.path.exists(dead_path))
+
+    def test_snapshot_lookups_counted_once(self):
+        """Каждый рецепт списка учитывается в кэше представлений раз."""
+        def count_lookups():
+            series = metrics_registry.collect()[
+                'foodgram_cache_requests_total'
+            ]
+            return sum(
+                series.get(
+                    format_labels({'cache': 'recipe_snapshot', 'result': r}),
+                    0,
+                )
+                for r in ('hit', 'miss')
+            )
+
+        before = count_lookups()
+        self.client.get('/api/recipes/?limit=10')
+        self.assertEqual(count_lookups() - before, 3)
+
+
+class IndexUsageTestCase(TestCase):
+    '''Основные запросы на сгенерированных данных идут по индексам.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(50)
+        )
+        call_command(
+            'generate_fake_data', users=50, recipes=500, authors_share=1,
+            seed=1, skip_snapshots=True, stdout=StringIO(),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.user = User.objects.first()
+        cls.recipe = Recipe.objects.first()
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertRegex(plan, rf'(using|on) {index}\b', plan)
+        self.assertNotIn('Seq Scan', plan)
+
+    def test_recipe_list_ordered_by_index(self):
+        """Лента рецептов и страница автора читаются по индексу."""
+        self.assertUsesIndex(Recipe.objects.all()[:6], 'recipe_pub_date_idx')
+        self.assertUsesIndex(
+            Recipe.objects.filter(author=self.recipe.author_id)[:6],
+            'recipe_author_pub_date_idx',
+        )
+
+    def test_user_prefix_search(self):
+        """Поиск пользователя по началу имени идет по индексам."""
+        for field in ('username', 'first_name', 'last_name'):
+            self.assertUsesIndex(
+                User.objects.filter(**{f'{field}__istartswith': 'fake'}),
+                f'user_{field}_upper_idx',
+            )
+
+    def test_ingredient_prefix_search(self):
+        """Поиск ингредиента по началу названия идет по индексу."""
+        self.assertUsesIndex(
+            Ingredient.objects.filter(name__istartswith='ингр'),
+            'ingredient_name_upper_idx',
+        )
+
+    def test_user_and_recipe_lookups(self):
+        """Выборки по пользователю и по рецепту идут по индексам."""
+        for model, by_user, by_recipe in (
+            (Favorite, 'unique_favorite', 'favorite_recipe_user_idx'),
+            (ShoppingCart, 'unique_shopping_cart',
+             'shopping_cart_recipe_user_idx'),
+        ):
+            self.assertUsesIndex(
+                model.objects.filter(user=self.user).values('recipe'), by_user
+            )
+            self.assertUsesIndex(
+                model.objects.filter(recipe=self.recipe).values('user'),
+                by_recipe,
+            )
+        self.assertUsesIndex(
+            Follow.objects.filter(user=self.user).values('author'),
+            'unique_follow',
+        )
+
+
+class ArchiveTestCase(FoodgramDataMixin, TestCase):
+    def test_stale_carts_and_inactive_users_archived(self):
+        """Старые записи списка покупок и данные неактивных
+        пользователей переносятся в архив пачками.
+        """
+        stale = ShoppingCart.objects.create(user=self.user, recipe=self.pie)
+        ShoppingCart.objects.filter(id=stale.id).update(
+            added=timezone.now() - timedelta(days=100)
+        )
+        ShoppingCart.objects.create(user=self.user, recipe=self.cake)
+        inactive = User.objects.create_user(
+            username='gone', email='gone@ya.ru', password='pass',
+            is_active=False,
+        )
+        Favorite.objects.create(user=inactive, recipe=self.pie)
+        Favorite.objects.create(user=inactive, recipe=self.cake)
+        ShoppingCart.objects.create(user=inactive, recipe=self.steak)
+
+        call_command(
+            'archive_stale_rows', retention_days=90, batch_size=1, sleep=0,
+            stdout=StringIO(),
+        )
+        self.assertEqual(
+            list(ShoppingCart.objects.values_list('recipe', flat=True)),
+            [self.cake.id],
+        )
+        self.assertEqual(
+            list(Favorite.objects.values_list('user', flat=True)),
+            [self.user.id],
+        )
+        archived = ShoppingCartArchive.objects.get(original_id=stale.id)
+        self.assertEqual(
+            (archived.user_id, archived.recipe_id, archived.reason),
+            (self.user.id, self.pie.id, 'stale'),
+        )
+        self.assertEqual(ShoppingCartArchive.objects.count(), 2)
+        self.assertEqual(
+            FavoriteArchive.objects.filter(
+                user_id=inactive.id, reason='inactive_user'
+            ).count(),
+            2,
+        )
+
+
+class BatchDeletionTestCase(FoodgramDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Follow.objects.create(user=cls.user, author=cls.author)
+        Follow.objects.create(user=cls.author, author=cls.user)
+        ShoppingCart.objects.create(user=cls.user, recipe=cls.cake)
+
+    def test_author_deleted_in_batches(self):
+        """Автор удаляется вместе со всеми записями, рецепты - по одному."""
+        with CaptureQueriesContext(connection) as captured, \
+                self.captureOnCommitCallbacks(execute=True):
+            deleted = delete_users(
+                User.objects.filter(id=self.author.id), batch_size=1
+            )
+        self.assertEqual(deleted['recipes.Recipe'], 3)
+        self.assertEqual(deleted['users.Follow'], 2)
+        self.assertEqual(
+            sum(
+                query['sql'].startswith('DELETE FROM "recipes_recipe" ')
+                for query in captured
+            ),
+            3,
+        )
+        self.assertFalse(Recipe.objects.exists())
+        self.assertFalse(Favorite.objects.exists())
+        self.assertFalse(ShoppingCart.objects.exists())
+        self.assertTrue(User.objects.filter(id=self.user.id).exists())
+        self.assertEqual(len(ingredient_index.search([self.salt.id])), 0)
+
+    def test_admin_delete_selected(self):
+        """Действие админки показывает сводку и удаляет пачками."""
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@ya.ru', password='pass'
+        )
+        client = Client()
+        client.force_login(admin)
+        data = {
+            'action': 'delete_selected',
+            '_selected_action': [self.pie.id, self.cake.id],
+        }
+        response = client.post('/admin/recipes/recipe/', data)
+        self.assertContains(response, 'Рецепт: Пирог')
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post('/admin/recipes/recipe/', {**data, 'post': 'yes'})
+        self.assertEqual(
+            list(Recipe.objects.values_list('id', flat=True)),
+            [self.steak.id],
+        )
+
+    def test_admin_delete_view(self):
+        """Страница удаления удаляет объект пачками после коммита."""
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@ya.ru', password='pass'
+        )
+        client = Client()
+        client.force_login(admin)
+        url = f'/admin/users/user/{self.author.id}/delete/'
+        self.assertContains(client.get(url), self.author.username)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = client.post(url, {'post': 'yes'})
+        self.assertRedirects(response, '/admin/users/user/')
+        self.assertTrue(User.objects.filter(id=self.author.id).exists())
+        for callback in callbacks:
+            callback()
+        self.assertFalse(User.objects.filter(id=self.author.id).exists())
+        self.assertFalse(Recipe.objects.exists())
+
+
+class AdminTestCase(FoodgramDataMixin, TestCase):
+    CHANGELISTS = (
+        '/admin/recipes/recipe/',
+        '/admin/recipes/favorite/',
+        '/admin/recipes/shoppingcart/',
+        '/admin/recipes/ingredientinrecipe/',
+        '/admin/users/user/',
+        '/admin/users/follow/',
+    )
+
+    def setUp(self):
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@ya.ru', password='pass'
+        )
+        self.client = Client()
+        self.client.force_login(admin)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK, url)
+        return len(captured)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        """Число запросов списков админки не зависит от числа строк."""
+        before = {url: self.count_queries(url) for url in self.CHANGELISTS}
+        users = [
+            User.objects.create_user(
+                username=f'reader{i}', email=f'reader{i}@ya.ru'
+            )
+            for i in range(5)
+        ]
+        for user in users:
+            recipe = Recipe.objects.create(
+                author=user, name=user.username, text='-', cooking_time=5
+            )
+            IngredientInRecipe.objects.create(
+                recipe=recipe, ingredients=self.salt, amount=1
+            )
+            Favorite.objects.create(user=user, recipe=self.pie)
+            ShoppingCart.objects.create(user=user, recipe=recipe)
+            Follow.objects.create(user=user, author=self.author)
+        after = {url: self.count_queries(url) for url in self.CHANGELISTS}
+        self.assertEqual(after, before)
+
+    def test_recipe_favorites_count_column(self):
+        """В списке рецептов выводится число добавлений в избранное."""
+        response = self.client.get('/admin/recipes/recipe/')
+        self.assertContains(response, '<td class="field-favorites_count">1')
+
+    def test_recipe_form_does_not_list_all_ingredients(self):
+        """Ингредиенты в форме рецепта выбираются через автодополнение."""
+        response = self.client.get(
+            f'/admin/recipes/recipe/{self.cake.id}/change/'
+        )
+        self.assertContains(response, self.flour.name)
+        self.assertNotContains(response, self.meat.name)
+
+
+class AuthorStatsTestCase(FoodgramDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Recipe.objects.update(image='recipes/pie.png')
+
+    def get_stats(self, user):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(f'/api/users/{user.id}/stats/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertFalse(
+            [query for query in captured if 'COUNT(' in query['sql']]
+        )
+        return response.json()
+
+    def assertStatsRebuilt(self):
+        '''Счетчики после записей совпадают с полным пересчетом.'''
+        current = list(AuthorStats.objects.order_by('author').values())
+        rebuild_stats()
+        rebuilt = list(AuthorStats.objects.order_by('author').values())
+        self.assertEqual(current, rebuilt)
+
+    def test_stats_updated_on_writes(self):
+        """Счетчики автора обновляются записями без пересчета."""
+        rebuild_stats()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/recipes/{self.cake.id}/favorite/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(
+            self.get_stats(self.author),
+            {'recipes_count': 3, 'followers_count': 1, 'favorites_count': 2},
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pie.delete()
+        self.assertEqual(
+            self.get_stats(self.author),
+            {'recipes_count': 2, 'followers_count': 1, 'favorites_count': 1},
+        )
+        self.assertStatsRebuilt()
+
+    def test_stats_kept_after_nested_rollback(self):
+        """Откат вложенного atomic не теряет изменения транзакции."""
+        rebuild_stats()
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.user, recipe=self.cake)
+            try:
+                with transaction.atomic():
+                    Favorite.objects.create(
+                        user=self.author, recipe=self.steak
+                    )
+                    raise ValueError
+            except ValueError:
+                pass
+            Favorite.objects.create(user=self.author, recipe=self.cake)
+        self.assertEqual(self.get_stats(self.author)['favorites_count'], 3)
+        self.assertStatsRebuilt()
+
+    def test_stats_inline(self):
+        """Счетчики есть в профиле, списке пользователей и подписках."""
+        rebuild_stats()
+        Follow.objects.create(user=self.user, author=self.author)
+        expected = {
+            'recipes_count': 3, 'followers_count': 0, 'favorites_count': 1,
+        }
+        profile = self.client.get(f'/api/users/{self.author.id}/').json()
+        self.assertEqual(profile['stats'], expected)
+        users = self.client.get('/api/users/').json()['results']
+        self.assertEqual(
+            {user['id']: user['stats'] for user in users}[self.author.id],
+            expected,
+        )
+        subscriptions = self.client.get('/api/users/subscriptions/').json()
+        self.assertEqual(subscriptions['results'][0]['stats'], expected)
+        self.assertEqual(subscriptions['results'][0]['recipes_count'], 3)
+
+    def test_stats_after_archive(self):
+        """Архивирование избранного вычитается из счетчиков."""
+        rebuild_stats()
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        call_command('archive_stale_rows', sleep=0, stdout=StringIO())
+        self.assertEqual(self.author.stats.favorites_count, 0)
+        self.assertStatsRebuilt()
+
+
+class FollowSetTestCase(FoodgramDataMixin, TestCase):
+    URLS = (
+        '/api/users/',
+        '/api/users/{author}/',
+        '/api/recipes/',
+        '/api/recipes/{pie}/',
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Recipe.objects.update(image='recipes/pie.png')
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def get_flags(self):
+        '''Признак подписки на автора во всех ответах, где он есть.'''
+        flags = []
+        for url in self.URLS:
+            data = self.client.get(
+                url.format(author=self.author.id, pie=self.pie.id)
+            ).json()
+            for item in data.get('results', [data]):
+                if 'author' in item:
+                    flags.append(item['author']['is_subscribed'])
+                elif item['id'] == self.author.id:
+                    flags.append(item['is_subscribed'])
+        return set(flags)
+
+    def test_subscription_invalidates_cache(self):
+        """Подписка и отписка сразу видны во всех ответах."""
+        self.assertEqual(self.get_flags(), {False})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(self.get_flags(), {True})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(self.get_flags(), {False})
+
+    def test_eviction_during_read_not_overwritten(self):
+        """Сброс между чтением из базы и записью в кэш не теряется."""
+        def follow_and_evict(author_ids):
+            follow_set = FollowSet(author_ids)
+            Follow.objects.create(user=self.user, author=self.author)
+            evict_follow_sets([self.user.id])
+            return follow_set
+
+        with mock.patch(
+            'users.follow_set.FollowSet', side_effect=follow_and_evict
+        ):
+            self.assertNotIn(self.author.id, get_follow_set(self.user))
+        self.assertIn(self.author.id, get_follow_set(self.user))
+
+    def test_follow_set_cached(self):
+        """Подписки читаются из базы один раз, а не на каждый ответ."""
+        self.get_flags()
+        with CaptureQueriesContext(connection) as captured:
+            self.get_flags()
+        self.assertFalse(
+            [query for query in captured if 'users_follow' in query['sql']]
+        )
+
+
+class UserDirectoryTestCase(FoodgramDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        User.objects.bulk_create(
+            User(
+                username=f'cook_{i}', email=f'cook_{i}@ya.ru',
+                first_name='Ivan' if i % 2 else 'Petr', last_name='Povarov',
+            )
+            for i in range(7)
+        )
+
+    def search(self, text):
+        response = self.client.get('/api/users/', {'search': text})
+        return {user['username'] for user in response.json()['results']}
+
+    def test_prefix_search(self):
+        """Поиск по началу имени пользователя, имени и фамилии."""
+        self.assertEqual(self.search('AUTH'), {'author'})
+        self.assertEqual(
+            self.search('iva'), {'cook_1', 'cook_3', 'cook_5'}
+        )
+        self.assertEqual(len(self.search('povarOV')), 5)
+        self.assertEqual(self.search('%'), set())
+
+    def test_trigram_search(self):
+        """С pg_trgm находятся и похожие имена пользователей."""
+        if not has_trigram_index():
+            self.skipTest('pg_trgm не установлен')
+        self.assertIn('author', self.search('athor'))
+
+    def test_keyset_pagination(self):
+        """Список по cursor проходится целиком без OFFSET и COUNT."""
+        usernames = []
+        url = '/api/users/?limit=3&cursor='
+        with CaptureQueriesContext(connection) as captured:
+            while url:
+                data = self.client.get(url).json()
+                self.assertNotIn('count', data)
+                usernames.extend(user['username'] for user in data['results'])
+                url = data['next']
+        self.assertEqual(
+            usernames,
+            list(User.objects.order_by('username').values_list(
+                'username', flat=True
+            )),
+        )
+        for query in captured:
+            self.assertNotIn('OFFSET', query['sql'])
+            self.assertNotIn('COUNT(', query['sql'])
+
+
+class SparseFieldsTestCase(FoodgramDataMixin, TestCase):
+    CARD = {'fields': 'id,name,image,cooking_time,tags', 'expand': 'tags'}
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Recipe.objects.update(image='recipes/pie.png')
+
+    def test_expanded_fields_match_full_representation(self):
+        """Все поля с развернутыми связями совпадают с полным ответом."""
+        full = self.client.get('/api/recipes/')
+        sparse = self.client.get(
+            '/api/recipes/', {'expand': 'tags,author,ingredients'}
+        )
+        self.assertEqual(sparse.content, full.content)
+
+    def test_card_fields(self):
+        """Карточка не читает описание и ингредиенты."""
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/api/recipes/', self.CARD)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        recipe = response.json()['results'][0]
+        self.assertEqual(
+            list(recipe), ['id', 'tags', 'name', 'image', 'cooking_time']
+        )
+        self.assertEqual(recipe['tags'][0]['slug'], 'lunch')
+        sql = '\n'.join(query['sql'] for query in captured)
+        self.assertNotIn('"recipes_recipe"."text"', sql)
+        self.assertNotIn('recipes_ingredient', sql)
+        self.assertNotIn('recipes_favorite', sql)
+
+    def test_collapsed_relations(self):
+        """Связи не из expand отдаются как id."""
+        response = self.client.get(
+            f'/api/recipes/{self.pie.id}/',
+            {'fields': 'author,tags,ingredients'},
+        )
+        self.assertEqual(response.json(), {
+            'tags': [self.tag.id],
+            'author': self.author.id,
+            'ingredients': sorted(
+                [self.salt.id, self.flour.id, self.sugar.id],
+                key=lambda pk: Ingredient.objects.get(pk=pk).name,
+            ),
+        })
+
+    def test_unknown_field(self):
+        """Неизвестное поле - ошибка 400."""
+        response = self.client.get('/api/recipes/', {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+
+class RecipeBatchTestCase(FoodgramDataMixin, TestCase):
+    def get_ids(self, ids, **params):
+        response = self.client.get(
+            '/api/recipes/batch/',
+            {'ids': ','.join(map(str, ids)), **params},
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response.json()
+
+    def test_requested_order(self):
+        """Рецепты отдаются в порядке запроса, без повторов и пропусков."""
+        ids = [self.steak.id, 0, self.pie.id, self.steak.id, self.cake.id]
+        recipes = self.get_ids(ids)
+        self.assertEqual(
+            [recipe['id'] for recipe in recipes],
+            [self.steak.id, self.pie.id, self.cake.id],
+        )
+        self.assertTrue(recipes[1]['is_favorited'])
+        self.assertEqual(
+            recipes[1],
+            self.client.get(f'/api/recipes/{self.pie.id}/').json(),
+        )
+
+    def test_sparse_fields(self):
+        """Пакетный запрос понимает fields и expand."""
+        recipes = self.get_ids([self.cake.id], fields='id,name,author')
+        self.assertEqual(
+            recipes, [{'id': self.cake.id, 'name': 'Торт',
+                       'author': self.author.id}]
+        )
+
+    @override_settings(RECIPES_BATCH_MAX_SIZE=2)
+    def test_batch_size_limit(self):
+        """Слишком большой пакет и нечисловые id - ошибка 400."""
+        for ids in ('1,2,3', '1,x'):
+            response = self.client.get('/api/recipes/batch/', {'ids': ids})
+            self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+
+class SyncTestCase(FoodgramDataMixin, TestCase):
+    def sync(self, since=None, status=HTTPStatus.OK):
+        response = self.client.get(
+            '/api/sync/', {} if since is None else {'since': since}
+        )
+        self.assertEqual(response.status_code, status)
+        return response.json()
+
+    def get_next_cursor(self):
+        '''Курсор, после которого изменений текущей транзакции нет.'''
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT txid_current()')
+            return make_cursor(cursor.fetchone()[0] + 1, timezone.now())
+
+    def test_full_state(self):
+        """Без курсора отдается полный состав личных списков."""
+        data = self.sync()
+        self.assertIn('cursor', data)
+        self.assertEqual(data['favorites'], {
+            'changed': [self.pie.id], 'deleted': [],
+        })
+        self.assertEqual(data['recipes'], {'changed': [], 'deleted': []})
+
+    def test_changes_since_cursor(self):
+        """Отдаются только изменения после курсора, последнее по объекту."""
+        self.assertEqual(
+            self.sync(self.get_next_cursor())['favorites'],
+            {'changed': [], 'deleted': []},
+        )
+        since = self.sync()['cursor']
+        self.client.delete(f'/api/recipes/{self.pie.id}/favorite/')
+        self.client.post(f'/api/recipes/{self.cake.id}/shopping_cart/')
+        Follow.objects.create(user=self.user, author=self.author)
+        Favorite.objects.create(user=self.author, recipe=self.cake)
+        steak_id = self.steak.id
+        self.steak.delete()
+        data = self.sync(since)
+        self.assertEqual(data['favorites'], {
+            'changed': [], 'deleted': [self.pie.id],
+        })
+        self.assertEqual(data['shopping_cart']['changed'], [self.cake.id])
+        self.assertEqual(data['subscriptions']['changed'], [self.author.id])
+        self.assertEqual(data['recipes']['deleted'], [steak_id])
+        self.assertNotIn(steak_id, data['recipes']['changed'])
+
+    def test_recipe_update_logged(self):
+        """Изменение рецепта попадает в журнал и обновляет updated."""
+        events = SyncEvent.objects.filter(
+            kind=SyncEvent.KIND_RECIPE, object_id=self.cake.id, deleted=False
+        )
+        count, updated = events.count(), self.cake.updated
+        self.cake.save()
+        self.cake.refresh_from_db()
+        self.assertGreater(self.cake.updated, updated)
+        self.assertEqual(events.count(), count + 1)
+        self.client.logout()
+        data = self.sync(self.sync()['cursor'])
+        self.assertIn(self.cake.id, data['recipes']['changed'])
+        self.assertEqual(data['favorites']['deleted'], [])
+        self.assertEqual(data['favorites']['changed'], [])
+
+    def test_invalid_cursor(self):
+        """Неверный курсор - 400, устаревший - 410."""
+        self.sync('abc', HTTPStatus.BAD_REQUEST)
+        self.sync('1-99999999999999', HTTPStatus.BAD_REQUEST)
+        expired = make_cursor(1, timezone.now() - timedelta(days=365))
+        self.sync(expired, HTTPStatus.GONE)
+
+    def test_prune_sync_events(self):
+        """Старые записи журнала удаляются командой."""
+        SyncEvent.objects.filter(kind=SyncEvent.KIND_RECIPE).update(
+            created=timezone.now() - timedelta(days=365)
+        )
+        kept = SyncEvent.objects.exclude(kind=SyncEvent.KIND_RECIPE).count()
+        call_command('prune_sync_events', batch_size=1, stdout=StringIO())
+        self.assertEqual(SyncEvent.objects.count(), kept)
+
+
+class ImageUploadTestCase(TemporaryDirsMixin, FoodgramDataMixin, TestCase):
+    temporary_dirs = ('MEDIA_ROOT',)
+
+    def upload(self, image, status=HTTPStatus.CREATED):
+        response = self.client.post(
+            '/api/recipes/images/', {'image': image}, format='multipart'
+        )
+        self.assertEqual(response.status_code, status, response.content)
+        return response.json()
+
+    def create_recipe(self, image):
+        return self.client.post('/api/recipes/', {
+            'ingredients': [{'id': self.salt.id, 'amount': 1}],
+            'tags': [self.tag.id],
+            'image': image,
+            'name': 'Суп',
+            'text': 'Суп',
+            'cooking_time': 5,
+        }, format='json')
+
+    def test_recipe_created_with_upload_token(self):
+        """Токен загрузки принимается вместо base64 в поле image."""
+        token = self.upload(get_image_file())['image']
+        response = self.create_recipe(token)
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        image = Recipe.objects.get(id=response.json()['id']).image
+        self.assertTrue(image.name.startswith('recipes/'))
+        self.assertEqual(image.read(), get_image_file().read())
+
+    def test_base64_still_accepted(self):
+        """Старый путь с base64 в JSON продолжает работать."""
+        self.assertEqual(
+            self.create_recipe(IMAGE).status_code, HTTPStatus.CREATED
+        )
+
+    def test_foreign_or_forged_token_rejected(self):
+        """Чужой или подделанный токен - ошибка 400."""
+        token = self.upload(get_image_file())['image']
+        for image in (token + 'x', 'upload:abc'):
+            self.assertEqual(
+                self.create_recipe(image).status_code, HTTPStatus.BAD_REQUEST
+            )
+        self.client.force_authenticate(self.author)
+        self.assertEqual(
+            self.create_recipe(token).status_code, HTTPStatus.BAD_REQUEST
+        )
+
+    def test_not_an_image_rejected(self):
+        """Файл, который не является картинкой, не сохраняется."""
+        self.upload(
+            SimpleUploadedFile('pie.gif', b'not an image'),
+            HTTPStatus.BAD_REQUEST,
+        )
+
+    @override_settings(IMAGE_UPLOAD_MAX_SIZE=20)
+    def test_size_limit(self):
+        """Превышение размера обрывает загрузку с ошибкой 413:
+        по заголовку Content-Length или при чтении тела.
+        """
+        self.upload(get_image_file(), HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        large = SimpleUploadedFile('pie.gif', b'0' * 1024 * 1024)
+        self.upload(large, HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+
+    def test_prune_image_uploads(self):
+        """Устаревшие загрузки удаляются командой."""
+        self.upload(get_image_file())
+        call_command('prune_image_uploads', stdout=StringIO())
+        self.assertTrue(default_storage.listdir(UPLOAD_DIR)[1])
+        with override_settings(IMAGE_UPLOAD_TOKEN_MAX_AGE=-60):
+            call_command('prune_image_uploads', stdout=StringIO())
+        self.assertEqual(default_storage.listdir(UPLOAD_DIR)[1], [])
+
+
+class ContentAddressedStorageTestCase(TemporaryDirsMixin, FoodgramDataMixin,
+                                      TestCase):
+    temporary_dirs = ('MEDIA_ROOT',)
+
+    def create_recipe(self, name, image=IMAGE):
+        response = self.client.post('/api/recipes/', {
+            'ingredients': [{'id': self.salt.id, 'amount': 1}],
+            'tags': [self.tag.id],
+            'image': image,
+            'name': name,
+            'text': name,
+            'cooking_time': 5,
+        }, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        return Recipe.objects.get(id=response.json()['id'])
+
+    def test_same_image_stored_once(self):
+        """Одинаковые фото сохраняются в один файл с именем по хэшу."""
+        first = self.create_recipe('Суп')
+        files = set(walk_files(recipe_image_storage, 'recipes'))
+        second = self.create_recipe('Борщ')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(
+            first.image.name, r'^recipes/[0-9a-f]{2}/[0-9a-f]{64}\.gif$'
+        )
+        self.assertIn(first.image.name, files)
+        self.assertEqual(
+            set(walk_files(recipe_image_storage, 'recipes')), files
+        )
+
+    def test_file_saved_concurrently(self):
+        """Файл, записанный параллельно после проверки имени,
+        не перезаписывается и не получает другое имя.
+        """
+        content = ContentFile(b'image', 'pie.gif')
+        name = recipe_image_storage.save('recipes/pie.gif', content)
+        with mock.patch.object(
+            recipe_image_storage, 'exists', side_effect=[False, True]
+        ):
+            self.assertEqual(
+                recipe_image_storage.save('recipes/cake.gif', content), name
+            )
+        self.assertEqual(
+            list(walk_files(recipe_image_storage, 'recipes')), [name]
+        )
+
+    def test_gc_media(self):
+        """gc_media удаляет только файлы без ссылок."""
+        kept = self.create_recipe('Суп')
+        orphan = self.create_recipe('Борщ', IMAGE.replace('RAA7', 'RAA8'))
+        orphan_name = orphan.image.name
+        orphan.delete()
+        call_command('gc_media', dry_run=True, stdout=StringIO())
+        self.assertTrue(recipe_image_storage.exists(orphan_name))
+        call_command('gc_media', stdout=StringIO())
+        self.assertTrue(recipe_image_storage.exists(orphan_name))
+        call_command('gc_media', grace_hours=-1, stdout=StringIO())
+        self.assertFalse(recipe_image_storage.exists(orphan_name))
+        self.assertTrue(recipe_image_storage.exists(kept.image.name))
+
+
+class ShoppingCartFileTestCase(FoodgramDataMixin, TestCase):
+    url = '/api/recipes/download_shopping_cart/'
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        ShoppingCart.objects.create(user=cls.user, recipe=cls.pie)
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        cache_dir = override_settings(SHOPPING_CART_CACHE_DIR=directory)
+        cache_dir.enable()
+        self.addCleanup(cache_dir.disable)
+
+    def download(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response
+
+    def test_file_reused_until_cart_changes(self):
+        """Неизмененный список не собирается заново."""
+        content = self.download().getvalue().decode()
+        self.assertIn('мука', content)
+        [name] = os.listdir(settings.SHOPPING_CART_CACHE_DIR)
+        path = os.path.join(settings.SHOPPING_CART_CACHE_DIR, name)
+        written = os.stat(path).st_ino
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.download().getvalue().decode(), content)
+        self.assertEqual(os.stat(path).st_ino, written)
+        self.assertFalse(any(
+            'recipes_ingredientinrecipe' in query['sql']
+            for query in captured
+        ))
+        ShoppingCart.objects.create(user=self.user, recipe=self.steak)
+        self.assertIn('мясо', self.download().getvalue().decode())
+        with self.captureOnCommitCallbacks(execute=True):
+            IngredientInRecipe.objects.filter(recipe=self.steak).delete()
+        self.assertNotIn('мясо', self.download().getvalue().decode())
+
+    def test_file_rebuilt_on_ingredient_changes(self):
+        """Файл пересобирается при правке ингредиентов без правки рецепта."""
+        self.assertIn('мука', self.download().getvalue().decode())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.flour.name = 'мука в/с'
+            self.flour.save()
+        self.assertIn('мука в/с', self.download().getvalue().decode())
+        item = IngredientInRecipe.objects.get(
+            recipe=self.pie, ingredients=self.salt
+        )
+        item.amount = 7
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        self.assertIn('соль,г,7', self.download().getvalue().decode())
+
+    @override_settings(SHOPPING_CART_ACCEL_REDIRECT=True)
+    def test_accel_redirect(self):
+        """В режиме nginx файл отдается через X-Accel-Redirect."""
+        response = self.download()
+        self.assertEqual(response.content, b'')
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename="shopping_cart.txt"',
+        )
+        location = response['X-Accel-Redirect']
+        self.assertTrue(location.startswith('/internal/shopping_cart/'))
+        path = os.path.join(
+            settings.SHOPPING_CART_CACHE_DIR, os.path.basename(location)
+        )
+        with open(path, encoding='utf-8') as file:
+            self.assertIn('мука', file.read())
+
+    def test_prune_shopping_cart_files(self):
+        """Давно не скачанные файлы удаляются командой."""
+        self.download().close()
+        call_command('prune_shopping_cart_files', stdout=StringIO())
+        self.assertTrue(os.listdir(settings.SHOPPING_CART_CACHE_DIR))
+        call_command(
+            'prune_shopping_cart_files', days=-1, stdout=StringIO()
+        )
+        self.assertEqual(os.listdir(settings.SHOPPING_CART_CACHE_DIR), [])
+
+
+class InvalidationBusTestCase(TransactionTestCase):
+    '''Шина проверяется на настоящем соединении с PostgreSQL:
+    уведомления доставляются только после коммита.
+    '''
+
+    def setUp(self):
+        self.bus = InvalidationBus()
+        self.received = queue.Queue()
+        self.bus.subscribe(
+            'test', self.received.put, lambda: self.received.put(None)
+        )
+        self.addCleanup(self.bus.stop)
+
+    def start_bus(self):
+        self.bus.start()
+        self.assertTrue(self.bus.connected.wait(5))
+        # Первый полный сброс - сразу после подключения.
+        self.assertIsNone(self.received.get(timeout=5))
+
+    def notify(self, keys, topic='test'):
+        '''Сообщение от имени другого процесса.'''
+        payload = json.dumps(
+            {'topic': topic, 'keys': keys, 'sender': 'other:1'}
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_notify(%s, %s)',
+                [settings.INVALIDATION_CHANNEL, payload],
+            )
+
+    def assertNothingReceived(self):
+        with self.assertRaises(queue.Empty):
+            self.received.get(timeout=0.3)
+
+    def test_delivered_after_commit(self):
+        """Сообщение доставляется после коммита, откаченное - нет."""
+        self.start_bus()
+        with transaction.atomic():
+            self.notify([1, 2])
+            self.assertNothingReceived()
+        self.assertEqual(self.received.get(timeout=5), [1, 2])
+        with transaction.atomic():
+            self.notify([3])
+            transaction.set_rollback(True)
+        self.bus.publish('test', [4])
+        self.notify([5])
+        self.assertEqual(self.received.get(timeout=5), [5])
+
+    def test_large_payload_becomes_full_refresh(self):
+        """Слишком длинный список ключей заменяется полным сбросом."""
+        self.start_bus()
+        with transaction.atomic(), mock.patch(
+            'foodgram.invalidation.get_sender', return_value='other:2'
+        ):
+            self.bus.publish('test', range(5000))
+        self.assertIsNone(self.received.get(timeout=5))
+
+    def test_reconnect_and_periodic_refresh(self):
+        """После обрыва соединения и по таймеру кэш сбрасывается целиком."""
+        with override_settings(INVALIDATION_REFRESH_INTERVAL=1):
+            self.start_bus()
+            self.assertIsNone(self.received.get(timeout=5))
+        with self.assertLogs('foodgram.invalidation', 'ERROR'):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT pg_terminate_backend(pid) '
+                    'FROM pg_stat_activity '
+                    "WHERE query LIKE 'LISTEN %%' "
+                    'AND pid <> pg_backend_pid()'
+                )
+            self.assertIsNone(self.received.get(timeout=10))
+        self.assertTrue(self.bus.connected.wait(5))
+        self.notify([6])
+        self.assertEqual(self.received.get(timeout=5), [6])
+
+    def test_handlers_reconnect_after_database_restart(self):
+        """После обрыва всех соединений обработчики снова ходят в базу."""
+        def select(keys):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT %s', [keys[0]])
+                self.received.put(cursor.fetchone()[0])
+
+        self.bus.subscribe('db', select)
+        self.start_bus()
+        self.notify([1], topic='db')
+        self.assertEqual(self.received.get(timeout=5), 1)
+        with self.assertLogs('foodgram.invalidation', 'ERROR'):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT pg_terminate_backend(pid) '
+                    'FROM pg_stat_activity '
+                    'WHERE datname = current_database() '
+                    'AND pid <> pg_backend_pid()'
+                )
+            self.assertIsNone(self.received.get(timeout=10))
+        self.assertTrue(self.bus.connected.wait(5))
+        self.notify([2], topic='db')
+        self.assertEqual(self.received.get(timeout=5), 2)
+
+    def test_follow_set_evicted_by_other_process(self):
+        """Сообщение другого процесса сбрасывает кэш подписок."""
+        user = User.objects.create_user(
+            username='bus', email='bus@ya.ru', password='pass'
+        )
+        get_follow_set(user)
+        with CaptureQueriesContext(connection) as cached:
+            get_follow_set(user)
+        bus.handle(json.dumps(
+            {'topic': 'follow_set', 'keys': [user.id], 'sender': 'other:1'}
+        ))
+        with CaptureQueriesContext(connection) as evicted:
+            get_follow_set(user)
+        self.assertEqual((len(cached), len(evicted)), (0, 1))
+
+
+class ListCacheTestCase(FoodgramDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.guest = APIClient()
+
+    def test_anonymous_recipe_list_cached(self):
+        """Список рецептов для анонима отдается из кэша без запросов,
+        для пользователя - считается заново.
+        """
+        first = self.guest.get('/api/recipes/', {'limit': 2})
+        with self.assertNumQueries(0):
+            second = self.guest.get('/api/recipes/', {'limit': 2})
+        self.assertEqual(first.json(), second.json())
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/recipes/', {'limit': 2})
+            self.client.get('/api/recipes/', {'limit': 2})
+        self.assertGreater(len(queries), 2)
+
+    def test_write_changes_version(self):
+        """После коммита правки списки считаются заново."""
+        for url in ('/api/tags/', '/api/ingredients/', '/api/recipes/'):
+            self.guest.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Ужин', color='#FFFFFF', slug='dinner')
+            Ingredient.objects.create(name='перец', measurement_unit='г')
+        self.assertEqual(len(self.guest.get('/api/tags/').json()), 2)
+        self.assertEqual(len(self.guest.get('/api/ingredients/').json()), 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.steak.delete()
+        self.assertEqual(self.guest.get('/api/recipes/').json()['count'], 2)
+
+    def test_version_message_bumps_only_process_cache(self):
+        """Сообщение другого процесса меняет версию только в кэше
+        процесса: общий кэш уже обновил отправитель.
+        """
+        message = json.dumps(
+            {'topic': 'cache_version', 'keys': ['tags'], 'sender': 'other:1'}
+        )
+        before = get_version('tags')
+        bus.handle(message)
+        self.assertNotEqual(get_version('tags'), before)
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.'
+                           'FileBasedCache',
+                'LOCATION': directory,
+            }},
+        ):
+            before = get_version('tags')
+            bus.handle(message)
+            self.assertEqual(get_version('tags'), before)
+
+    @override_settings(TAGS_CACHE_TIMEOUT=0)
+    def test_zero_timeout_disables_cache(self):
+        self.guest.get('/api/tags/')
+        with self.assertNumQueries(1):
+            self.guest.get('/api/tags/')
+
+    def test_stale_value_served_while_locked(self):
+        """Пока другой запрос пересчитывает ключ, отдается старое значение,
+        без блокировки истекший ключ пересчитывается.
+        """
+        compute = mock.Mock(return_value='new')
+        # Срок свежести истек, запись еще в кэше.
+        cache.set('key', ('old', time.time() - 1), 60)
+        cache.add('lock:key', 1)
+        self.assertEqual(get_or_compute('key', compute, 60, 'test'), 'old')
+        compute.assert_not_called()
+        cache.delete('lock:key')
+        self.assertEqual(get_or_compute('key', compute, 60, 'test'), 'new')
+        compute.assert_called_once()
+        self.assertIsNone(cache.get('lock:key'))
+        self.assertEqual(get_or_compute('key', compute, 60, 'test'), 'new')
+        compute.assert_called_once()
+
+    def test_single_flight(self):
+        """Одновременные промахи по ключу вызывают один пересчет."""
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.3)
+            return 'value'
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                get_or_compute('key', compute, 60, 'test')
+            ))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 5)
+
+    @override_settings(CACHE_JITTER=0.1)
+    def test_jitter(self):
+        timeouts = {jitter(100) for _ in range(20)}
+        self.assertGreater(len(timeouts), 1)
+        self.assertTrue(all(90 <= timeout <= 110 for timeout in timeouts))
+
+
+@override_settings(RECIPES_JSON_FROM_DB=True, RECIPES_CACHE_TIMEOUT=0)
+class RecipeJSONPageTestCase(FoodgramDataMixin, TestCase):
+    PARAMS = (
+        {'limit': 2},
+        {'limit': 2, 'page': 2},
+        {'limit': 1, 'page': 2},
+        {'limit': 1, 'page': 3},
+        {'tags': 'lunch', 'limit': 10},
+        {'page': 'last', 'limit': 2},
+    )
+    USER_PARAMS = ({'is_favorited': 1}, {'is_in_shopping_cart': 1})
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Recipe.objects.filter(id=cls.pie.id).update(image='recipes/pie.png')
+        ShoppingCart.objects.create(user=cls.user, recipe=cls.cake)
+        Follow.objects.create(user=cls.user, author=cls.author)
+
+    def get_expected(self, request):
+        recipes = Recipe.objects.annotate(**{
+            name: Exists(
+                model.objects.filter(user=self.user, recipe=OuterRef('id'))
+            )
+            for name, model in (
+                ('is_favorited', Favorite),
+                ('is_in_shopping_cart', ShoppingCart),
+            )
+        })
+        return RecipeSerializer(
+            recipes, many=True, context={'request': request}
+        ).data
+
+    def test_matches_recipe_serializer(self):
+        """Страница из PostgreSQL совпадает с RecipeSerializer
+        с точностью до пробелов, включая порядок ключей.
+        """
+        response = self.client.get('/api/recipes/?limit=10')
+        self.assertEqual(
+            json.loads(response.content, object_pairs_hook=list),
+            json.loads(
+                JSONRenderer().render({
+                    'count': 3,
+                    'next': None,
+                    'previous': None,
+                    'results': self.get_expected(response.wsgi_request),
+                }),
+                object_pairs_hook=list,
+            ),
+        )
+
+    def test_matches_regular_path(self):
+        """Фильтры, страницы и флаги совпадают с обычным путем."""
+        for client, cases in (
+            (self.client, self.PARAMS + self.USER_PARAMS),
+            (APIClient(), self.PARAMS),
+        ):
+            for params in cases:
+                with self.subTest(params=params):
+                    response = client.get('/api/recipes/', params)
+                    with override_settings(RECIPES_JSON_FROM_DB=False):
+                        expected = client.get('/api/recipes/', params)
+                    self.assertEqual(response.json(), expected.json())
+
+    def test_single_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/recipes/', {'limit': 2})
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_invalid_page(self):
+        response = self.client.get('/api/recipes/', {'page': 9})
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        with override_settings(RECIPES_JSON_FROM_DB=False):
+            expected = self.client.get('/api/recipes/', {'page': 9})
+        self.assertEqual(response.json(), expected.json())
+
+    def test_sparse_fields_use_serializers(self):
+        response = self.client.get('/api/recipes/', {'fields': 'id'})
+        self.assertEqual(
+            response.json()['results'][0], {'id': self.steak.id}
+        )
@@ -1,7 +1,8 @@
 from django.urls import include, path
 from rest_framework import routers
 
-from .views import IngredientViewSet, RecipeViewSet, TagViewSet, UserViewSet
+from .views import (IngredientViewSet, RecipeViewSet, SyncViewSet, TagViewSet,
+                    UserViewSet)
 
 app_name = 'api'
 
@@ -11,6 +12,7 @@ router.register('users', UserViewSet, basename='users')
 router.register('tags', TagViewSet, basename='tags')
 router.register('ingredients', IngredientViewSet, basename='ingredients')
 router.register('recipes', RecipeViewSet, basename='recipes')
+router.register('sync', SyncViewSet, basename='sync')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,35 +1,130 @@
 import csv
-from io import StringIO
+import hashlib
+import json
+import os
+import tempfile
+from collections import defaultdict
+from pathlib import Path
 
+from django.conf import settings
 from django.db.models import Sum
-from django.http import HttpResponse
+from django.db.models.expressions import RawSQL
+from django.http import FileResponse, HttpResponse
 
-from recipes.models import IngredientInRecipe
+from foodgram.cache import get_version
+from recipes.models import IngredientInRecipe, Recipe, ShoppingCart
 
+# Меняется вместе с форматом файла, чтобы не отдавать старые файлы.
+SHOPPING_CART_FILE_VERSION = 1
 
-def get_file_shopping_cart(user):
-    '''Отдает файл с покупками(ингредиентами).'''
-    ingredients = (
+
+def get_shopping_cart_rows(user):
+    '''Строки списка покупок: название, единица измерения и сумма
+    количества ингредиента по всем рецептам списка.
+    '''
+    return list(
         IngredientInRecipe
         .objects
         .filter(recipe__shopping_cart_users__user=user)
         .values('ingredients__name', 'ingredients__measurement_unit')
         .annotate(amount=Sum('amount'))
+        .order_by('ingredients__name', 'ingredients__measurement_unit')
+        .values_list(
+            'ingredients__name',
+            'ingredients__measurement_unit',
+            'amount'
+        )
     )
-    data = ingredients.values_list(
-        'ingredients__name',
-        'ingredients__measurement_unit',
-        'amount'
+
+
+def get_shopping_cart_key(user):
+    '''Ключ файла списка покупок без сборки самого списка.
+    Строится по строкам списка пользователя и версиям рецептов
+    и ингредиентов: добавление или удаление рецепта из списка,
+    правка рецепта, его ингредиентов или самих ингредиентов дают
+    новый ключ. Версии берутся из часов и не повторяются.
+    '''
+    cart_ids = (
+        ShoppingCart.objects
+        .filter(user=user)
+        .order_by('id')
+        .values_list('id', flat=True)
     )
-    file = StringIO()
-    writer = csv.writer(file)
-    writer.writerow(
-        ['Название ингредиента', 'Единица измерения', 'Количество']
+    digest = hashlib.sha256(
+        f'v{SHOPPING_CART_FILE_VERSION}:{get_version("recipes")}:'
+        f'{get_version("ingredients")}'.encode()
     )
-    for name, measurement_unit, amount in data:
-        writer.writerow([name, measurement_unit, amount])
-    file.seek(0)
-    response = HttpResponse(file, content_type='text/plain')
+    digest.update(json.dumps(list(cart_ids)).encode())
+    return digest.hexdigest()
+
+
+def write_file_shopping_cart(rows, path):
+    '''Собирает файл с покупками(ингредиентами) и атомарно
+    кладет его по пути path.
+    '''
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        'w', dir=path.parent, suffix='.tmp', delete=False, newline=''
+    ) as file:
+        writer = csv.writer(file)
+        writer.writerow(
+            ['Название ингредиента', 'Единица измерения', 'Количество']
+        )
+        for name, measurement_unit, amount in rows:
+            writer.writerow([name, measurement_unit, amount])
+    os.replace(file.name, path)
+
+
+def get_file_shopping_cart(user):
+    '''Отдает файл с покупками(ингредиентами).
+    Список собирается и файл записывается, только если с прошлой
+    выдачи изменились список или его рецепты.
+    С SHOPPING_CART_ACCEL_REDIRECT файл отправляет nginx,
+    и воркер освобождается сразу.
+    '''
+    name = f'{get_shopping_cart_key(user)}.txt'
+    path = Path(settings.SHOPPING_CART_CACHE_DIR) / name
+    if path.exists():
+        # Дата изменения - время последней выдачи, по ней чистит
+        # prune_shopping_cart_files.
+        path.touch()
+    else:
+        write_file_shopping_cart(get_shopping_cart_rows(user), path)
+    if settings.SHOPPING_CART_ACCEL_REDIRECT:
+        response = HttpResponse(content_type='text/plain')
+        response['X-Accel-Redirect'] = (
+            f'{settings.SHOPPING_CART_ACCEL_PREFIX}{name}'
+        )
+    else:
+        response = FileResponse(open(path, 'rb'), content_type='text/plain')
     response[
         'Content-Disposition'] = 'attachment; filename="shopping_cart.txt"'
     return response
+
+
+def get_latest_recipes(author_ids, limit=None):
+    '''Возвращает последние рецепты авторов, не больше limit на автора.
+    Выбирает рецепты всех авторов одним запросом
+    (LATERAL-подзапрос с LIMIT для каждого автора).
+    '''
+    author_ids = list(author_ids)
+    recipes_by_author = defaultdict(list)
+    if not author_ids:
+        return recipes_by_author
+    recipes = Recipe.objects.only('id', 'name', 'image', 'cooking_time',
+                                  'author_id')
+    if limit is None:
+        recipes = recipes.filter(author_id__in=author_ids)
+    else:
+        recipes = recipes.filter(id__in=RawSQL(
+            'SELECT latest.id FROM unnest(%s) AS authors(author_id) '
+            'CROSS JOIN LATERAL ('
+            f'SELECT id FROM {Recipe._meta.db_table} '
+            'WHERE author_id = authors.author_id '
+            'ORDER BY pub_date DESC LIMIT %s'
+            ') AS latest',
+            (author_ids, limit),
+        ))
+    for recipe in recipes:
+        recipes_by_author[recipe.author_id].append(recipe)
+    return recipes_by_author
@@ -1,66 +1,101 @@
-from django.db.models import Exists, OuterRef
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Prefetch
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import (AllowAny, IsAdminUser, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 
-from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from recipes.ingredient_index import ingredient_index
+from recipes.models import (AuthorStats, Favorite, Ingredient,
+                            IngredientInRecipe, Recipe, ShoppingCart, Tag)
+from recipes.pages import build_page
+from recipes.recommendations import get_recommended_ids, get_similar_ids
+from recipes.sync import (get_changes, get_cursor, get_state, is_expired,
+                          parse_cursor)
+from recipes.uploads import save_upload
 from users.models import Follow, User
 
-from .filters import IngredientSearchFilter, RecipeFilter
-from .pagination import PageLimitPagination
+from .decorators import cached_list
+from .filters import IngredientSearchFilter, RecipeFilter, UserSearchFilter
+from .pagination import PageLimitPagination, UserPagination
+from .parsers import ImageUploadParser
 from .permissions import IsAuthorOrReadOnly
-from .serializers import (CreateRecipeSerializer, FavoriteSerializer,
-                          FollowSerializer, IngredientSerializer,
-                          RecipeSerializer, ShopListSerializer, TagSerializer,
-                          UserSerializer)
-from .utils import get_file_shopping_cart
+from .renderers import FastJSONRenderer
+from .serializers import (AuthorStatsSerializer, CreateRecipeSerializer,
+                          FavoriteSerializer, FollowSerializer,
+                          ImageUploadSerializer, IngredientValuesSerializer,
+                          RecipeCoverageSerializer, RecipeSerializer,
+                          RecipeSnapshotSerializer, ShopListSerializer,
+                          SparseRecipeSerializer, TagValuesSerializer,
+                          UserSerializer, UserValuesSerializer)
+from .utils import get_file_shopping_cart, get_latest_recipes
 
 
 class UserViewSet(DjoserUserViewSet):
     '''ViewSet для работы с пользователями.'''
     serializer_class = UserSerializer
     permission_classes = (IsAuthenticated,)
-    pagination_class = PageLimitPagination
+    pagination_class = UserPagination
+    filter_backends = (UserSearchFilter,)
+
+    values_actions = ('list', 'retrieve')
 
     def get_queryset(self):
-        queryset = self.queryset.prefetch_related('recipes')
-        if self.request.user.is_authenticated:
-            queryset = (
-                queryset
-                .annotate(
-                    subscribed_exists=Exists(
-                        Follow
-                        .objects
-                        .filter(
-                            user_id=self.request.user.id,
-                            author_id=OuterRef('pk')
-                        )
-                    )
-                )
-            )
-        return queryset
+        if self.action in self.values_actions:
+            return UserValuesSerializer.values(self.queryset)
+        return self.queryset.select_related('stats')
+
+    def get_serializer_class(self):
+        if self.action in self.values_actions:
+            return UserValuesSerializer
+        return super().get_serializer_class()
 
     @action(
         detail=False,
         methods=['get'],
         permission_classes=(IsAuthenticated,),
+        pagination_class=PageLimitPagination,
     )
     def subscriptions(self, request):
         '''Возвращает пользователей, на которых подписан текущий пользователь.
         В выдачу добавляются рецепты.
         '''
-        following = Follow.objects.filter(user=self.request.user)
+        following = (
+            Follow
+            .objects
+            .filter(user=self.request.user)
+            .select_related('author__stats')
+            .order_by('-id')
+        )
         pages = self.paginate_queryset(following)
+        limit = request.query_params.get('recipes_limit')
+        recipes = get_latest_recipes(
+            (follow.author_id for follow in pages),
+            int(limit) if limit else None,
+        )
+        for follow in pages:
+            follow.author.subscription_recipes = recipes[follow.author_id]
         serializer = FollowSerializer(
             pages, many=True, context={'request': request}
         )
         return self.get_paginated_response(serializer.data)
 
+    @action(
+        detail=True,
+        methods=['get'],
+        permission_classes=(IsAuthenticated,)
+    )
+    def stats(self, request, id=None):
+        '''Возвращает счетчики автора: рецепты, подписчиков и избранное.'''
+        author = get_object_or_404(User.objects.select_related('stats'), id=id)
+        stats = getattr(author, 'stats', None) or AuthorStats(author=author)
+        return Response(AuthorStatsSerializer(stats).data)
+
     @action(
         detail=True,
         methods=['post'],
@@ -100,11 +135,15 @@ class UserViewSet(DjoserUserViewSet):
 
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
     '''ViewSet для работы с моделью Tag.'''
-    queryset = Tag.objects.all()
-    serializer_class = TagSerializer
+    queryset = TagValuesSerializer.values(Tag.objects.all())
+    serializer_class = TagValuesSerializer
     permission_classes = (AllowAny,)
     pagination_class = None
 
+    @cached_list('tags', 'TAGS_CACHE_TIMEOUT')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
 
 class RecipeViewSet(viewsets.ModelViewSet):
     '''ViewSet для работы с моделью Recipe.'''
@@ -115,36 +154,179 @@ class RecipeViewSet(viewsets.ModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
-    def get_queryset(self):
-        queryset = (
-            Recipe
-            .objects
-            .select_related('author')
-            .prefetch_related('tags', 'ingredients')
-        )
-        if self.request.user.is_authenticated:
-            return queryset.annotate(
-                is_favorited=Exists(
-                    queryset.filter(
-                        favorite_users__user=self.request.user,
-                        favorite_users__recipe=OuterRef('id'),
-                    )
-                ),
-                is_in_shopping_cart=Exists(
-                    queryset.filter(
-                        shopping_cart_users__user=self.request.user,
-                        shopping_cart_users__recipe=OuterRef('id'),
-                    )
+    read_actions = (
+        'list', 'retrieve', 'similar', 'recommended', 'by_ingredients',
+        'batch',
+    )
+    sparse_actions = ('list', 'retrieve', 'batch')
+    column_fields = ('name', 'image', 'text', 'cooking_time')
+    flag_models = {
+        'is_favorited': Favorite,
+        'is_in_shopping_cart': ShoppingCart,
+    }
+
+    def get_sparse_fields(self):
+        '''Поля из параметров fields и expand через запятую.
+        Без параметров - None: рецепт отдается целиком.
+        Без fields отдаются все поля, без expand - связи в виде id.
+        '''
+        params = self.request.query_params
+        if (
+            self.action not in self.sparse_actions
+            or ('fields' not in params and 'expand' not in params)
+        ):
+            return None
+        all_fields = RecipeSerializer.Meta.fields
+        fields = [
+            name for name in params.get('fields', '').split(',') if name
+        ] or all_fields
+        expand = [
+            name for name in params.get('expand', '').split(',') if name
+        ]
+        unknown = (set(fields) | set(expand)) - set(all_fields)
+        if unknown:
+            raise ValidationError(
+                {'fields': f'Неизвестные поля: {", ".join(sorted(unknown))}'}
+            )
+        return fields, expand
+
+    def get_sparse_queryset(self, fields, expand):
+        '''Выборка только под запрошенные поля: без описания,
+        если оно не нужно, и без ингредиентов, автора и тегов,
+        если их нет в fields.
+        '''
+        columns = [name for name in self.column_fields if name in fields]
+        queryset = Recipe.objects.only('id', 'author', *columns)
+        if 'author' in fields and 'author' in expand:
+            queryset = queryset.select_related('author').only(
+                'id', 'author', *columns,
+                *(
+                    f'author__{name}'
+                    for name in UserValuesSerializer.Meta.fields
                 ),
             )
+        if 'tags' in fields:
+            queryset = queryset.prefetch_related(
+                'tags' if 'tags' in expand
+                else Prefetch('tags', Tag.objects.only('id'))
+            )
+        if 'ingredients' in fields:
+            queryset = queryset.prefetch_related(
+                Prefetch(
+                    'ingredient_list',
+                    IngredientInRecipe.objects.select_related('ingredients'),
+                )
+                if 'ingredients' in expand
+                else Prefetch('ingredients', Ingredient.objects.only('id'))
+            )
         return queryset
 
+    def get_queryset(self):
+        sparse = self.get_sparse_fields()
+        flags = self.flag_models
+        if sparse is not None:
+            queryset = self.get_sparse_queryset(*sparse)
+            flags = [name for name in flags if name in sparse[0]]
+        elif self.action in self.read_actions:
+            queryset = (
+                Recipe
+                .objects
+                .select_related('snapshot')
+                .only('id', 'author', 'snapshot__data')
+            )
+        else:
+            queryset = (
+                Recipe
+                .objects
+                .select_related('author')
+                .prefetch_related('tags', 'ingredients')
+            )
+        if not self.request.user.is_authenticated:
+            return queryset
+        return queryset.annotate(**{
+            name: Exists(
+                self.flag_models[name].objects.filter(
+                    user=self.request.user, recipe=OuterRef('id')
+                )
+            )
+            for name in flags
+        })
+
     def get_serializer_class(self):
         '''Отдает нужный сериализатор.'''
-        if self.action in ['list', 'retrieve']:
-            return RecipeSerializer
+        if self.get_sparse_fields() is not None:
+            return SparseRecipeSerializer
+        if self.action in self.read_actions:
+            return RecipeSnapshotSerializer
         return CreateRecipeSerializer
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        sparse = self.get_sparse_fields()
+        if sparse is not None:
+            context['fields'], context['expand'] = sparse
+        return context
+
+    @cached_list('recipes', 'RECIPES_CACHE_TIMEOUT', anonymous_only=True)
+    def list(self, request, *args, **kwargs):
+        if (
+            settings.RECIPES_JSON_FROM_DB
+            and self.get_sparse_fields() is None
+            and isinstance(request.accepted_renderer, FastJSONRenderer)
+        ):
+            response = self.get_json_page(request)
+            if response is not None:
+                return response
+        return super().list(request, *args, **kwargs)
+
+    def get_json_page(self, request):
+        '''Страница списка, собранная в PostgreSQL одним запросом
+        и отданная без сериализаторов. Если номер страницы не число
+        (например, last) - None: страница строится обычным путем.
+        '''
+        paginator = self.paginator
+        try:
+            number = int(
+                request.query_params.get(paginator.page_query_param, 1)
+            )
+        except ValueError:
+            return None
+        if number < 1:
+            return None
+        page_size = paginator.get_page_size(request)
+        image_url = request.build_absolute_uri(
+            Recipe._meta.get_field('image').storage.url('')
+        )
+        count, results = build_page(
+            self.filter_queryset(Recipe.objects.all()),
+            request.user.id,
+            image_url,
+            (number - 1) * page_size,
+            page_size,
+        )
+        return paginator.get_json_paginated_response(
+            request, number, count, results
+        )
+
+    def get_id_list(self, param):
+        '''Список id из параметра: через запятую и/или повтором.'''
+        try:
+            return [
+                int(value)
+                for values in self.request.query_params.getlist(param)
+                for value in values.split(',')
+            ]
+        except ValueError:
+            raise ValidationError({param: 'Укажите id через запятую.'})
+
+    def get_ordered_response(self, request, ids):
+        '''Отдает рецепты в порядке переданных id.'''
+        recipes = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in ids if pk in recipes], many=True
+        )
+        return Response(serializer.data)
+
     def add_recipe(self, request, add_serializer, pk=None):
         """Добавляет рецепт."""
         recipe = get_object_or_404(Recipe, id=pk)
@@ -203,6 +385,24 @@ class RecipeViewSet(viewsets.ModelViewSet):
         '''Удаляет рецепт из списка покупок.'''
         return self.del_recipe(request, ShoppingCart, pk)
 
+    @action(
+        detail=False,
+        methods=['post'],
+        permission_classes=(IsAuthenticated,),
+        parser_classes=(ImageUploadParser,),
+    )
+    def images(self, request):
+        '''Принимает фото блюда в multipart/form-data.
+        Возвращает токен, который можно передать в поле image рецепта
+        вместо base64.
+        '''
+        serializer = ImageUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        token = save_upload(
+            serializer.validated_data['image'], request.user.id
+        )
+        return Response({'image': token}, status=status.HTTP_201_CREATED)
+
     @action(
         detail=False,
         methods=['get'],
@@ -212,12 +412,109 @@ class RecipeViewSet(viewsets.ModelViewSet):
         '''Скачивает список покупок.'''
         return get_file_shopping_cart(request.user)
 
+    @action(
+        detail=True,
+        methods=['get'],
+        permission_classes=(AllowAny,)
+    )
+    def similar(self, request, pk=None):
+        '''Возвращает похожие рецепты.'''
+        recipe = get_object_or_404(Recipe, id=pk)
+        return self.get_ordered_response(request, get_similar_ids(recipe.id))
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=(IsAuthenticated,)
+    )
+    def recommended(self, request):
+        '''Возвращает рецепты, рекомендованные текущему пользователю.'''
+        return self.get_ordered_response(
+            request, get_recommended_ids(request.user)
+        )
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=(AllowAny,)
+    )
+    def batch(self, request):
+        '''Возвращает рецепты по списку ids в порядке запроса.
+        Повторы id отдаются один раз, несуществующие пропускаются.
+        Поддерживает параметры fields и expand, как список рецептов.
+        '''
+        ids = list(dict.fromkeys(self.get_id_list('ids')))
+        if len(ids) > settings.RECIPES_BATCH_MAX_SIZE:
+            raise ValidationError({
+                'ids': 'Можно запросить не больше '
+                       f'{settings.RECIPES_BATCH_MAX_SIZE} рецептов.'
+            })
+        return self.get_ordered_response(request, ids)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=(AllowAny,)
+    )
+    def by_ingredients(self, request):
+        '''Ищет рецепты по имеющимся ингредиентам.
+        Сначала идут рецепты с наибольшей долей найденных ингредиентов,
+        затем - с наименьшим числом недостающих.
+        '''
+        ingredient_ids = self.get_id_list('ingredients')
+        page = self.paginate_queryset(ingredient_index.search(ingredient_ids))
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in page]
+        )
+        results = []
+        for recipe_id, coverage, missing in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:
+                recipe.coverage, recipe.missing = coverage, missing
+                results.append(recipe)
+        serializer = RecipeCoverageSerializer(
+            results, many=True, context={'request': request}
+        )
+        return self.get_paginated_response(serializer.data)
+
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     '''ViewSet для работы с моделью Ingredient.'''
-    queryset = Ingredient.objects.all()
-    serializer_class = IngredientSerializer
+    queryset = IngredientValuesSerializer.values(Ingredient.objects.all())
+    serializer_class = IngredientValuesSerializer
     permission_classes = (AllowAny,)
     pagination_class = None
     filter_backends = (IngredientSearchFilter,)
     search_fields = ('^name',)
+
+    @cached_list('ingredients', 'INGREDIENTS_CACHE_TIMEOUT')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+
+class SyncViewSet(viewsets.ViewSet):
+    '''Изменения для синхронизации клиента.'''
+    permission_classes = (AllowAny,)
+
+    def list(self, request):
+        '''Изменения рецептов и личных списков пользователя после курсора
+        since: id измененных и удаленных объектов по разделам и курсор
+        для следующего запроса. Сами рецепты можно получить через
+        /api/recipes/batch/. Без since отдает полный состав избранного,
+        списка покупок и подписок, рецепты загружаются обычным списком.
+        '''
+        user_id = request.user.id
+        cursor = get_cursor()
+        since = request.query_params.get('since')
+        if since is None:
+            return Response({'cursor': cursor, **get_state(user_id)})
+        try:
+            txid, issued = parse_cursor(since)
+        except ValueError:
+            raise ValidationError({'since': 'Неверный курсор.'})
+        if is_expired(issued):
+            return Response(
+                {'message': 'Курсор устарел, выполните полную синхронизацию.'},
+                status=status.HTTP_410_GONE
+            )
+        return Response({'cursor': cursor, **get_changes(user_id, txid)})
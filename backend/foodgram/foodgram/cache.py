@@ -0,0 +1,132 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+
+from .invalidation import bus
+from .metrics import inc
+
+# Шаг ожидания чужого пересчета при промахе, секунд.
+WAIT_STEP = 0.05
+
+
+def jitter(timeout):
+    '''Срок жизни со случайным отклонением на ±CACHE_JITTER:
+    ключи, записанные одновременно, истекают в разное время.
+    '''
+    spread = settings.CACHE_JITTER
+    return timeout * random.uniform(1 - spread, 1 + spread)
+
+
+def get_version_key(namespace):
+    return f'version:{namespace}'
+
+
+def get_version(namespace):
+    '''Текущая версия пространства ключей.
+    Начальная версия берется из часов, чтобы после вытеснения
+    счетчика из кэша не вернуться к уже использованным номерам.
+    '''
+    key = get_version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns() // 1000, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_versions(namespaces):
+    '''Переводит пространства на новую версию: старые ключи
+    больше не читаются и истекают сами.
+    '''
+    for namespace in namespaces:
+        try:
+            cache.incr(get_version_key(namespace))
+        except ValueError:
+            get_version(namespace)
+
+
+def record(name, result):
+    inc('foodgram_cache_requests_total', cache=name, result=result)
+
+
+def store(key, value, timeout):
+    '''Сохраняет значение со сроком свежести. Сама запись живет
+    еще CACHE_GRACE секунд: в это время отдается устаревшее значение.
+    '''
+    fresh_until = time.time() + jitter(timeout)
+    cache.set(key, (value, fresh_until), timeout + settings.CACHE_GRACE)
+
+
+def get_or_compute(key, compute, timeout, name):
+    '''Значение из кэша, при промахе - compute().
+    Пересчитывает ключ только тот, кто взял блокировку ключа.
+    Остальные, пока он считает, получают устаревшее значение,
+    а если его нет - ждут до CACHE_LOCK_WAIT секунд и только потом
+    считают сами. С общим для воркеров кэшем (Memcached, Redis)
+    блокировка одна на все процессы, с LocMemCache - на процесс.
+    name - имя кэша в метриках.
+    '''
+    entry = cache.get(key)
+    if entry is not None:
+        value, fresh_until = entry
+        if time.time() < fresh_until:
+            record(name, 'hit')
+            return value
+    lock_key = f'lock:{key}'
+    locked = cache.add(lock_key, 1, settings.CACHE_LOCK_TIMEOUT)
+    if not locked:
+        if entry is not None:
+            record(name, 'stale')
+            return entry[0]
+        deadline = time.monotonic() + settings.CACHE_LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(WAIT_STEP)
+            entry = cache.get(key)
+            if entry is not None:
+                record(name, 'hit')
+                return entry[0]
+    record(name, 'miss')
+    try:
+        value = compute()
+        store(key, value, timeout)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return value
+
+
+class VersionBump:
+    '''Отложенная до коммита смена версий пространств ключей.
+    Пространства всей транзакции переводятся разом, остальным
+    процессам они сообщаются через шину сброса кэшей.
+    '''
+
+    def __init__(self, namespaces=()):
+        self.namespaces = set(namespaces)
+
+    def __call__(self):
+        bump_versions(self.namespaces)
+        bus.publish('cache_version', self.namespaces)
+
+
+def is_process_local():
+    '''Кэш свой у каждого процесса (LocMemCache): сброс, сделанный
+    одним воркером, остальные должны повторить у себя.
+    '''
+    return isinstance(caches['default'], LocMemCache)
+
+
+def bump_local_versions(namespaces):
+    '''Смена версий по сообщению другого процесса. С общим кэшем
+    версии уже сменил отправитель, и повторная смена в каждом воркере
+    лишь сбросила бы ключи еще N раз.
+    '''
+    if is_process_local():
+        bump_versions(namespaces)
+
+
+# Полный сброс не нужен: записи живут не дольше срока кэша и CACHE_GRACE.
+bus.subscribe('cache_version', bump_local_versions)
@@ -0,0 +1,72 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connection
+
+_timings = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    '''Замеры одного запроса: время фаз обработки и выполненный SQL.'''
+
+    def __init__(self, max_queries):
+        self.phases = defaultdict(float)
+        self.active = set()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.queries = []
+        self.max_queries = max_queries
+
+    def execute(self, execute, sql, params, many, context):
+        '''Обертка для connection.execute_wrapper: считает SQL-запросы,
+        их время и запоминает первые max_queries текстов запросов.
+        '''
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.sql_count += 1
+            self.sql_time += elapsed
+            if len(self.queries) < self.max_queries:
+                self.queries.append((sql, elapsed))
+
+
+def get_timings():
+    '''Замеры текущего запроса или None, если сбор не идет.'''
+    return _timings.get()
+
+
+@contextmanager
+def collect_timings(max_queries):
+    '''Собирает замеры для кода внутри блока.'''
+    timings = RequestTimings(max_queries)
+    token = _timings.set(timings)
+    try:
+        with connection.execute_wrapper(timings.execute):
+            yield timings
+    finally:
+        _timings.reset(token)
+
+
+@contextmanager
+def phase(name):
+    '''Замеряет фазу обработки запроса, если идет сбор замеров.
+    Время SQL внутри фазы в нее не входит: оно учитывается отдельно.
+    Вложенный замер той же фазы входит во внешний.
+    '''
+    timings = _timings.get()
+    if timings is None or name in timings.active:
+        yield
+        return
+    timings.active.add(name)
+    start, sql_start = time.perf_counter(), timings.sql_time
+    try:
+        yield
+    finally:
+        timings.phases[name] += (
+            time.perf_counter() - start - (timings.sql_time - sql_start)
+        )
+        timings.active.discard(name)
@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connection
+
+from .metrics import inc
+
+logger = logging.getLogger('foodgram.invalidation')
+
+# Ограничение PostgreSQL на размер сообщения NOTIFY - 8000 байт.
+# Если ключи не помещаются, отправляется сброс темы целиком.
+MAX_PAYLOAD = 7900
+# Узел: вместе с pid отличает процессы и на разных машинах,
+# и воркеры, созданные fork после импорта модуля.
+NODE_ID = uuid.uuid4().hex[:12]
+
+
+def get_sender():
+    return f'{NODE_ID}:{os.getpid()}'
+
+
+class Subscription:
+    '''Обработчики темы: evict(keys) сбрасывает ключи,
+    refresh() - все, что кэшировано по теме.
+    '''
+
+    def __init__(self, evict, refresh=None):
+        self.evict = evict
+        self.refresh = refresh
+
+
+class InvalidationBus:
+    '''Шина сброса локальных кэшей процессов через LISTEN/NOTIFY.
+    publish() выполняет pg_notify в текущей транзакции: сообщение уходит
+    только при коммите. Свой процесс сбрасывает кэши сам, остальные -
+    в фоновом потоке-слушателе. Сообщения, пропущенные при обрыве
+    соединения, восполняются полным обновлением тем (refresh) после
+    переподключения и раз в INVALIDATION_REFRESH_INTERVAL. Обновление
+    должно быть дешевым: оно идет в потоке-слушателе, но регулярно.
+    Сброс идемпотентен, поэтому повторная доставка безопасна.
+    '''
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._thread = None
+        self._stop = threading.Event()
+        self.connected = threading.Event()
+
+    def subscribe(self, topic, evict, refresh=None):
+        self._subscriptions.setdefault(topic, []).append(
+            Subscription(evict, refresh)
+        )
+
+    def publish(self, topic, keys=None):
+        '''Сообщает остальным процессам о смене ключей темы.
+        keys=None - сброс темы целиком.
+        '''
+        if keys is not None:
+            keys = sorted(set(keys))
+        payload = json.dumps(
+            {'topic': topic, 'keys': keys, 'sender': get_sender()}
+        )
+        if len(payload) > MAX_PAYLOAD:
+            payload = json.dumps(
+                {'topic': topic, 'keys': None, 'sender': get_sender()}
+            )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_notify(%s, %s)',
+                [settings.INVALIDATION_CHANNEL, payload],
+            )
+        inc('foodgram_invalidation_messages_total',
+            topic=topic, event='published')
+
+    def dispatch(self, topic, keys):
+        '''Вызывает обработчики темы в текущем процессе.'''
+        for subscription in self._subscriptions.get(topic, ()):
+            try:
+                if keys is None:
+                    if subscription.refresh is not None:
+                        subscription.refresh()
+                else:
+                    subscription.evict(keys)
+            except Exception:
+                logger.exception('Ошибка сброса кэша %s', topic)
+
+    def refresh_all(self):
+        '''Полное обновление всех тем.'''
+        for topic in list(self._subscriptions):
+            self.dispatch(topic, None)
+            inc('foodgram_invalidation_messages_total',
+                topic=topic, event='refresh')
+
+    def handle(self, payload):
+        '''Обрабатывает сообщение из канала.
+        Свои сообщения пропускаются: свой кэш уже сброшен.
+        '''
+        try:
+            message = json.loads(payload)
+            topic, keys = message['topic'], message['keys']
+        except (ValueError, KeyError, TypeError):
+            logger.warning('Неверное сообщение шины: %s', payload)
+            return
+        if message.get('sender') == get_sender():
+            return
+        inc('foodgram_invalidation_messages_total',
+            topic=topic, event='received')
+        self.dispatch(topic, keys)
+
+    def start(self):
+        '''Запускает поток-слушатель, если он еще не запущен.'''
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='invalidation-bus', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _connect(self):
+        '''Отдельное соединение в режиме autocommit: уведомления
+        приходят только вне транзакции.
+        '''
+        raw = connection.get_new_connection(
+            connection.get_connection_params()
+        )
+        raw.autocommit = True
+        with raw.cursor() as cursor:
+            cursor.execute(f'LISTEN "{settings.INVALIDATION_CHANNEL}"')
+        return raw
+
+    def _run(self):
+        delay = 1
+        while not self._stop.is_set():
+            try:
+                self._listen()
+                delay = 1
+            except Exception:
+                logger.exception('Шина сброса кэшей: соединение потеряно')
+            finally:
+                self.connected.clear()
+                # Если база перезапускалась, соединение Django этого
+                # потока тоже оборвано: обработчики откроют новое.
+                connection.close()
+            self._stop.wait(delay)
+            delay = min(delay * 2, 30)
+
+    def _listen(self):
+        raw = self._connect()
+        try:
+            # Пока соединения не было, сообщения могли потеряться.
+            self.refresh_all()
+            self.connected.set()
+            interval = settings.INVALIDATION_REFRESH_INTERVAL
+            refresh_at = time.monotonic() + interval
+            while not self._stop.is_set():
+                timeout = min(1, max(0, refresh_at - time.monotonic()))
+                if select.select([raw], [], [], timeout)[0]:
+                    raw.poll()
+                    connection.close_if_unusable_or_obsolete()
+                    while raw.notifies:
+                        self.handle(raw.notifies.pop(0).payload)
+                if time.monotonic() >= refresh_at:
+                    connection.close_if_unusable_or_obsolete()
+                    self.refresh_all()
+                    refresh_at = time.monotonic() + interval
+        finally:
+            raw.close()
+
+
+bus = InvalidationBus()
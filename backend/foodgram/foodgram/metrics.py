@@ -0,0 +1,334 @@
+import atexit
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+CACHES = (
+    'recipe_snapshot', 'ingredient_index', 'follow_set',
+    'recipes_list', 'tags_list', 'ingredients_list',
+)
+
+# Файлы процессов: metrics_<pid>_<uuid>.json. Pid нужен, чтобы узнать
+# завершившийся процесс, uuid - чтобы новый процесс с тем же pid
+# не перезаписал файл старого.
+PROCESS_FILE = re.compile(r'metrics_(\d+)_[0-9a-f]+\.json')
+ARCHIVE_FILE = 'metrics_archive.json'
+LOCK_FILE = 'metrics.lock'
+
+# Имя -> (тип, описание, границы корзин для гистограмм).
+METRICS = {
+    'foodgram_http_requests_total': (
+        'counter', 'Обработанные запросы.', None
+    ),
+    'foodgram_http_request_duration_seconds': (
+        'histogram', 'Время обработки запроса.', DURATION_BUCKETS
+    ),
+    'foodgram_db_queries_per_request': (
+        'histogram', 'SQL-запросов на один HTTP-запрос.', QUERY_BUCKETS
+    ),
+    'foodgram_db_query_duration_seconds_total': (
+        'counter', 'Суммарное время SQL-запросов.', None
+    ),
+    'foodgram_auth_requests_total': (
+        'counter', 'Попытки аутентификации по результату.', None
+    ),
+    'foodgram_auth_duration_seconds_total': (
+        'counter', 'Суммарное время аутентификации.', None
+    ),
+    'foodgram_cache_requests_total': (
+        'counter', 'Обращения к внутренним кэшам: hit, stale или miss.', None
+    ),
+    'foodgram_invalidation_messages_total': (
+        'counter',
+        'Шина сброса кэшей: published, received или refresh.',
+        None,
+    ),
+}
+
+
+def write_json(path, data):
+    '''Атомарно записывает строку JSON в файл.'''
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as file:
+        file.write(data)
+    os.replace(f'{path}.tmp', path)
+
+
+def read_json(path):
+    '''Содержимое файла JSON или None, если его не прочитать.'''
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def add_snapshot(totals, snapshot):
+    '''Прибавляет значения snapshot к totals по сериям.'''
+    for name, series in snapshot.items():
+        if name not in totals:
+            continue
+        for key, value in series.items():
+            if isinstance(value, list):
+                current = totals[name].get(key) or [0] * len(value)
+                totals[name][key] = [a + b for a, b in zip(current, value)]
+            else:
+                totals[name][key] += value
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def archive_dead_files(directory, archive):
+    '''Складывает в архив значения завершившихся процессов
+    и удаляет их файлы. Имена сложенных файлов запоминаются
+    в архиве: файл, который не удалось удалить, не будет учтен дважды.
+    '''
+    folded = {
+        name for name in archive['folded']
+        if os.path.exists(os.path.join(directory, name))
+    }
+    dead = []
+    for name in os.listdir(directory):
+        match = PROCESS_FILE.fullmatch(name)
+        if match and not is_alive(int(match.group(1))):
+            dead.append(name)
+    if not dead:
+        return archive
+    totals = {name: defaultdict(int) for name in METRICS}
+    add_snapshot(totals, archive['values'])
+    for name in dead:
+        snapshot = read_json(os.path.join(directory, name))
+        if name not in folded and snapshot is not None:
+            add_snapshot(totals, snapshot)
+            folded.add(name)
+    archive = {'values': totals, 'folded': sorted(folded)}
+    write_json(os.path.join(directory, ARCHIVE_FILE), json.dumps(archive))
+    for name in folded:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+    return archive
+
+
+def read_files(directory, own):
+    '''Значения из файлов процессов и архива, кроме своего файла own.
+    Сбор идет под блокировкой, чтобы файл, который другой процесс
+    переносит в архив, не был пропущен или учтен дважды.
+    '''
+    with open(os.path.join(directory, LOCK_FILE), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archive = read_json(os.path.join(directory, ARCHIVE_FILE))
+        archive = archive_dead_files(
+            directory, archive or {'values': {}, 'folded': []}
+        )
+        snapshots = [archive['values']]
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if PROCESS_FILE.fullmatch(name) and path != own:
+                snapshot = read_json(path)
+                if snapshot is not None:
+                    snapshots.append(snapshot)
+    return snapshots
+
+
+def format_labels(labels):
+    '''Метки в формате экспозиции: name="value",... в порядке имен.'''
+    return ','.join(
+        '{}="{}"'.format(
+            name,
+            str(value)
+            .replace('\\', '\\\\')
+            .replace('"', '\\"')
+            .replace('\n', '\\n'),
+        )
+        for name, value in sorted(labels.items())
+    )
+
+
+class MetricsRegistry:
+    '''Счетчики и гистограммы текущего процесса.
+    Если задан METRICS_DIR, процесс периодически сохраняет свои значения
+    в METRICS_DIR/metrics_<pid>_<uuid>.json, а экспозиция суммирует файлы
+    всех процессов (воркеров gunicorn). Файлы завершившихся процессов
+    складываются в metrics_archive.json и удаляются: счетчики не теряются
+    и не перезаписываются новым процессом с тем же pid.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flushed_at = 0.0
+        self._path = None
+        self.values = {name: {} for name in METRICS}
+
+    def inc(self, name, value=1, **labels):
+        '''Увеличивает счетчик.'''
+        key = format_labels(labels)
+        with self._lock:
+            series = self.values[name]
+            series[key] = series.get(key, 0) + value
+        self._maybe_flush()
+
+    def observe(self, name, value, **labels):
+        '''Добавляет наблюдение в гистограмму.
+        Хранит число попаданий в каждую корзину (последняя - +Inf)
+        и сумму наблюдений.
+        '''
+        buckets = METRICS[name][2]
+        key = format_labels(labels)
+        with self._lock:
+            series = self.values[name]
+            if key not in series:
+                series[key] = [0] * (len(buckets) + 2)
+            row = series[key]
+            row[bisect_left(buckets, value)] += 1
+            row[-1] += value
+        self._maybe_flush()
+
+    def get_path(self):
+        '''Файл значений процесса: pid и случайная часть.'''
+        if self._path is None:
+            self._path = os.path.join(
+                settings.METRICS_DIR,
+                f'metrics_{os.getpid()}_{uuid.uuid4().hex}.json',
+            )
+        return self._path
+
+    def reset(self):
+        '''Начинает значения заново в новом файле. Вызывается в процессе,
+        созданном fork: значения родителя остаются в файле родителя.
+        '''
+        self._lock = threading.Lock()
+        self._flushed_at = 0.0
+        self._path = None
+        self.values = {name: {} for name in METRICS}
+
+    def _maybe_flush(self):
+        if not settings.METRICS_DIR:
+            return
+        elapsed = time.monotonic() - self._flushed_at
+        if elapsed >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        '''Атомарно сохраняет значения процесса в METRICS_DIR.'''
+        if not settings.METRICS_DIR:
+            return
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        with self._lock:
+            path = self.get_path()
+            data = json.dumps(self.values)
+            self._flushed_at = time.monotonic()
+        write_json(path, data)
+
+    def collect(self):
+        '''Значения всех процессов, сложенные по сериям.'''
+        with self._lock:
+            snapshots = [json.loads(json.dumps(self.values))]
+            own = self._path
+        if settings.METRICS_DIR and os.path.isdir(settings.METRICS_DIR):
+            snapshots.extend(read_files(settings.METRICS_DIR, own))
+        totals = {name: defaultdict(int) for name in METRICS}
+        for snapshot in snapshots:
+            add_snapshot(totals, snapshot)
+        return totals
+
+    def render(self):
+        '''Все метрики в текстовом формате экспозиции Prometheus.'''
+        totals = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in sorted(totals[name].items()):
+                if kind != 'histogram':
+                    lines.append(f'{name}{{{key}}} {value}')
+                    continue
+                prefix = f'{key},' if key else ''
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    lines.append(
+                        f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}'
+                    )
+                lines.append(f'{name}_sum{{{key}}} {value[-1]}')
+                lines.append(f'{name}_count{{{key}}} {cumulative}')
+        lines.extend(self.render_hit_ratio(totals))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def render_hit_ratio(totals):
+        '''Доля попаданий по каждому кэшу.'''
+        name = 'foodgram_cache_hit_ratio'
+        requests = totals['foodgram_cache_requests_total']
+        yield f'# HELP {name} Доля попаданий во внутренние кэши.'
+        yield f'# TYPE {name} gauge'
+        for cache in CACHES:
+            hits = requests.get(
+                format_labels({'cache': cache, 'result': 'hit'}), 0
+            )
+            misses = requests.get(
+                format_labels({'cache': cache, 'result': 'miss'}), 0
+            )
+            if hits + misses:
+                yield (
+                    f'{name}{{{format_labels({"cache": cache})}}} '
+                    f'{hits / (hits + misses)}'
+                )
+
+
+registry = MetricsRegistry()
+atexit.register(registry.flush)
+os.register_at_fork(after_in_child=registry.reset)
+
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+
+def record_cache(cache, hits, misses):
+    '''Учитывает обращения к внутреннему кэшу.'''
+    if hits:
+        inc('foodgram_cache_requests_total', hits, cache=cache, result='hit')
+    if misses:
+        inc('foodgram_cache_requests_total', misses, cache=cache,
+            result='miss')
+
+
+def record_request(request, response, timings, total):
+    '''Учитывает обработанный запрос и его SQL-запросы.'''
+    match = request.resolver_match
+    view = match.view_name if match else 'unmatched'
+    inc(
+        'foodgram_http_requests_total',
+        view=view,
+        method=request.method,
+        status=response.status_code,
+    )
+    observe('foodgram_http_request_duration_seconds', total, view=view)
+    observe('foodgram_db_queries_per_request', timings.sql_count, view=view)
+    inc('foodgram_db_query_duration_seconds_total', timings.sql_time,
+        view=view)
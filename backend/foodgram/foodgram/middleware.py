@@ -0,0 +1,82 @@
+import json
+import logging
+import random
+import time
+
+from django.conf import settings
+
+from .instrumentation import collect_timings, phase
+from .metrics import record_request
+
+logger = logging.getLogger('foodgram.performance')
+
+
+class PerformanceMiddleware:
+    '''Замеряет фазы обработки запроса и отдает их в Server-Timing.
+    Фазы: auth - аутентификация, db - все SQL-запросы, serialize - работа
+    сериализаторов, render - рендеринг ответа, app - остальное (view,
+    middleware), total - все. Заголовок получают только сотрудники
+    (is_staff): время SQL не стоит показывать всем клиентам.
+    Часть запросов (PERFORMANCE_SAMPLE_RATE) пишется в лог, медленные -
+    всегда и вместе с текстом выполненных SQL-запросов.
+    Замеры также учитываются в метриках (foodgram.metrics).
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with collect_timings(settings.PERFORMANCE_MAX_QUERIES) as timings:
+            start = time.perf_counter()
+            response = self.get_response(request)
+            total = time.perf_counter() - start
+        self.report(request, response, timings, total)
+        record_request(request, response, timings, total)
+        return response
+
+    def process_template_response(self, request, response):
+        render = response.render
+
+        def timed_render():
+            with phase('render'):
+                return render()
+
+        response.render = timed_render
+        return response
+
+    def report(self, request, response, timings, total):
+        durations = dict(timings.phases)
+        durations['db'] = timings.sql_time
+        durations['app'] = max(0.0, total - sum(durations.values()))
+        durations['total'] = total
+        user = getattr(request, 'user', None)
+        if settings.PERFORMANCE_SERVER_TIMING and user and user.is_staff:
+            response['Server-Timing'] = ', '.join(
+                f'{name};dur={seconds * 1000:.1f}'
+                + (f';desc="{timings.sql_count} queries"'
+                   if name == 'db' else '')
+                for name, seconds in durations.items()
+            )
+        slow = total * 1000 >= settings.PERFORMANCE_SLOW_REQUEST_MS
+        if not slow and random.random() >= settings.PERFORMANCE_SAMPLE_RATE:
+            return
+        match = request.resolver_match
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'queries': timings.sql_count,
+            **{
+                f'{name}_ms': round(seconds * 1000, 3)
+                for name, seconds in durations.items()
+            },
+        }
+        if not slow:
+            logger.info(json.dumps(record, ensure_ascii=False))
+            return
+        record['sql'] = [
+            {'sql': sql, 'ms': round(seconds * 1000, 3)}
+            for sql, seconds in timings.queries
+        ]
+        logger.warning(json.dumps(record, ensure_ascii=False))
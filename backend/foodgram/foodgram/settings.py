@@ -20,6 +20,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'django_filters',
     'rest_framework.authtoken',
@@ -31,6 +32,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'foodgram.middleware.PerformanceMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -70,6 +72,17 @@ DATABASES = {
     }
 }
 
+# По умолчанию кэш свой у каждого процесса. Чтобы сброс кэша был виден
+# всем воркерам gunicorn, укажите общий кэш, например FileBasedCache.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -104,13 +117,44 @@ MEDIA_ROOT = Path(BASE_DIR) / 'media'
 
 AUTH_USER_MODEL = 'users.User'
 
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'foodgram.performance': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'foodgram.invalidation': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
 REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.TimedTokenAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS':
         'rest_framework.pagination.PageNumberPagination',
@@ -140,3 +184,98 @@ MAX_COOKING_TIME = 1000
 MIN_COOKING_TIME = 1
 MAX_AMOUNT_INGREDIENT = 10000
 MIN_AMOUNT_INGREDIENT = 1
+
+#  Рекомендации:
+RECOMMENDATIONS_TOP_K = 20
+RECOMMENDATIONS_SEED_SIZE = 50
+
+#  Собирать страницы списка рецептов целиком в PostgreSQL одним
+#  запросом, без моделей и сериализаторов (кроме fields/expand
+#  и браузерного API):
+RECIPES_JSON_FROM_DB = os.getenv('RECIPES_JSON_FROM_DB', 'False') == 'True'
+
+#  Наибольшее число рецептов в одном запросе /api/recipes/batch/:
+RECIPES_BATCH_MAX_SIZE = int(os.getenv('RECIPES_BATCH_MAX_SIZE', 100))
+
+#  Загрузка фото блюда через /api/recipes/images/: наибольший размер
+#  файла в байтах и срок действия токена загрузки в секундах:
+IMAGE_UPLOAD_MAX_SIZE = int(
+    os.getenv('IMAGE_UPLOAD_MAX_SIZE', 10 * 1024 * 1024)
+)
+IMAGE_UPLOAD_TOKEN_MAX_AGE = int(
+    os.getenv('IMAGE_UPLOAD_TOKEN_MAX_AGE', 24 * 60 * 60)
+)
+
+#  Готовые файлы списков покупок. С SHOPPING_CART_ACCEL_REDIRECT=True
+#  файл отдает nginx из internal-локации SHOPPING_CART_ACCEL_PREFIX,
+#  иначе - сам Django. Файлы, которые не скачивали
+#  SHOPPING_CART_CACHE_DAYS дней, удаляет prune_shopping_cart_files.
+SHOPPING_CART_CACHE_DIR = os.getenv(
+    'SHOPPING_CART_CACHE_DIR', '/tmp/foodgram-shopping-cart'
+)
+SHOPPING_CART_ACCEL_REDIRECT = (
+    os.getenv('SHOPPING_CART_ACCEL_REDIRECT', 'False') == 'True'
+)
+SHOPPING_CART_ACCEL_PREFIX = '/internal/shopping_cart/'
+SHOPPING_CART_CACHE_DAYS = int(os.getenv('SHOPPING_CART_CACHE_DAYS', 7))
+
+#  Сколько часов gc_media не трогает новые файлы фото блюд:
+MEDIA_GC_GRACE_HOURS = int(os.getenv('MEDIA_GC_GRACE_HOURS', 24))
+
+#  Шина сброса локальных кэшей через LISTEN/NOTIFY. Слушатель запускается
+#  в каждом воркере из wsgi.py и раз в INVALIDATION_REFRESH_INTERVAL
+#  секунд сбрасывает кэши целиком на случай потерянных сообщений.
+INVALIDATION_BUS_ENABLED = (
+    os.getenv('INVALIDATION_BUS_ENABLED', 'True') == 'True'
+)
+INVALIDATION_CHANNEL = 'foodgram_invalidation'
+INVALIDATION_REFRESH_INTERVAL = int(
+    os.getenv('INVALIDATION_REFRESH_INTERVAL', 300)
+)
+
+#  Кэш списков рецептов (только для анонимов), тегов и ингредиентов,
+#  секунд, 0 отключает кэш. Истекший ответ еще CACHE_GRACE секунд
+#  отдается, пока один запрос считает новый; остальные промахи ждут
+#  его до CACHE_LOCK_WAIT секунд. Сроки случайно отклоняются
+#  на ±CACHE_JITTER, чтобы ключи не истекали одновременно.
+RECIPES_CACHE_TIMEOUT = int(os.getenv('RECIPES_CACHE_TIMEOUT', 30))
+TAGS_CACHE_TIMEOUT = int(os.getenv('TAGS_CACHE_TIMEOUT', 3600))
+INGREDIENTS_CACHE_TIMEOUT = int(os.getenv('INGREDIENTS_CACHE_TIMEOUT', 3600))
+CACHE_GRACE = int(os.getenv('CACHE_GRACE', 60))
+CACHE_JITTER = 0.1
+CACHE_LOCK_TIMEOUT = 30
+CACHE_LOCK_WAIT = 2
+
+#  Кэш подписок пользователя, секунд:
+FOLLOW_SET_TIMEOUT = int(os.getenv('FOLLOW_SET_TIMEOUT', 300))
+
+
+#  Архивирование списков покупок и данных неактивных пользователей:
+SHOPPING_CART_RETENTION_DAYS = int(
+    os.getenv('SHOPPING_CART_RETENTION_DAYS', 90)
+)
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 5000))
+ARCHIVE_BATCH_SLEEP = float(os.getenv('ARCHIVE_BATCH_SLEEP', 0.5))
+
+#  Журнал изменений для /api/sync/: сколько дней действует курсор.
+#  Записи хранятся на сутки дольше, с запасом на долгие транзакции.
+SYNC_RETENTION_DAYS = int(os.getenv('SYNC_RETENTION_DAYS', 30))
+
+#  Удаление пользователей и рецептов пачками:
+DELETE_BATCH_SIZE = int(os.getenv('DELETE_BATCH_SIZE', 500))
+DELETE_BATCH_SLEEP = float(os.getenv('DELETE_BATCH_SLEEP', 0))
+
+#  Замеры производительности запросов. Заголовок Server-Timing
+#  отдается только сотрудникам (is_staff):
+PERFORMANCE_SERVER_TIMING = (
+    os.getenv('PERFORMANCE_SERVER_TIMING', 'True') == 'True'
+)
+PERFORMANCE_SAMPLE_RATE = float(os.getenv('PERFORMANCE_SAMPLE_RATE', 0))
+PERFORMANCE_SLOW_REQUEST_MS = float(
+    os.getenv('PERFORMANCE_SLOW_REQUEST_MS', 500)
+)
+PERFORMANCE_MAX_QUERIES = 200
+
+#  Метрики: каталог для сбора значений со всех воркеров gunicorn.
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 1
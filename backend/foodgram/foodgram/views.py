@@ -0,0 +1,11 @@
+from django.http import HttpResponse
+
+from .metrics import registry
+
+
+def metrics(request):
+    '''Метрики приложения в текстовом формате Prometheus.'''
+    return HttpResponse(
+        registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
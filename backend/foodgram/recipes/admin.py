@@ -1,13 +1,110 @@
 from django.contrib import admin
 from django.contrib.admin import register
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
 
+from .deletion import delete_recipes
 from .models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
                      ShoppingCart, Tag)
 
+DELETE_PREVIEW_SIZE = 20
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+class EstimatedCountPaginator(Paginator):
+    '''Пагинатор списков админки для больших таблиц.
+    Для выборки без фильтров число строк берется из статистики
+    PostgreSQL (pg_class.reltuples) вместо COUNT(*) по всей таблице.
+    Небольшие и еще не проанализированные таблицы считаются точно.
+    '''
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= ESTIMATED_COUNT_THRESHOLD:
+                return int(row[0])
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    '''Общие настройки списков больших таблиц: без полного подсчета
+    строк при поиске и с оценкой числа строк без фильтров.
+    '''
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+def count_related(model, field):
+    '''Подзапрос с числом строк model, ссылающихся на объект через field.
+    Считается только для строк страницы, в отличие от Count с JOIN.
+    '''
+    return Coalesce(
+        Subquery(
+            model.objects
+            .filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(count=Count('pk'))
+            .values('count')
+        ),
+        0,
+    )
+
+
+class BatchDeleteAdminMixin:
+    '''Удаление из админки пачками через batch_delete(queryset).
+    Страница подтверждения показывает число удаляемых объектов
+    вместо полного дерева связанных записей, которое для активного
+    автора не помещается ни в память, ни на страницу.
+    Удаление запускается после коммита транзакции страницы удаления:
+    каждая пачка коммитится отдельно, и блокировки не держатся
+    до конца удаления.
+    '''
+    batch_delete = None
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, type(obj).objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        transaction.on_commit(lambda: self.batch_delete(queryset))
+
+    def get_deleted_objects(self, objs, request):
+        opts = self.model._meta
+        count = len(objs) if isinstance(objs, list) else objs.count()
+        deleted_objects = [
+            f'{opts.verbose_name.capitalize()}: {obj}'
+            for obj in objs[:DELETE_PREVIEW_SIZE]
+        ]
+        if count > DELETE_PREVIEW_SIZE:
+            deleted_objects.append(
+                f'... и еще {count - DELETE_PREVIEW_SIZE}, а также '
+                'связанные с ними записи'
+            )
+        perms_needed = set()
+        if not self.has_delete_permission(request):
+            perms_needed.add(opts.verbose_name)
+        return (
+            deleted_objects,
+            {opts.verbose_name_plural: count},
+            perms_needed,
+            [],
+        )
+
 
 class IngredientRecipeInLine(admin.TabularInline):
     model = Recipe.ingredients.through
     extra = 2
+    autocomplete_fields = ('ingredients',)
 
 
 @register(Tag)
@@ -16,35 +113,57 @@ class TagAdmin(admin.ModelAdmin):
 
 
 @register(IngredientInRecipe)
-class IngredientInRecipeAdmin(admin.ModelAdmin):
+class IngredientInRecipeAdmin(LargeTableAdmin):
     list_display = ('recipe', 'ingredients', 'amount',)
-    list_filter = ('recipe',)
+    list_select_related = ('recipe', 'ingredients')
+    search_fields = ('^recipe__name', '^ingredients__name')
+    raw_id_fields = ('recipe',)
+    autocomplete_fields = ('ingredients',)
     save_on_top = True
 
 
 @register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('name', 'measurement_unit',)
+    search_fields = ('^name',)
+    show_full_result_count = False
     save_on_top = True
 
 
 @register(Recipe)
-class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'author',)
-    list_filter = ('name', 'author__username', 'tags__name')
+class RecipeAdmin(BatchDeleteAdminMixin, LargeTableAdmin):
+    list_display = ('id', 'name', 'author', 'favorites_count',)
+    list_select_related = ('author',)
+    list_filter = ('tags',)
+    search_fields = ('^name', '^author__username')
+    autocomplete_fields = ('author',)
     save_on_top = True
     inlines = (IngredientRecipeInLine, )
+    batch_delete = staticmethod(delete_recipes)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            favorites_count=count_related(Favorite, 'recipe')
+        )
+
+    @admin.display(description='В избранном', ordering='favorites_count')
+    def favorites_count(self, recipe):
+        return recipe.favorites_count
 
 
 @register(ShoppingCart)
-class ShoppingCartAdmin(admin.ModelAdmin):
-    list_display = ('user', 'recipe',)
-    list_filter = ('user',)
+class ShoppingCartAdmin(LargeTableAdmin):
+    list_display = ('user', 'recipe', 'added',)
+    list_select_related = ('user', 'recipe')
+    search_fields = ('^user__username', '^recipe__name')
+    raw_id_fields = ('user', 'recipe')
     save_on_top = True
 
 
 @register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
+class FavoriteAdmin(LargeTableAdmin):
     list_display = ('user', 'recipe',)
-    list_filter = ('user',)
+    list_select_related = ('user', 'recipe')
+    search_fields = ('^user__username', '^recipe__name')
+    raw_id_fields = ('user', 'recipe')
     save_on_top = True
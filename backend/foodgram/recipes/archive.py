@@ -0,0 +1,68 @@
+from collections import Counter
+
+from django.db import connection, transaction
+
+from users.models import User
+
+from .models import (ArchivedRelation, Favorite, FavoriteArchive, ShoppingCart,
+                     ShoppingCartArchive)
+from .stats import apply_deltas
+
+
+def archive_batch(model, archive, condition, params, reason, batch_size,
+                  fields=()):
+    '''Переносит в архив одну пачку строк model, подходящих под condition.
+    Удаление и вставка выполняются одним запросом (DELETE ... RETURNING),
+    строки, заблокированные другими транзакциями, пропускаются.
+    Перенос избранного вычитается из счетчиков авторов в той же транзакции.
+    Возвращает число перенесенных строк.
+    '''
+    table = model._meta.db_table
+    columns = ', '.join(
+        model._meta.get_field(name).column for name in fields
+    )
+    extra = f', {columns}' if columns else ''
+    sql = f'''
+        WITH moved AS (
+            DELETE FROM {table}
+            WHERE id IN (
+                SELECT id FROM {table}
+                WHERE {condition}
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, user_id, recipe_id{extra}
+        )
+        INSERT INTO {archive._meta.db_table}
+            (original_id, user_id, recipe_id{extra}, reason, archived)
+        SELECT id, user_id, recipe_id{extra}, %s, now() FROM moved
+        RETURNING recipe_id
+    '''
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql, [*params, batch_size, reason])
+        recipe_ids = [recipe_id for recipe_id, in cursor.fetchall()]
+        if model is Favorite:
+            apply_deltas({}, {
+                recipe_id: -count
+                for recipe_id, count in Counter(recipe_ids).items()
+            })
+        return len(recipe_ids)
+
+
+def get_archive_jobs(cart_cutoff):
+    '''Задания архивирования: (название, модель, архив, условие,
+    параметры, причина, дополнительные поля).
+    '''
+    inactive = (
+        f'user_id IN (SELECT id FROM {User._meta.db_table} '
+        'WHERE NOT is_active)'
+    )
+    return (
+        ('stale carts', ShoppingCart, ShoppingCartArchive, 'added < %s',
+         [cart_cutoff], ArchivedRelation.REASON_STALE, ('added',)),
+        ('inactive users carts', ShoppingCart, ShoppingCartArchive,
+         inactive, [], ArchivedRelation.REASON_INACTIVE_USER, ('added',)),
+        ('inactive users favorites', Favorite, FavoriteArchive, inactive,
+         [], ArchivedRelation.REASON_INACTIVE_USER, ()),
+    )
@@ -0,0 +1,73 @@
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+
+from users.models import Follow
+
+from .models import Favorite, Recipe, ShoppingCart, SimilarRecipe
+
+
+def delete_in_batches(queryset, batch_size=None, before_delete=None):
+    '''Удаляет объекты выборки пачками, каждую в своей транзакции.
+    Сборщик каскада Django видит только одну пачку, поэтому память
+    и время удержания блокировок ограничены ее размером; сигналы
+    удаления отправляются как обычно. before_delete(ids) вызывается
+    перед удалением каждой пачки, например, чтобы удалить
+    многочисленные дочерние записи такими же пачками.
+    Возвращает число удаленных объектов по моделям.
+    '''
+    batch_size = batch_size or settings.DELETE_BATCH_SIZE
+    model = queryset.model
+    ids_queryset = queryset.order_by().values_list('pk', flat=True)
+    deleted = Counter()
+    while True:
+        ids = list(ids_queryset[:batch_size])
+        if not ids:
+            return deleted
+        if before_delete is not None:
+            deleted.update(before_delete(ids))
+        with transaction.atomic():
+            deleted.update(
+                model._default_manager.filter(pk__in=ids).delete()[1]
+            )
+        if settings.DELETE_BATCH_SLEEP:
+            time.sleep(settings.DELETE_BATCH_SLEEP)
+
+
+def delete_recipes(queryset, batch_size=None):
+    '''Удаляет рецепты вместе с избранным, списками покупок
+    и похожими рецептами, которых у популярного рецепта может быть много.
+    '''
+    def delete_children(ids):
+        deleted = Counter()
+        for children in (
+            Favorite.objects.filter(recipe__in=ids),
+            ShoppingCart.objects.filter(recipe__in=ids),
+            SimilarRecipe.objects.filter(similar__in=ids),
+        ):
+            deleted.update(delete_in_batches(children, batch_size))
+        return deleted
+
+    return delete_in_batches(queryset, batch_size, delete_children)
+
+
+def delete_users(queryset, batch_size=None):
+    '''Удаляет пользователей: сначала пачками их рецепты, подписки
+    в обе стороны, избранное и списки покупок, затем самих пользователей.
+    '''
+    def delete_children(ids):
+        deleted = delete_recipes(
+            Recipe.objects.filter(author__in=ids), batch_size
+        )
+        for children in (
+            Follow.objects.filter(user__in=ids),
+            Follow.objects.filter(author__in=ids),
+            Favorite.objects.filter(user__in=ids),
+            ShoppingCart.objects.filter(user__in=ids),
+        ):
+            deleted.update(delete_in_batches(children, batch_size))
+        return deleted
+
+    return delete_in_batches(queryset, batch_size, delete_children)
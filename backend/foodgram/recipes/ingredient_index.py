@@ -0,0 +1,338 @@
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from itertools import groupby
+from operator import itemgetter
+
+from foodgram.invalidation import bus
+from foodgram.metrics import record_cache
+
+from .models import IngredientInRecipe
+from .sync import get_changed_recipes, get_cursor, is_expired, parse_cursor
+
+# Сколько последних результатов поиска хранить для следующих страниц.
+RESULT_CACHE_SIZE = 128
+# Битовая карта рецептов заводится для ингредиента, который есть
+# хотя бы в каждом BITMAP_SHARE-м рецепте: тогда она не больше
+# его списков id. По картам быстро считается число найденных рецептов.
+BITMAP_SHARE = 32
+BITMAP_MIN_SIZE = 1024
+
+
+def rank_groups(query_size, sizes):
+    '''Группы (найдено, всего ингредиентов) в порядке выдачи:
+    по убыванию доли найденных, затем по числу недостающих.
+    '''
+    return sorted(
+        (
+            (matched, size)
+            for size in sizes
+            for matched in range(1, min(query_size, size) + 1)
+        ),
+        key=lambda group: (-group[0] / group[1], group[1] - group[0]),
+    )
+
+
+def popcount(bitmap):
+    return bin(bitmap).count('1')
+
+
+class IngredientSearchResult:
+    '''Результат поиска по ингредиентам.
+    Поддерживает len() и срезы, поэтому его можно отдать пагинатору.
+    Списки id рецептов разбиты по числу ингредиентов рецепта, поэтому
+    группы выдачи строятся по одному разделу, а ранжируются только
+    группы, которые нужны до конца запрошенной страницы. Готовая часть
+    выдачи и число найденных рецептов запоминаются: результат хранится
+    в кэше индекса, и следующие страницы того же запроса не ранжируются
+    заново. Индекс не меняет списки на месте, поэтому результат видит
+    индекс таким, каким он был при поиске.
+    '''
+
+    def __init__(self, partitions, bitmaps, query_size):
+        self.partitions = partitions
+        self.bitmaps = bitmaps
+        self.groups = iter(rank_groups(query_size, partitions))
+        self.buckets = {}
+        self.ranked = []
+        self.count = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            if self.count is None:
+                self.count = self.get_count()
+            return self.count
+
+    def get_count(self):
+        '''Число рецептов хотя бы с одним ингредиентом запроса.
+        Рецепты частых ингредиентов считаются по битовым картам,
+        остальные - поштучно.
+        '''
+        union = 0
+        for bitmap in self.bitmaps.values():
+            union |= bitmap
+        rare = set()
+        for ingredient_id, postings in self.iter_postings():
+            if ingredient_id not in self.bitmaps:
+                rare.update(postings)
+        if not union:
+            return len(rare)
+        data = union.to_bytes((union.bit_length() + 7) // 8, 'little')
+        return popcount(union) + sum(
+            1 for recipe_id in rare
+            if (recipe_id >> 3) >= len(data)
+            or not data[recipe_id >> 3] >> (recipe_id & 7) & 1
+        )
+
+    def iter_postings(self):
+        for postings in self.partitions.values():
+            yield from postings
+
+    def get_bucket(self, matched, size):
+        '''id рецептов раздела size, в которых найдено matched
+        ингредиентов, от больших id к меньшим.
+        '''
+        if size not in self.buckets:
+            postings = [posting for _, posting in self.partitions[size]]
+            counts = Counter()
+            for posting in postings:
+                counts.update(posting)
+            buckets = {}
+            for recipe_id, count in counts.items():
+                buckets.setdefault(count, []).append(recipe_id)
+            for bucket in buckets.values():
+                bucket.sort(reverse=True)
+            self.buckets[size] = buckets
+        return self.buckets[size].get(matched, ())
+
+    def rank(self, stop):
+        '''Дополняет выдачу группами, пока в ней меньше stop рецептов.'''
+        while stop is None or len(self.ranked) < stop:
+            group = next(self.groups, None)
+            if group is None:
+                return
+            matched, size = group
+            coverage, missing = matched / size, size - matched
+            self.ranked.extend(
+                (recipe_id, coverage, missing)
+                for recipe_id in self.get_bucket(matched, size)
+            )
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        with self.lock:
+            self.rank(index.stop)
+            return self.ranked[index]
+
+
+class IngredientIndex:
+    '''Инвертированный индекс ингредиент -> id рецептов.
+    Для каждого ингредиента id рецептов хранятся отсортированными
+    массивами array('I') по разделам - числу ингредиентов рецепта.
+    Состав рецептов хранится отдельно, поэтому переиндексация рецепта
+    меняет только его разделы. Индекс строится при первом поиске
+    и дальше обновляется по одному рецепту при записи, а пропущенные
+    изменения других процессов догоняет по журналу изменений.
+    '''
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._cursor = None
+        self._recipes = None
+        self._postings = None
+        self._max_id = 0
+        self._bitmaps = {}
+        self._results = OrderedDict()
+
+    @staticmethod
+    def _load():
+        '''Читает индекс из базы. Курсор журнала изменений берется
+        до чтения: изменения, которые чтение не увидело, будут после него.
+        '''
+        cursor = get_cursor()
+        rows = (
+            IngredientInRecipe
+            .objects
+            .order_by('recipe_id')
+            .values_list('recipe_id', 'ingredients_id')
+            .iterator()
+        )
+        recipes = {
+            recipe_id: tuple(ingredient_id for _, ingredient_id in group)
+            for recipe_id, group in groupby(rows, itemgetter(0))
+        }
+        postings = {}
+        # Рецепты идут по возрастанию id, и списки получаются
+        # отсортированными без вставок.
+        for recipe_id, ingredient_ids in recipes.items():
+            size = len(ingredient_ids)
+            for ingredient_id in ingredient_ids:
+                partitions = postings.setdefault(ingredient_id, {})
+                partitions.setdefault(size, array('I')).append(recipe_id)
+        return cursor, recipes, postings
+
+    def _set(self, cursor, recipes, postings):
+        self._cursor, self._recipes, self._postings = (
+            cursor, recipes, postings
+        )
+        self._max_id = max(recipes, default=0)
+        self._bitmaps = {}
+        self._results.clear()
+
+    def _ensure_built(self):
+        if self._postings is None:
+            self._set(*self._load())
+
+    def _replace(self, ingredient_id, size, change):
+        '''Заменяет раздел ингредиента измененной копией.
+        Списки не меняются на месте: их могут читать готовые результаты.
+        '''
+        partitions = self._postings.setdefault(ingredient_id, {})
+        posting = partitions.get(size, array('I'))[:]
+        change(posting)
+        if posting:
+            partitions[size] = posting
+        else:
+            partitions.pop(size, None)
+
+    def _remove(self, recipe_id):
+        ingredient_ids = self._recipes.pop(recipe_id, ())
+        size = len(ingredient_ids)
+
+        def remove(posting):
+            position = bisect_left(posting, recipe_id)
+            if position < len(posting) and posting[position] == recipe_id:
+                del posting[position]
+
+        for ingredient_id in ingredient_ids:
+            self._replace(ingredient_id, size, remove)
+            if ingredient_id in self._bitmaps:
+                self._bitmaps[ingredient_id] &= ~(1 << recipe_id)
+
+    def _add(self, recipe_id, ingredient_ids):
+        self._recipes[recipe_id] = ingredient_ids
+        self._max_id = max(self._max_id, recipe_id)
+
+        def insert(posting):
+            posting.insert(bisect_left(posting, recipe_id), recipe_id)
+
+        for ingredient_id in ingredient_ids:
+            self._replace(ingredient_id, len(ingredient_ids), insert)
+            if ingredient_id in self._bitmaps:
+                self._bitmaps[ingredient_id] |= 1 << recipe_id
+
+    def update_recipes(self, recipe_ids):
+        '''Переиндексирует ингредиенты рецептов.
+        Удаленные рецепты просто убираются из индекса.
+        '''
+        with self._lock:
+            if self._postings is None:
+                return
+            recipe_ingredients = {recipe_id: [] for recipe_id in recipe_ids}
+            rows = (
+                IngredientInRecipe
+                .objects
+                .filter(recipe_id__in=recipe_ingredients)
+                .values_list('recipe_id', 'ingredients_id')
+            )
+            for recipe_id, ingredient_id in rows:
+                recipe_ingredients[recipe_id].append(ingredient_id)
+            for recipe_id, ingredient_ids in recipe_ingredients.items():
+                self._remove(recipe_id)
+                if ingredient_ids:
+                    self._add(recipe_id, tuple(ingredient_ids))
+            self._results.clear()
+
+    def invalidate(self):
+        '''Сбрасывает индекс, он будет построен при следующем поиске.'''
+        with self._lock:
+            self._cursor = self._recipes = self._postings = None
+            self._bitmaps = {}
+            self._results.clear()
+
+    def refresh(self):
+        '''Догоняет индекс по журналу изменений (SyncEvent):
+        переиндексирует рецепты, измененные после прошлого обновления.
+        Если журнал за это время уже очищен, индекс читается заново
+        и подменяется целиком. Вызывается шиной сброса кэшей
+        в фоновом потоке, поиск при этом не ждет.
+        '''
+        with self._lock:
+            cursor = self._cursor
+        if cursor is None:
+            return
+        since, issued = parse_cursor(cursor)
+        if is_expired(issued):
+            loaded = self._load()
+            with self._lock:
+                if self._cursor != cursor:
+                    return
+                self._set(*loaded)
+            cursor = loaded[0]
+            since, _ = parse_cursor(cursor)
+        next_cursor = get_cursor()
+        recipe_ids = get_changed_recipes(since)
+        if recipe_ids:
+            self.update_recipes(recipe_ids)
+        with self._lock:
+            if self._cursor == cursor:
+                self._cursor = next_cursor
+
+    def _get_bitmap(self, ingredient_id):
+        '''Битовая карта рецептов частого ингредиента, иначе None.'''
+        if ingredient_id in self._bitmaps:
+            return self._bitmaps[ingredient_id]
+        partitions = self._postings.get(ingredient_id, {})
+        total = sum(len(posting) for posting in partitions.values())
+        if total < max(BITMAP_MIN_SIZE, self._max_id // BITMAP_SHARE):
+            return None
+        data = bytearray(self._max_id // 8 + 1)
+        for posting in partitions.values():
+            for recipe_id in posting:
+                data[recipe_id >> 3] |= 1 << (recipe_id & 7)
+        bitmap = self._bitmaps[ingredient_id] = int.from_bytes(data, 'little')
+        return bitmap
+
+    def search(self, ingredient_ids):
+        '''Ищет рецепты, в которых есть хотя бы один из ингредиентов.'''
+        key = frozenset(ingredient_ids)
+        with self._lock:
+            result = self._results.get(key)
+            record_cache(
+                'ingredient_index', int(result is not None),
+                int(result is None),
+            )
+            if result is not None:
+                self._results.move_to_end(key)
+                return result
+            self._ensure_built()
+            partitions = {}
+            bitmaps = {}
+            for ingredient_id in key:
+                for size, posting in self._postings.get(
+                    ingredient_id, {}
+                ).items():
+                    partitions.setdefault(size, []).append(
+                        (ingredient_id, posting)
+                    )
+                bitmap = self._get_bitmap(ingredient_id)
+                if bitmap is not None:
+                    bitmaps[ingredient_id] = bitmap
+            result = IngredientSearchResult(partitions, bitmaps, len(key))
+            self._results[key] = result
+            if len(self._results) > RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+            return result
+
+
+ingredient_index = IngredientIndex()
+# Рецепты, измененные другими процессами, переиндексируются по их id,
+# пропущенные сообщения восполняются по журналу изменений.
+bus.subscribe(
+    'ingredient_index',
+    ingredient_index.update_recipes,
+    ingredient_index.refresh,
+)
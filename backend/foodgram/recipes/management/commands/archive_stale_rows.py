@@ -0,0 +1,75 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from recipes.archive import archive_batch, get_archive_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит в архив устаревшие записи списков покупок, а также '
+        'избранное и списки покупок неактивных пользователей.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention-days',
+            type=int,
+            default=settings.SHOPPING_CART_RETENTION_DAYS,
+            help='Сколько дней хранить записи списка покупок.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.ARCHIVE_BATCH_SIZE,
+            help='Сколько строк переносить за одну транзакцию.',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=settings.ARCHIVE_BATCH_SLEEP,
+            help='Пауза между пачками в секундах.',
+        )
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            default=None,
+            help='Остановиться после этого числа пачек на задание.',
+        )
+        parser.add_argument(
+            '--vacuum',
+            action='store_true',
+            help='Выполнить VACUUM ANALYZE очищенных таблиц.',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['retention_days'])
+        tables = set()
+        for name, model, archive, condition, params, reason, fields in (
+            get_archive_jobs(cutoff)
+        ):
+            total = batches = 0
+            while options['max_batches'] is None or (
+                batches < options['max_batches']
+            ):
+                moved = archive_batch(
+                    model, archive, condition, params, reason,
+                    options['batch_size'], fields,
+                )
+                total += moved
+                batches += 1
+                if moved < options['batch_size']:
+                    break
+                time.sleep(options['sleep'])
+            if total:
+                tables.add(model._meta.db_table)
+            self.stdout.write(f'{name}: {total}')
+        if options['vacuum']:
+            with connection.cursor() as cursor:
+                for table in sorted(tables):
+                    cursor.execute(f'VACUUM ANALYZE {table}')
+        self.stdout.write(self.style.SUCCESS('Архивирование завершено'))
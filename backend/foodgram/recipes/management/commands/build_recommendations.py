@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes.recommendations import build_similarity_index
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает таблицу похожих рецептов для рекомендаций.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-k',
+            type=int,
+            default=settings.RECOMMENDATIONS_TOP_K,
+            help='Сколько соседей хранить для каждого рецепта.',
+        )
+        parser.add_argument(
+            '--ingredient-weight',
+            type=float,
+            default=0.5,
+            help='Вес сходства по ингредиентам (от 0 до 1).',
+        )
+        parser.add_argument(
+            '--max-user-items',
+            type=int,
+            default=200,
+            help='Пользователи с большим числом рецептов не учитываются.',
+        )
+        parser.add_argument(
+            '--max-ingredient-share',
+            type=float,
+            default=0.2,
+            help='Ингредиенты, встречающиеся чаще, не учитываются.',
+        )
+
+    def handle(self, *args, **options):
+        saved = build_similarity_index(
+            top_k=options['top_k'],
+            ingredient_weight=options['ingredient_weight'],
+            max_user_items=options['max_user_items'],
+            max_ingredient_share=options['max_ingredient_share'],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f'Сохранено похожих рецептов: {saved}')
+        )
@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.models import Recipe
+from recipes.storage import collect_garbage
+
+
+class Command(BaseCommand):
+    help = 'Удаляет фото блюд, на которые не ссылается ни один рецепт.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours',
+            type=int,
+            default=settings.MEDIA_GC_GRACE_HOURS,
+            help='Не удалять файлы, измененные за это число часов.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, какие файлы будут удалены.',
+        )
+
+    def handle(self, *args, **options):
+        field = Recipe._meta.get_field('image')
+        referenced = set(
+            Recipe.objects
+            .exclude(image='')
+            .exclude(image__isnull=True)
+            .values_list('image', flat=True)
+            .iterator()
+        )
+        cutoff = timezone.now() - timedelta(hours=options['grace_hours'])
+        deleted = collect_garbage(
+            field.storage, field.upload_to.rstrip('/'), referenced, cutoff,
+            options['dry_run'],
+        )
+        if options['verbosity'] > 1:
+            for name in deleted:
+                self.stdout.write(name)
+        action = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(
+            self.style.SUCCESS(f'{action} файлов: {len(deleted)}')
+        )
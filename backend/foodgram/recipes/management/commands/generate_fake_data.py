@@ -0,0 +1,227 @@
+import csv
+import random
+from datetime import timedelta
+from io import StringIO
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from foodgram.cache import VersionBump
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, Tag)
+from recipes.snapshots import CHUNK_SIZE, refresh_snapshots
+from recipes.stats import rebuild_stats
+from users.models import Follow, User
+
+FAKE_IMAGE = 'recipes/fake.jpg'
+DEFAULT_TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+
+
+def copy_rows(model, fields, rows, batch_size):
+    '''Загружает строки в таблицу модели через COPY пачками.'''
+    columns = ', '.join(model._meta.get_field(name).column for name in fields)
+    sql = f'COPY {model._meta.db_table} ({columns}) FROM STDIN WITH CSV'
+    total = 0
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    with connection.cursor() as cursor:
+        for row in rows:
+            writer.writerow(row)
+            total += 1
+            if total % batch_size == 0:
+                buffer.seek(0)
+                cursor.copy_expert(sql, buffer)
+                buffer.seek(0)
+                buffer.truncate()
+        buffer.seek(0)
+        cursor.copy_expert(sql, buffer)
+    return total
+
+
+class Command(BaseCommand):
+    help = (
+        'Создает синтетические данные для нагрузочного тестирования: '
+        'пользователей, подписки, рецепты, избранное и списки покупок.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--authors-share',
+            type=float,
+            default=0.1,
+            help='Доля пользователей, публикующих рецепты.',
+        )
+        parser.add_argument('--follows-per-user', type=int, default=5)
+        parser.add_argument('--favorites-per-user', type=int, default=10)
+        parser.add_argument('--carts-per-user', type=int, default=3)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument(
+            '--prefix',
+            default='fake',
+            help='Префикс имен и почты создаваемых пользователей.',
+        )
+        parser.add_argument(
+            '--skip-snapshots',
+            action='store_true',
+            help='Не собирать готовые представления рецептов.',
+        )
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        prefix = options['prefix']
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        if not ingredient_ids:
+            raise CommandError(
+                'Нет ингредиентов, сначала выполните import_ingredients.'
+            )
+        if User.objects.filter(username__startswith=f'{prefix}_').exists():
+            raise CommandError(
+                f'Пользователи с префиксом {prefix} уже есть, '
+                'укажите другой --prefix.'
+            )
+        for name, color, slug in DEFAULT_TAGS:
+            Tag.objects.get_or_create(
+                slug=slug, defaults={'name': name, 'color': color}
+            )
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        now = timezone.now()
+
+        with transaction.atomic():
+            last_user_id = User.objects.order_by('-id').values('id')[:1]
+            last_user_id = last_user_id[0]['id'] if last_user_id else 0
+            password = make_password(None)
+            copy_rows(
+                User,
+                ('username', 'email', 'first_name', 'last_name', 'password',
+                 'is_superuser', 'is_staff', 'is_active', 'date_joined'),
+                (
+                    (f'{prefix}_{i}', f'{prefix}_{i}@example.com', 'Имя',
+                     'Фамилия', password, False, False, True, now)
+                    for i in range(options['users'])
+                ),
+                batch_size,
+            )
+            user_ids = list(
+                User.objects
+                .filter(id__gt=last_user_id)
+                .values_list('id', flat=True)
+            )
+            authors = rnd.sample(
+                user_ids,
+                max(1, int(len(user_ids) * options['authors_share'])),
+            )
+            self.stdout.write(f'Пользователей: {len(user_ids)}')
+
+            follows = min(options['follows_per_user'], len(authors) - 1)
+
+            def follow_rows():
+                for user_id in user_ids:
+                    candidates = rnd.sample(authors, follows + 1)
+                    for author_id in [
+                        author_id for author_id in candidates
+                        if author_id != user_id
+                    ][:follows]:
+                        yield user_id, author_id
+
+            copied = copy_rows(Follow, ('user', 'author'), follow_rows(),
+                               batch_size)
+            self.stdout.write(f'Подписок: {copied}')
+
+            last_recipe_id = Recipe.objects.order_by('-id').values('id')[:1]
+            last_recipe_id = last_recipe_id[0]['id'] if last_recipe_id else 0
+            copy_rows(
+                Recipe,
+                ('author', 'name', 'image', 'text', 'cooking_time',
+                 'pub_date', 'updated'),
+                (
+                    (rnd.choice(authors), f'Рецепт {i}', FAKE_IMAGE,
+                     'Описание рецепта. ' * rnd.randint(5, 50),
+                     rnd.randint(5, 180), pub_date, pub_date)
+                    for i in range(options['recipes'])
+                    for pub_date in (
+                        now - timedelta(minutes=options['recipes'] - i),
+                    )
+                ),
+                batch_size,
+            )
+            recipe_ids = list(
+                Recipe.objects
+                .filter(id__gt=last_recipe_id)
+                .values_list('id', flat=True)
+            )
+            self.stdout.write(f'Рецептов: {len(recipe_ids)}')
+
+            copy_rows(
+                Recipe.tags.through,
+                ('recipe', 'tag'),
+                (
+                    (recipe_id, tag_id)
+                    for recipe_id in recipe_ids
+                    for tag_id in rnd.sample(
+                        tag_ids, rnd.randint(1, len(tag_ids))
+                    )
+                ),
+                batch_size,
+            )
+            per_recipe = min(
+                options['ingredients_per_recipe'], len(ingredient_ids)
+            )
+            copied = copy_rows(
+                IngredientInRecipe,
+                ('recipe', 'ingredients', 'amount'),
+                (
+                    (recipe_id, ingredient_id, rnd.randint(1, 500))
+                    for recipe_id in recipe_ids
+                    for ingredient_id in rnd.sample(
+                        ingredient_ids, per_recipe
+                    )
+                ),
+                batch_size,
+            )
+            self.stdout.write(f'Ингредиентов в рецептах: {copied}')
+
+            # Популярность рецептов убывает как 1 / ранг.
+            popularity = list(
+                accumulate(1 / rank for rank in range(1, len(recipe_ids) + 1))
+            )
+            # Избранное и списки покупок добавлены за последние полгода.
+            for model, per_user in (
+                (Favorite, options['favorites_per_user']),
+                (ShoppingCart, options['carts_per_user']),
+            ):
+                copied = copy_rows(
+                    model,
+                    ('user', 'recipe', 'added'),
+                    (
+                        (user_id, recipe_id,
+                         now - timedelta(days=rnd.random() * 180))
+                        for user_id in user_ids
+                        for recipe_id in set(rnd.choices(
+                            recipe_ids, cum_weights=popularity, k=per_user
+                        ))
+                    ),
+                    batch_size,
+                )
+                self.stdout.write(
+                    f'{model._meta.verbose_name_plural}: {copied}'
+                )
+            # COPY не отправляет сигналы, счетчики пересчитываются целиком.
+            rebuild_stats()
+
+        if not options['skip_snapshots']:
+            for start in range(0, len(recipe_ids), CHUNK_SIZE):
+                refresh_snapshots(recipe_ids[start:start + CHUNK_SIZE])
+        VersionBump(['recipes'])()
+        self.stdout.write(self.style.SUCCESS('Данные созданы'))
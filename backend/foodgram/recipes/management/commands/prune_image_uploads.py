@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.uploads import prune_uploads
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет загруженные через /api/recipes/images/ фото, '
+        'токены которых уже устарели.'
+    )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(
+            seconds=settings.IMAGE_UPLOAD_TOKEN_MAX_AGE
+        )
+        deleted = prune_uploads(cutoff)
+        self.stdout.write(self.style.SUCCESS(f'Удалено загрузок: {deleted}'))
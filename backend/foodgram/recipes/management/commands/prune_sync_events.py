@@ -0,0 +1,46 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.sync import prune_events
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет из журнала изменений записи, которые уже не нужны '
+        'ни одному действующему курсору синхронизации.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention-days',
+            type=int,
+            default=settings.SYNC_RETENTION_DAYS + 1,
+            help='Сколько дней хранить записи журнала.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.ARCHIVE_BATCH_SIZE,
+            help='Сколько строк удалять за одну транзакцию.',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=settings.ARCHIVE_BATCH_SLEEP,
+            help='Пауза между пачками в секундах.',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['retention_days'])
+        total = 0
+        while True:
+            deleted = prune_events(cutoff, options['batch_size'])
+            total += deleted
+            if deleted < options['batch_size']:
+                break
+            time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f'Удалено записей: {total}'))
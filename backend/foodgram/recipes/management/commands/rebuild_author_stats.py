@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from recipes.stats import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает счетчики авторов: рецепты, подписчиков '
+        'и добавления в избранное. Нужен после загрузки данных '
+        'в обход ORM или правки базы вручную.'
+    )
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_stats()
+        self.stdout.write(
+            self.style.SUCCESS(f'Пересчитано авторов: {rebuilt}')
+        )
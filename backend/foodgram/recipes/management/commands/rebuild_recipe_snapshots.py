@@ -0,0 +1,21 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from foodgram.cache import VersionBump
+from recipes.models import Recipe
+from recipes.snapshots import CHUNK_SIZE, refresh_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает готовые JSON-представления всех рецептов.'
+
+    def handle(self, *args, **options):
+        recipe_ids = Recipe.objects.values_list('id', flat=True).iterator()
+        refreshed = 0
+        while chunk := list(islice(recipe_ids, CHUNK_SIZE)):
+            refreshed += len(refresh_snapshots(chunk))
+        VersionBump(['recipes'])()
+        self.stdout.write(
+            self.style.SUCCESS(f'Пересобрано представлений: {refreshed}')
+        )
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.3 on 2026-10-19 10:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_similarrecipe'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeSnapshot',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('data', models.TextField(verbose_name='JSON-представление рецепта')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Представление рецепта',
+                'verbose_name_plural': 'Представления рецептов',
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 3.2.3 on 2026-10-19 10:24
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FavoriteArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.BigIntegerField(verbose_name='id до архивирования')),
+                ('user_id', models.BigIntegerField(db_index=True, verbose_name='id пользователя')),
+                ('recipe_id', models.BigIntegerField(verbose_name='id рецепта')),
+                ('reason', models.CharField(choices=[('stale', 'Устарела'), ('inactive_user', 'Пользователь неактивен')], max_length=20, verbose_name='Причина')),
+                ('archived', models.DateTimeField(auto_now_add=True, verbose_name='Дата архивирования')),
+            ],
+            options={
+                'verbose_name': 'Архивная запись избранного',
+                'verbose_name_plural': 'Архив избранного',
+                'ordering': ('-archived',),
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ShoppingCartArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.BigIntegerField(verbose_name='id до архивирования')),
+                ('user_id', models.BigIntegerField(db_index=True, verbose_name='id пользователя')),
+                ('recipe_id', models.BigIntegerField(verbose_name='id рецепта')),
+                ('reason', models.CharField(choices=[('stale', 'Устарела'), ('inactive_user', 'Пользователь неактивен')], max_length=20, verbose_name='Причина')),
+                ('archived', models.DateTimeField(auto_now_add=True, verbose_name='Дата архивирования')),
+                ('added', models.DateTimeField(verbose_name='Дата добавления в список покупок')),
+            ],
+            options={
+                'verbose_name': 'Архивная запись списка покупок',
+                'verbose_name_plural': 'Архив списков покупок',
+                'ordering': ('-archived',),
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='added',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Дата добавления в список покупок'),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='shoppingcart',
+            index=models.Index(fields=['added'], name='shopping_cart_added_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.3 on 2026-10-19 10:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Заполняет счетчики по уже существующим данным.
+FILL_STATS = '''
+    INSERT INTO recipes_authorstats
+        (author_id, recipes_count, followers_count, favorites_count)
+    SELECT
+        author.id,
+        COALESCE(recipes.count, 0),
+        COALESCE(followers.count, 0),
+        COALESCE(favorites.count, 0)
+    FROM users_user AS author
+    LEFT JOIN (
+        SELECT author_id, COUNT(*) FROM recipes_recipe GROUP BY author_id
+    ) AS recipes ON recipes.author_id = author.id
+    LEFT JOIN (
+        SELECT author_id, COUNT(*) FROM users_follow GROUP BY author_id
+    ) AS followers ON followers.author_id = author.id
+    LEFT JOIN (
+        SELECT recipe.author_id, COUNT(*)
+        FROM recipes_favorite AS favorite
+        JOIN recipes_recipe AS recipe ON recipe.id = favorite.recipe_id
+        GROUP BY recipe.author_id
+    ) AS favorites ON favorites.author_id = author.id
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_follow_user'),
+        ('recipes', '0007_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorStats',
+            fields=[
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='users.user', verbose_name='Автор')),
+                ('recipes_count', models.IntegerField(default=0, verbose_name='Рецептов')),
+                ('followers_count', models.IntegerField(default=0, verbose_name='Подписчиков')),
+                ('favorites_count', models.IntegerField(default=0, verbose_name='Добавлений рецептов в избранное')),
+            ],
+            options={
+                'verbose_name': 'Статистика автора',
+                'verbose_name_plural': 'Статистика авторов',
+            },
+        ),
+        migrations.RunSQL(FILL_STATS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,126 @@
+# Generated by Django 3.2.3 on 2026-10-19 10:46
+
+import django.utils.timezone
+from django.db import migrations, models
+
+# Таблица, тип объекта, столбец пользователя, столбец id объекта.
+SYNC_TABLES = (
+    ('recipes_recipe', 'recipe', 'NULL', 'id'),
+    ('recipes_favorite', 'favorite', 'user_id', 'recipe_id'),
+    ('recipes_shoppingcart', 'shopping_cart', 'user_id', 'recipe_id'),
+    ('users_follow', 'follow', 'user_id', 'author_id'),
+)
+
+# Триггеры уровня оператора: изменения пишутся в журнал одной вставкой
+# на оператор, в том числе для COPY и массовых DELETE.
+# При UPDATE строка, сменившая пользователя или объект,
+# записывается как удаленная.
+SYNC_FUNCTION = '''
+    CREATE FUNCTION {table}_sync_log() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO recipes_syncevent
+                (kind, user_id, object_id, deleted, txid, created)
+            SELECT '{kind}', {user}, {object}, true, txid_current(), now()
+            FROM old_rows;
+            RETURN NULL;
+        END IF;
+        IF TG_OP = 'UPDATE' THEN
+            INSERT INTO recipes_syncevent
+                (kind, user_id, object_id, deleted, txid, created)
+            SELECT '{kind}', {user}, {object}, true, txid_current(), now()
+            FROM old_rows AS changed
+            WHERE NOT EXISTS (
+                SELECT 1 FROM new_rows AS kept
+                WHERE kept.{object} = changed.{object}
+                    AND {new_user} IS NOT DISTINCT FROM {old_user}
+            );
+        END IF;
+        INSERT INTO recipes_syncevent
+            (kind, user_id, object_id, deleted, txid, created)
+        SELECT '{kind}', {user}, {object}, false, txid_current(), now()
+        FROM new_rows;
+        RETURN NULL;
+    END
+    $$;
+    CREATE TRIGGER {table}_sync_insert
+        AFTER INSERT ON {table} REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION {table}_sync_log();
+    CREATE TRIGGER {table}_sync_update
+        AFTER UPDATE ON {table}
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION {table}_sync_log();
+    CREATE TRIGGER {table}_sync_delete
+        AFTER DELETE ON {table} REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION {table}_sync_log();
+'''
+DROP_SYNC_FUNCTION = 'DROP FUNCTION {table}_sync_log() CASCADE;'
+
+
+def sync_sql(template):
+    return [
+        template.format(
+            table=table,
+            kind=kind,
+            user=user,
+            object=column,
+            new_user=user if user == 'NULL' else f'kept.{user}',
+            old_user=user if user == 'NULL' else f'changed.{user}',
+        )
+        for table, kind, user, column in SYNC_TABLES
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_user_search_indexes'),
+        ('recipes', '0008_authorstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('recipe', 'Рецепт'), ('favorite', 'Избранное'), ('shopping_cart', 'Список покупок'), ('follow', 'Подписка')], max_length=20, verbose_name='Тип объекта')),
+                ('user_id', models.BigIntegerField(help_text='Пусто для общих объектов - рецептов', null=True, verbose_name='id пользователя')),
+                ('object_id', models.BigIntegerField(help_text='id рецепта, для подписок - id автора', verbose_name='id объекта')),
+                ('deleted', models.BooleanField(verbose_name='Удален')),
+                ('txid', models.BigIntegerField(verbose_name='Номер транзакции')),
+                ('created', models.DateTimeField(verbose_name='Дата записи')),
+            ],
+            options={
+                'verbose_name': 'Изменение для синхронизации',
+                'verbose_name_plural': 'Журнал изменений для синхронизации',
+                'ordering': ('-id',),
+            },
+        ),
+        migrations.AddField(
+            model_name='favorite',
+            name='added',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Дата добавления в избранное'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, verbose_name='Дата изменения рецепта'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['updated'], name='recipe_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='syncevent',
+            index=models.Index(fields=['user_id', 'txid'], name='sync_event_user_txid_idx'),
+        ),
+        migrations.RunSQL(
+            'UPDATE recipes_recipe SET updated = pub_date',
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            sync_sql(SYNC_FUNCTION), sync_sql(DROP_SYNC_FUNCTION)
+        ),
+    ]
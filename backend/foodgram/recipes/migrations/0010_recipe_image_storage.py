@@ -0,0 +1,20 @@
+# Generated by Django 3.2.3 on 2026-10-19 10:54
+
+from django.db import migrations, models
+
+import recipes.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_sync'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(blank=True, help_text='Загрузите фото блюда', null=True, storage=recipes.storage.ContentAddressedStorage(), upload_to='recipes/', verbose_name='Фото блюда'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 3.2.3 on 2026-10-19 12:10
+
+from django.db import migrations
+
+# Правка ингредиентов рецепта пишется в журнал как изменение самого
+# рецепта: по журналу клиенты и индекс ингредиентов узнают о ней,
+# даже если сам рецепт не сохранялся.
+SYNC_FUNCTION = '''
+    CREATE FUNCTION recipes_ingredientinrecipe_sync_log() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO recipes_syncevent
+                (kind, user_id, object_id, deleted, txid, created)
+            SELECT 'recipe', NULL, recipe_id, false, txid_current(), now()
+            FROM (SELECT DISTINCT recipe_id FROM new_rows) AS changed;
+        ELSIF TG_OP = 'DELETE' THEN
+            INSERT INTO recipes_syncevent
+                (kind, user_id, object_id, deleted, txid, created)
+            SELECT 'recipe', NULL, recipe_id, false, txid_current(), now()
+            FROM (SELECT DISTINCT recipe_id FROM old_rows) AS changed;
+        ELSE
+            INSERT INTO recipes_syncevent
+                (kind, user_id, object_id, deleted, txid, created)
+            SELECT 'recipe', NULL, recipe_id, false, txid_current(), now()
+            FROM (
+                SELECT recipe_id FROM old_rows
+                UNION
+                SELECT recipe_id FROM new_rows
+            ) AS changed;
+        END IF;
+        RETURN NULL;
+    END
+    $$;
+    CREATE TRIGGER recipes_ingredientinrecipe_sync_insert
+        AFTER INSERT ON recipes_ingredientinrecipe
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION recipes_ingredientinrecipe_sync_log();
+    CREATE TRIGGER recipes_ingredientinrecipe_sync_update
+        AFTER UPDATE ON recipes_ingredientinrecipe
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION recipes_ingredientinrecipe_sync_log();
+    CREATE TRIGGER recipes_ingredientinrecipe_sync_delete
+        AFTER DELETE ON recipes_ingredientinrecipe
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION recipes_ingredientinrecipe_sync_log();
+'''
+DROP_SYNC_FUNCTION = '''
+    DROP FUNCTION recipes_ingredientinrecipe_sync_log() CASCADE;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_image_storage'),
+    ]
+
+    operations = [
+        migrations.RunSQL(SYNC_FUNCTION, DROP_SYNC_FUNCTION),
+    ]
@@ -5,6 +5,7 @@ from django.db.models import UniqueConstraint
 
 from users.models import User
 
+from .storage import recipe_image_storage
 from .validators import validate_slug
 
 
@@ -49,6 +50,7 @@ class Recipe(models.Model):
         related_name='recipes',
         to=User,
         on_delete=models.CASCADE,
+        db_index=False,
     )
     ingredients = models.ManyToManyField(
         verbose_name='Ингредиенты для приготовления блюда',
@@ -63,6 +65,7 @@ class Recipe(models.Model):
     image = models.ImageField(
         'Фото блюда',
         upload_to='recipes/',
+        storage=recipe_image_storage,
         blank=True,
         null=True,
         help_text='Загрузите фото блюда',
@@ -90,11 +93,24 @@ class Recipe(models.Model):
         auto_now_add=True,
         editable=False,
     )
+    updated = models.DateTimeField(
+        'Дата изменения рецепта',
+        auto_now=True,
+    )
 
     class Meta:
         ordering = ('-pub_date',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        # Индекс по автору не нужен: его заменяет recipe_author_pub_date_idx.
+        indexes = [
+            models.Index(fields=['-pub_date'], name='recipe_pub_date_idx'),
+            models.Index(
+                fields=['author', '-pub_date'],
+                name='recipe_author_pub_date_idx',
+            ),
+            models.Index(fields=['updated'], name='recipe_updated_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -127,7 +143,8 @@ class IngredientInRecipe(models.Model):
     recipe = models.ForeignKey(
         to=Recipe,
         on_delete=models.CASCADE,
-        related_name='ingredient_list'
+        related_name='ingredient_list',
+        db_index=False,
     )
     ingredients = models.ForeignKey(
         to=Ingredient,
@@ -151,6 +168,7 @@ class IngredientInRecipe(models.Model):
     class Meta:
         verbose_name = 'Ингредиент в рецепте'
         verbose_name_plural = 'Ингредиенты в рецепте'
+        # Поиск по рецепту идет по unique_ingredient_in_recipe.
         constraints = [
             UniqueConstraint(
                 fields=['recipe', 'ingredients'],
@@ -171,24 +189,37 @@ class Favorite(models.Model):
         related_name='favorite_recipes',
         to=User,
         on_delete=models.CASCADE,
+        db_index=False,
     )
     recipe = models.ForeignKey(
         verbose_name='Рецепт, который пользователь добавил в избранное',
         related_name='favorite_users',
         to=Recipe,
         on_delete=models.CASCADE,
+        db_index=False,
+    )
+    added = models.DateTimeField(
+        'Дата добавления в избранное',
+        auto_now_add=True,
     )
 
     class Meta:
         ordering = ('-id',)
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранные'
+        # Поиск по пользователю идет по unique_favorite,
+        # по рецепту - по favorite_recipe_user_idx.
         constraints = [
             UniqueConstraint(
                 fields=['user', 'recipe'],
                 name='unique_favorite',
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'user'], name='favorite_recipe_user_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.user} добавил в избранное {self.recipe}'
@@ -203,24 +234,217 @@ class ShoppingCart(models.Model):
         related_name='shopping_cart_recipes',
         to=User,
         on_delete=models.CASCADE,
+        db_index=False,
     )
     recipe = models.ForeignKey(
         verbose_name='Рецепт, добавляемый пользователем в список покупок',
         related_name='shopping_cart_users',
         to=Recipe,
         on_delete=models.CASCADE,
+        db_index=False,
+    )
+    added = models.DateTimeField(
+        'Дата добавления в список покупок',
+        auto_now_add=True,
     )
 
     class Meta:
         ordering = ('-id',)
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Списки покупок'
+        # Поиск по пользователю идет по unique_shopping_cart,
+        # по рецепту - по shopping_cart_recipe_user_idx.
         constraints = [
             UniqueConstraint(
                 fields=['user', 'recipe'],
                 name='unique_shopping_cart',
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'user'],
+                name='shopping_cart_recipe_user_idx',
+            ),
+            models.Index(fields=['added'], name='shopping_cart_added_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user} добавил в список покупок {self.recipe}'
+
+
+class ArchivedRelation(models.Model):
+    '''Запись, перенесенная в архив из избранного или списка покупок.
+    Хранит id без внешних ключей: пользователь или рецепт
+    могут быть удалены после архивирования.
+    '''
+    REASON_STALE = 'stale'
+    REASON_INACTIVE_USER = 'inactive_user'
+    REASONS = (
+        (REASON_STALE, 'Устарела'),
+        (REASON_INACTIVE_USER, 'Пользователь неактивен'),
+    )
+
+    original_id = models.BigIntegerField('id до архивирования')
+    user_id = models.BigIntegerField('id пользователя', db_index=True)
+    recipe_id = models.BigIntegerField('id рецепта')
+    reason = models.CharField('Причина', max_length=20, choices=REASONS)
+    archived = models.DateTimeField('Дата архивирования', auto_now_add=True)
+
+    class Meta:
+        abstract = True
+        ordering = ('-archived',)
+
+
+class FavoriteArchive(ArchivedRelation):
+    '''Архив избранного.'''
+
+    class Meta(ArchivedRelation.Meta):
+        verbose_name = 'Архивная запись избранного'
+        verbose_name_plural = 'Архив избранного'
+
+
+class ShoppingCartArchive(ArchivedRelation):
+    '''Архив списков покупок.'''
+    added = models.DateTimeField('Дата добавления в список покупок')
+
+    class Meta(ArchivedRelation.Meta):
+        verbose_name = 'Архивная запись списка покупок'
+        verbose_name_plural = 'Архив списков покупок'
+
+
+class SimilarRecipe(models.Model):
+    '''Похожие рецепты.
+    Список top-K соседей рецепта, заранее рассчитанный командой
+    build_recommendations по совместным добавлениям в избранное/покупки
+    и по сходству наборов ингредиентов.
+    '''
+    recipe = models.ForeignKey(
+        verbose_name='Рецепт',
+        related_name='similar_recipes',
+        to=Recipe,
+        on_delete=models.CASCADE,
+    )
+    similar = models.ForeignKey(
+        verbose_name='Похожий рецепт',
+        related_name='+',
+        to=Recipe,
+        on_delete=models.CASCADE,
+    )
+    score = models.FloatField('Степень сходства')
+
+    class Meta:
+        ordering = ('recipe', '-score')
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            UniqueConstraint(
+                fields=['recipe', 'similar'],
+                name='unique_similar_recipe',
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['recipe', '-score'],
+                name='similar_recipe_score_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} ~ {self.similar} ({self.score:.3f})'
+
+
+class RecipeSnapshot(models.Model):
+    '''Готовое JSON-представление рецепта для чтения.
+    Хранит не зависящую от пользователя часть ответа RecipeSerializer.
+    Хранится текстом, а не jsonb, чтобы сохранить порядок ключей.
+    '''
+    recipe = models.OneToOneField(
+        verbose_name='Рецепт',
+        related_name='snapshot',
+        to=Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+    data = models.TextField('JSON-представление рецепта')
+    updated = models.DateTimeField('Дата обновления', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Представление рецепта'
+        verbose_name_plural = 'Представления рецептов'
+
+    def __str__(self):
+        return f'{self.recipe_id}'
+
+
+class AuthorStats(models.Model):
+    '''Счетчики автора: рецепты, подписчики и добавления его рецептов
+    в избранное. Обновляются сигналами при записи рецептов, подписок
+    и избранного и пересчитываются командой rebuild_author_stats.
+    '''
+    author = models.OneToOneField(
+        verbose_name='Автор',
+        related_name='stats',
+        to=User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+    recipes_count = models.IntegerField('Рецептов', default=0)
+    followers_count = models.IntegerField('Подписчиков', default=0)
+    favorites_count = models.IntegerField(
+        'Добавлений рецептов в избранное', default=0
+    )
+
+    class Meta:
+        verbose_name = 'Статистика автора'
+        verbose_name_plural = 'Статистика авторов'
+
+    def __str__(self):
+        return f'{self.author_id}'
+
+
+class SyncEvent(models.Model):
+    '''Запись журнала изменений для синхронизации клиентов.
+    Пишется триггерами базы данных при вставке, изменении и удалении
+    рецептов, избранного, списков покупок и подписок, поэтому учитывает
+    и массовые операции в обход ORM. Транзакция записи хранится в txid:
+    по ней строится курсор синхронизации.
+    '''
+    KIND_RECIPE = 'recipe'
+    KIND_FAVORITE = 'favorite'
+    KIND_SHOPPING_CART = 'shopping_cart'
+    KIND_FOLLOW = 'follow'
+    KINDS = (
+        (KIND_RECIPE, 'Рецепт'),
+        (KIND_FAVORITE, 'Избранное'),
+        (KIND_SHOPPING_CART, 'Список покупок'),
+        (KIND_FOLLOW, 'Подписка'),
+    )
+
+    kind = models.CharField('Тип объекта', max_length=20, choices=KINDS)
+    user_id = models.BigIntegerField(
+        'id пользователя',
+        null=True,
+        help_text='Пусто для общих объектов - рецептов',
+    )
+    object_id = models.BigIntegerField(
+        'id объекта',
+        help_text='id рецепта, для подписок - id автора',
+    )
+    deleted = models.BooleanField('Удален')
+    txid = models.BigIntegerField('Номер транзакции')
+    created = models.DateTimeField('Дата записи')
+
+    class Meta:
+        ordering = ('-id',)
+        verbose_name = 'Изменение для синхронизации'
+        verbose_name_plural = 'Журнал изменений для синхронизации'
+        # Общие изменения ищутся по user_id IS NULL, личные - по user_id,
+        # в обоих случаях начиная с txid курсора.
+        indexes = [
+            models.Index(
+                fields=['user_id', 'txid'], name='sync_event_user_txid_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id}'
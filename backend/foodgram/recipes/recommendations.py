@@ -0,0 +1,145 @@
+import heapq
+import math
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+
+from .models import (Favorite, IngredientInRecipe, Recipe, ShoppingCart,
+                     SimilarRecipe)
+
+BATCH_SIZE = 5000
+
+
+def _group(pairs):
+    '''Группирует пары (ключ, значение) в словарь множеств.'''
+    groups = defaultdict(set)
+    for key, value in pairs:
+        groups[key].add(value)
+    return groups
+
+
+def _cosine_neighbors(recipe_id, features, postings, max_posting):
+    '''Косинусная близость бинарных векторов рецепта ко всем соседям.
+    Соседи ищутся через инвертированный индекс признак -> рецепты,
+    поэтому затрагиваются только рецепты с общими признаками.
+    Слишком частые признаки (длиннее max_posting) пропускаются.
+    '''
+    own = features.get(recipe_id)
+    if not own:
+        return {}
+    overlap = Counter()
+    for feature in own:
+        posting = postings[feature]
+        if len(posting) <= max_posting:
+            overlap.update(posting)
+    del overlap[recipe_id]
+    norm = len(own)
+    return {
+        other: count / math.sqrt(norm * len(features[other]))
+        for other, count in overlap.items()
+    }
+
+
+def build_similarity_index(top_k=None, ingredient_weight=0.5,
+                           max_user_items=200, max_ingredient_share=0.2):
+    '''Пересчитывает таблицу похожих рецептов.
+    Сходство складывается из двух косинусных мер:
+    по пользователям, добавившим рецепты в избранное или покупки,
+    и по наборам ингредиентов. Для каждого рецепта сохраняется top-K.
+    Возвращает количество сохраненных строк.
+    '''
+    top_k = top_k or settings.RECOMMENDATIONS_TOP_K
+    interactions = [
+        *Favorite.objects.values_list('user_id', 'recipe_id').iterator(),
+        *ShoppingCart.objects.values_list('user_id', 'recipe_id').iterator(),
+    ]
+    user_recipes = {
+        user_id: recipes
+        for user_id, recipes in _group(interactions).items()
+        if len(recipes) <= max_user_items
+    }
+    recipe_users = _group(
+        (recipe_id, user_id)
+        for user_id, recipes in user_recipes.items()
+        for recipe_id in recipes
+    )
+    recipe_ingredients = _group(
+        IngredientInRecipe
+        .objects
+        .values_list('recipe_id', 'ingredients_id')
+        .iterator()
+    )
+    ingredient_recipes = _group(
+        (ingredient_id, recipe_id)
+        for recipe_id, ingredients in recipe_ingredients.items()
+        for ingredient_id in ingredients
+    )
+    recipe_ids = list(Recipe.objects.values_list('id', flat=True).iterator())
+    max_posting = max(2, int(len(recipe_ids) * max_ingredient_share))
+
+    saved = 0
+    rows = []
+    with transaction.atomic():
+        SimilarRecipe.objects.all().delete()
+        for recipe_id in recipe_ids:
+            scores = Counter()
+            for other, value in _cosine_neighbors(
+                recipe_id, recipe_users, user_recipes, max_user_items
+            ).items():
+                scores[other] += (1 - ingredient_weight) * value
+            for other, value in _cosine_neighbors(
+                recipe_id, recipe_ingredients, ingredient_recipes, max_posting
+            ).items():
+                scores[other] += ingredient_weight * value
+            rows.extend(
+                SimilarRecipe(
+                    recipe_id=recipe_id, similar_id=other, score=score
+                )
+                for other, score in heapq.nlargest(
+                    top_k, scores.items(), key=lambda item: item[1]
+                )
+            )
+            if len(rows) >= BATCH_SIZE:
+                SimilarRecipe.objects.bulk_create(rows)
+                saved += len(rows)
+                rows = []
+        SimilarRecipe.objects.bulk_create(rows)
+    return saved + len(rows)
+
+
+def get_similar_ids(recipe_id, limit=None):
+    '''Возвращает id похожих рецептов, начиная с самых близких.'''
+    limit = limit or settings.RECOMMENDATIONS_TOP_K
+    return list(
+        SimilarRecipe
+        .objects
+        .filter(recipe_id=recipe_id)
+        .values_list('similar_id', flat=True)[:limit]
+    )
+
+
+def get_recommended_ids(user, limit=None):
+    '''Возвращает id рекомендованных пользователю рецептов.
+    Соседи последних добавленных в избранное и покупки рецептов
+    суммируются по степени сходства.
+    '''
+    limit = limit or settings.RECOMMENDATIONS_TOP_K
+    seed_size = settings.RECOMMENDATIONS_SEED_SIZE
+    seeds = {
+        *user.favorite_recipes.values_list('recipe_id', flat=True)[:seed_size],
+        *user.shopping_cart_recipes.values_list(
+            'recipe_id', flat=True
+        )[:seed_size],
+    }
+    return list(
+        SimilarRecipe
+        .objects
+        .filter(recipe_id__in=seeds)
+        .exclude(similar_id__in=seeds)
+        .values('similar_id')
+        .annotate(total=Sum('score'))
+        .order_by('-total')
+        .values_list('similar_id', flat=True)[:limit]
+    )
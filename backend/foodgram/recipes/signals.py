@@ -0,0 +1,212 @@
+from weakref import WeakValueDictionary
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from foodgram.cache import VersionBump
+from foodgram.invalidation import bus
+from users.follow_set import FollowSetInvalidation
+from users.models import Follow, User
+
+from .ingredient_index import ingredient_index
+from .models import Favorite, Ingredient, IngredientInRecipe, Recipe, Tag
+from .snapshots import refresh_snapshots
+from .stats import StatsUpdate
+
+AUTHOR_SNAPSHOT_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+
+class RecipeRefresh:
+    '''Отложенный до коммита пересчет производных данных рецептов.
+    Обновляет индекс ингредиентов и представления рецептов.
+    Все изменения одной транзакции собираются в один вызов.
+    '''
+
+    def __init__(self):
+        self.recipe_ids = set()
+
+    def __call__(self):
+        ingredient_index.update_recipes(self.recipe_ids)
+        bus.publish('ingredient_index', self.recipe_ids)
+        refresh_snapshots(self.recipe_ids)
+
+
+def collect_on_commit(callback_class, update):
+    '''Передает в update отложенный до коммита обработчик callback_class.
+    Переиспользует уже запланированный обработчик той же точки сохранения,
+    чтобы откат вложенного atomic не терял накопленные изменения.
+    Запланированные обработчики хранятся в слабом словаре соединения:
+    обработчик, который Django выполнил или забыл при откате,
+    пропадает из словаря сам.
+    '''
+    connection = transaction.get_connection()
+    pending = connection.__dict__.setdefault(
+        'pending_on_commit', WeakValueDictionary()
+    )
+    key = (callback_class, frozenset(connection.savepoint_ids))
+    callback = pending.get(key)
+    if callback is not None:
+        update(callback)
+        return
+    callback = callback_class()
+    update(callback)
+    pending[key] = callback
+
+    def run():
+        if pending.get(key) is callback:
+            del pending[key]
+        callback()
+
+    transaction.on_commit(run)
+
+
+def bump_on_commit(*namespaces):
+    '''Сбрасывает кэши списков пространств после коммита.'''
+    collect_on_commit(
+        VersionBump, lambda bump: bump.namespaces.update(namespaces)
+    )
+
+
+def refresh_on_commit(*recipe_ids):
+    '''Планирует пересчет рецептов после коммита текущей транзакции.'''
+    collect_on_commit(
+        RecipeRefresh, lambda refresh: refresh.recipe_ids.update(recipe_ids)
+    )
+    bump_on_commit('recipes')
+
+
+def refresh_related_on_commit(recipes):
+    '''Пересобирает представления рецептов из выборки после коммита.'''
+    transaction.on_commit(
+        lambda: refresh_snapshots(recipes.values_list('id', flat=True))
+    )
+    bump_on_commit('recipes')
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def refresh_recipe(sender, instance, **kwargs):
+    '''Пересчитывает производные данные сохраненного рецепта.
+    Ингредиенты и теги сохраняются уже после самого рецепта,
+    поэтому пересчет выполняется после коммита транзакции.
+    '''
+    refresh_on_commit(instance.id)
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+def refresh_recipe_ingredients(sender, instance, **kwargs):
+    '''Пересчитывает рецепт при правке ингредиента в нем.'''
+    refresh_on_commit(instance.recipe_id)
+
+
+@receiver(post_save, sender=Ingredient)
+def refresh_ingredient_recipes(sender, instance, created, **kwargs):
+    '''Пересобирает представления рецептов с измененным ингредиентом.'''
+    if not created:
+        refresh_related_on_commit(
+            Recipe.objects.filter(ingredients=instance.id)
+        )
+
+
+@receiver(post_save, sender=Tag)
+def refresh_tag_recipes(sender, instance, created, **kwargs):
+    '''Пересобирает представления рецептов с измененным тегом.'''
+    if not created:
+        refresh_related_on_commit(Recipe.objects.filter(tags=instance.id))
+
+
+@receiver(pre_delete, sender=Tag)
+def refresh_deleted_tag_recipes(sender, instance, **kwargs):
+    '''Пересобирает представления рецептов удаляемого тега.
+    Связи с рецептами удаляются каскадом без сигналов, поэтому
+    рецепты запоминаются до удаления тега.
+    '''
+    recipe_ids = list(
+        Recipe.objects.filter(tags=instance.id).values_list('id', flat=True)
+    )
+    if recipe_ids:
+        refresh_on_commit(*recipe_ids)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_list(sender, instance, **kwargs):
+    '''Сбрасывает кэш списка тегов и рецептов с тегами.'''
+    bump_on_commit('tags', 'recipes')
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_list(sender, instance, **kwargs):
+    '''Сбрасывает кэш списка ингредиентов и рецептов с ними.'''
+    bump_on_commit('ingredients', 'recipes')
+
+
+@receiver(post_save, sender=User)
+def refresh_author_recipes(sender, instance, created, update_fields,
+                           **kwargs):
+    '''Пересобирает представления рецептов при правке профиля автора.'''
+    if created:
+        return
+    if update_fields and not AUTHOR_SNAPSHOT_FIELDS & set(update_fields):
+        return
+    refresh_related_on_commit(Recipe.objects.filter(author=instance.id))
+
+
+@receiver(post_save, sender=Recipe)
+def count_recipe(sender, instance, created, **kwargs):
+    '''Учитывает новый рецепт в счетчиках автора.'''
+    if created:
+        collect_on_commit(
+            StatsUpdate,
+            lambda stats: stats.add(instance.author_id, 'recipes_count', 1),
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def uncount_recipe(sender, instance, **kwargs):
+    '''Вычитает удаленный рецепт и его избранное из счетчиков автора.'''
+    collect_on_commit(
+        StatsUpdate,
+        lambda stats: stats.remove_recipe(instance.id, instance.author_id),
+    )
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def count_follower(sender, instance, created=None, **kwargs):
+    '''Учитывает подписку или отписку в счетчиках автора.'''
+    if created is False:
+        return
+    collect_on_commit(
+        StatsUpdate,
+        lambda stats: stats.add(
+            instance.author_id, 'followers_count', 1 if created else -1
+        ),
+    )
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def count_favorite(sender, instance, created=None, **kwargs):
+    '''Учитывает добавление рецепта в избранное или удаление из него.'''
+    if created is False:
+        return
+    collect_on_commit(
+        StatsUpdate,
+        lambda stats: stats.add_favorite(
+            instance.recipe_id, 1 if created else -1
+        ),
+    )
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_set(sender, instance, **kwargs):
+    '''Сбрасывает кэш подписок подписчика после коммита.'''
+    collect_on_commit(
+        FollowSetInvalidation,
+        lambda invalidation: invalidation.user_ids.add(instance.user_id),
+    )
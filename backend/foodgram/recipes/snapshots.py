@@ -0,0 +1,130 @@
+import json
+from collections import defaultdict
+
+from django.db import connection
+
+from foodgram.metrics import record_cache
+
+from .models import IngredientInRecipe, Recipe, RecipeSnapshot
+
+CHUNK_SIZE = 500
+TAG_FIELDS = ('id', 'name', 'color', 'slug')
+INGREDIENT_FIELDS = ('id', 'name', 'measurement_unit', 'amount')
+
+
+def build_documents(recipe_ids):
+    '''Собирает JSON-представления рецептов за три запроса.
+    Порядок ключей совпадает с RecipeSerializer, флаги пользователя
+    заполнены значениями по умолчанию и проставляются при чтении.
+    '''
+    tags = defaultdict(list)
+    tag_rows = (
+        Recipe.tags.through
+        .objects
+        .filter(recipe_id__in=recipe_ids)
+        .order_by('tag__slug')
+        .values_list('recipe_id', 'tag_id', 'tag__name', 'tag__color',
+                     'tag__slug')
+    )
+    for recipe_id, *tag in tag_rows:
+        tags[recipe_id].append(dict(zip(TAG_FIELDS, tag)))
+
+    ingredients = defaultdict(list)
+    ingredient_rows = (
+        IngredientInRecipe
+        .objects
+        .filter(recipe_id__in=recipe_ids)
+        .order_by('id')
+        .values_list('recipe_id', 'ingredients_id', 'ingredients__name',
+                     'ingredients__measurement_unit', 'amount')
+    )
+    for recipe_id, *ingredient in ingredient_rows:
+        ingredients[recipe_id].append(dict(zip(INGREDIENT_FIELDS, ingredient)))
+
+    image_url = Recipe._meta.get_field('image').storage.url
+    recipes = (
+        Recipe
+        .objects
+        .filter(id__in=recipe_ids)
+        .values('id', 'name', 'image', 'text', 'cooking_time', 'author_id',
+                'author__email', 'author__username', 'author__first_name',
+                'author__last_name')
+    )
+    documents = {}
+    for recipe in recipes:
+        documents[recipe['id']] = json.dumps(
+            {
+                'id': recipe['id'],
+                'tags': tags[recipe['id']],
+                'author': {
+                    'email': recipe['author__email'],
+                    'id': recipe['author_id'],
+                    'username': recipe['author__username'],
+                    'first_name': recipe['author__first_name'],
+                    'last_name': recipe['author__last_name'],
+                    'is_subscribed': False,
+                },
+                'ingredients': ingredients[recipe['id']],
+                'is_favorited': False,
+                'is_in_shopping_cart': False,
+                'name': recipe['name'],
+                'image': (
+                    image_url(recipe['image']) if recipe['image'] else None
+                ),
+                'text': recipe['text'],
+                'cooking_time': recipe['cooking_time'],
+            },
+            ensure_ascii=False,
+        )
+    return documents
+
+
+def refresh_snapshots(recipe_ids):
+    '''Пересобирает представления рецептов пачками по CHUNK_SIZE.
+    Возвращает словарь id рецепта -> новое представление.
+    '''
+    recipe_ids = list(recipe_ids)
+    refreshed = {}
+    for start in range(0, len(recipe_ids), CHUNK_SIZE):
+        documents = build_documents(recipe_ids[start:start + CHUNK_SIZE])
+        save_snapshots(documents)
+        refreshed.update(documents)
+    return refreshed
+
+
+def save_snapshots(documents):
+    '''Записывает представления одним INSERT ... ON CONFLICT.
+    Одновременные пересборки одного рецепта (после коммита и при чтении)
+    не конфликтуют: вторая запись просто обновляет строку. Рецепты,
+    удаленные после сборки представлений, пропускаются: строка рецепта
+    блокируется от удаления до конца записи.
+    '''
+    if not documents:
+        return
+    table = RecipeSnapshot._meta.db_table
+    recipe_table = Recipe._meta.db_table
+    sql = f'''
+        INSERT INTO {table} (recipe_id, data, updated)
+        SELECT recipe.id, document.data, now()
+        FROM unnest(%s::bigint[], %s::text[]) AS document(recipe_id, data)
+        JOIN {recipe_table} recipe ON recipe.id = document.recipe_id
+        ORDER BY recipe.id
+        FOR KEY SHARE OF recipe
+        ON CONFLICT (recipe_id) DO UPDATE
+        SET data = EXCLUDED.data, updated = EXCLUDED.updated
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [list(documents), list(documents.values())])
+
+
+def ensure_snapshots(recipes):
+    '''Достраивает недостающие представления для списка рецептов.'''
+    missing = [recipe for recipe in recipes if not hasattr(recipe, 'snapshot')]
+    record_cache('recipe_snapshot', len(recipes) - len(missing), len(missing))
+    if not missing:
+        return
+    documents = refresh_snapshots(recipe.id for recipe in missing)
+    for recipe in missing:
+        recipe.snapshot = RecipeSnapshot(
+            recipe=recipe, data=documents[recipe.id]
+        )
@@ -0,0 +1,126 @@
+from collections import Counter, defaultdict
+
+from django.db import connection
+
+from users.models import Follow, User
+
+from .models import AuthorStats, Favorite, Recipe
+
+FIELDS = ('recipes_count', 'followers_count', 'favorites_count')
+
+
+def apply_deltas(authors, favorites):
+    '''Прибавляет изменения к счетчикам авторов одним запросом.
+    authors - id автора -> изменения полей FIELDS, favorites - id рецепта ->
+    изменение числа добавлений в избранное, автор рецепта определяется
+    в запросе. Удаленные авторы и рецепты пропускаются,
+    недостающие строки счетчиков создаются.
+    '''
+    authors = {
+        author_id: deltas for author_id, deltas in authors.items()
+        if any(deltas)
+    }
+    favorites = {
+        recipe_id: delta for recipe_id, delta in favorites.items() if delta
+    }
+    if not authors and not favorites:
+        return
+    table = AuthorStats._meta.db_table
+    sums = ', '.join(f'SUM({name})' for name in FIELDS)
+    updates = ', '.join(
+        f'{name} = {table}.{name} + EXCLUDED.{name}' for name in FIELDS
+    )
+    # Строки вставляются по возрастанию id, чтобы параллельные
+    # обновления блокировали их в одном порядке.
+    sql = f'''
+        INSERT INTO {table} (author_id, {', '.join(FIELDS)})
+        SELECT deltas.author_id, {sums}
+        FROM (
+            SELECT * FROM unnest(
+                %s::bigint[], %s::integer[], %s::integer[], %s::integer[]
+            )
+            UNION ALL
+            SELECT recipe.author_id, 0, 0, favorite.delta
+            FROM unnest(%s::bigint[], %s::integer[])
+                AS favorite (recipe_id, delta)
+            JOIN {Recipe._meta.db_table} AS recipe
+                ON recipe.id = favorite.recipe_id
+        ) AS deltas (author_id, {', '.join(FIELDS)})
+        JOIN {User._meta.db_table} AS author ON author.id = deltas.author_id
+        GROUP BY deltas.author_id
+        ORDER BY deltas.author_id
+        ON CONFLICT (author_id) DO UPDATE SET {updates}
+    '''
+    columns = list(zip(*authors.values())) or [()] * len(FIELDS)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [
+            list(authors),
+            *map(list, columns),
+            list(favorites),
+            list(favorites.values()),
+        ])
+
+
+class StatsUpdate:
+    '''Отложенное до коммита обновление счетчиков авторов.
+    Изменения всей транзакции применяются одним запросом.
+    Избранное копится по рецептам: если рецепт удаляется в той же
+    транзакции, его изменения переносятся на автора в remove_recipe.
+    '''
+
+    def __init__(self):
+        self.authors = defaultdict(lambda: [0] * len(FIELDS))
+        self.favorites = Counter()
+
+    def __call__(self):
+        apply_deltas(self.authors, self.favorites)
+
+    def add(self, author_id, field, delta):
+        self.authors[author_id][FIELDS.index(field)] += delta
+
+    def add_favorite(self, recipe_id, delta):
+        self.favorites[recipe_id] += delta
+
+    def remove_recipe(self, recipe_id, author_id):
+        '''Учитывает удаление рецепта вместе с его избранным.'''
+        self.add(author_id, 'recipes_count', -1)
+        self.add(
+            author_id, 'favorites_count', self.favorites.pop(recipe_id, 0)
+        )
+
+
+def rebuild_stats():
+    '''Пересчитывает счетчики всех пользователей одним запросом.
+    Возвращает число записанных строк.
+    '''
+    table = AuthorStats._meta.db_table
+    recipes = Recipe._meta.db_table
+    updates = ', '.join(f'{name} = EXCLUDED.{name}' for name in FIELDS)
+    sql = f'''
+        INSERT INTO {table} (author_id, {', '.join(FIELDS)})
+        SELECT
+            author.id,
+            COALESCE(recipes.count, 0),
+            COALESCE(followers.count, 0),
+            COALESCE(favorites.count, 0)
+        FROM {User._meta.db_table} AS author
+        LEFT JOIN (
+            SELECT author_id, COUNT(*) FROM {recipes} GROUP BY author_id
+        ) AS recipes ON recipes.author_id = author.id
+        LEFT JOIN (
+            SELECT author_id, COUNT(*)
+            FROM {Follow._meta.db_table}
+            GROUP BY author_id
+        ) AS followers ON followers.author_id = author.id
+        LEFT JOIN (
+            SELECT recipe.author_id, COUNT(*)
+            FROM {Favorite._meta.db_table} AS favorite
+            JOIN {recipes} AS recipe ON recipe.id = favorite.recipe_id
+            GROUP BY recipe.author_id
+        ) AS favorites ON favorites.author_id = author.id
+        ORDER BY author.id
+        ON CONFLICT (author_id) DO UPDATE SET {updates}
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        return cursor.rowcount
@@ -0,0 +1,81 @@
+import hashlib
+import os
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    '''Файловое хранилище, в котором имя файла - SHA-256 его содержимого.
+    Одинаковые файлы хранятся один раз: повторная загрузка возвращает
+    имя уже сохраненного файла. Содержимое под именем никогда не меняется,
+    поэтому такие файлы можно кэшировать навсегда. Вместе с записями
+    файлы не удаляются - неиспользуемые убирает команда gc_media.
+    '''
+
+    def get_content_name(self, name, content):
+        '''Имя по содержимому в каталоге исходного имени:
+        recipes/ab/ab....png.
+        '''
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        return posixpath.join(
+            posixpath.dirname(name), digest[:2], f'{digest}{extension}'
+        )
+
+    def get_available_name(self, name, max_length=None):
+        '''Имя по содержимому не меняется. Если файл с таким именем
+        уже есть, в нем то же содержимое: FileExistsError прерывает
+        сохранение, и save возвращает имя готового файла.
+        '''
+        if self.exists(name):
+            raise FileExistsError(name)
+        return name
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.get_content_name(name, content)
+        try:
+            return super().save(name, content, max_length)
+        except FileExistsError:
+            # Файл уже сохранен, возможно, параллельной загрузкой.
+            # Свежая дата изменения защищает его от gc_media,
+            # пока новая ссылка на него не закоммичена.
+            os.utime(self.path(name))
+            return name
+
+
+recipe_image_storage = ContentAddressedStorage()
+
+
+def walk_files(storage, directory):
+    '''Имена всех файлов каталога хранилища, включая вложенные.'''
+    if not storage.exists(directory):
+        return
+    directories, files = storage.listdir(directory)
+    for name in files:
+        yield posixpath.join(directory, name)
+    for name in directories:
+        yield from walk_files(storage, posixpath.join(directory, name))
+
+
+def collect_garbage(storage, directory, referenced, cutoff, dry_run=False):
+    '''Удаляет файлы каталога, на которые нет ссылок в referenced.
+    Файлы новее cutoff не трогаются: запись, которая на них ссылается,
+    может быть еще не закоммичена. Возвращает список удаленных имен.
+    '''
+    deleted = []
+    for name in walk_files(storage, directory):
+        if name in referenced or storage.get_modified_time(name) >= cutoff:
+            continue
+        if not dry_run:
+            storage.delete(name)
+        deleted.append(name)
+    return deleted
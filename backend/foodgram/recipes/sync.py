@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import CharField, Value
+from django.utils import timezone as django_timezone
+
+from users.models import Follow
+
+from .models import Favorite, ShoppingCart, SyncEvent
+
+# Тип объекта журнала -> раздел ответа синхронизации.
+SECTIONS = {
+    SyncEvent.KIND_RECIPE: 'recipes',
+    SyncEvent.KIND_FAVORITE: 'favorites',
+    SyncEvent.KIND_SHOPPING_CART: 'shopping_cart',
+    SyncEvent.KIND_FOLLOW: 'subscriptions',
+}
+
+
+def make_cursor(txid, issued):
+    return f'{txid}-{int(issued.timestamp())}'
+
+
+def parse_cursor(cursor):
+    '''Разбирает курсор в (txid, время выдачи).
+    При неверном формате выбрасывает ValueError.
+    '''
+    txid, issued = cursor.split('-')
+    try:
+        issued = datetime.fromtimestamp(int(issued), timezone.utc)
+    except (OverflowError, OSError):
+        raise ValueError(f'Неверное время выдачи курсора: {issued}')
+    return int(txid), issued
+
+
+def get_cursor():
+    '''Курсор для следующей синхронизации.
+    Берется самая старая незавершенная транзакция: все, что младше,
+    уже видно, а изменения незавершенных транзакций попадут в следующий
+    ответ. Курсор не убывает; изменения, закоммиченные после его выдачи,
+    могут прийти повторно - применять их нужно идемпотентно.
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT txid_snapshot_xmin(txid_current_snapshot()), now()'
+        )
+        return make_cursor(*cursor.fetchone())
+
+
+def is_expired(issued):
+    '''Курсор выдан раньше, чем хранится журнал изменений.'''
+    expires = timedelta(days=settings.SYNC_RETENTION_DAYS)
+    return issued < django_timezone.now() - expires
+
+
+def get_changed_recipes(since):
+    '''id рецептов, измененных или удаленных после транзакции since.'''
+    return set(
+        SyncEvent.objects
+        .filter(kind=SyncEvent.KIND_RECIPE, user_id=None, txid__gte=since)
+        .order_by()
+        .values_list('object_id', flat=True)
+        .distinct()
+    )
+
+
+def empty_changes():
+    return {
+        section: {'changed': [], 'deleted': []}
+        for section in SECTIONS.values()
+    }
+
+
+def get_changes(user_id, since):
+    '''Изменения после транзакции since: общие - по рецептам,
+    личные - по избранному, списку покупок и подпискам пользователя.
+    По каждому объекту берется только последнее изменение.
+    Для анонимного пользователя user_id - None.
+    '''
+    table = SyncEvent._meta.db_table
+    sql = f'''
+        SELECT DISTINCT ON (kind, object_id) kind, object_id, deleted
+        FROM {table}
+        WHERE txid >= %s AND (user_id IS NULL OR user_id = %s)
+        ORDER BY kind, object_id, id DESC
+    '''
+    changes = empty_changes()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [since, user_id])
+        for kind, object_id, deleted in cursor.fetchall():
+            status = 'deleted' if deleted else 'changed'
+            changes[SECTIONS[kind]][status].append(object_id)
+    return changes
+
+
+def get_state(user_id):
+    '''Полный состав избранного, списка покупок и подписок пользователя
+    одним запросом - для первой синхронизации.
+    '''
+    changes = empty_changes()
+    if user_id is None:
+        return changes
+    queries = [
+        model.objects
+        .filter(user=user_id)
+        .annotate(section=Value(section, output_field=CharField()))
+        .order_by()
+        .values_list(column, 'section')
+        for model, column, section in (
+            (Favorite, 'recipe', 'favorites'),
+            (ShoppingCart, 'recipe', 'shopping_cart'),
+            (Follow, 'author', 'subscriptions'),
+        )
+    ]
+    for object_id, section in queries[0].union(*queries[1:], all=True):
+        changes[section]['changed'].append(object_id)
+    return changes
+
+
+def prune_events(cutoff, batch_size):
+    '''Удаляет одну пачку записей журнала старше cutoff.
+    Журнал пишется только в конец, поэтому старые записи идут
+    первыми по id. Возвращает число удаленных строк.
+    '''
+    table = SyncEvent._meta.db_table
+    sql = f'''
+        DELETE FROM {table}
+        WHERE id IN (
+            SELECT id FROM {table}
+            WHERE created < %s
+            ORDER BY id
+            LIMIT %s
+        )
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [cutoff, batch_size])
+        return cursor.rowcount
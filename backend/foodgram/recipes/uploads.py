@@ -0,0 +1,60 @@
+import os
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+UPLOAD_DIR = 'uploads'
+TOKEN_PREFIX = 'upload:'
+TOKEN_SALT = 'recipes.uploads'
+
+
+def save_upload(image, user_id):
+    '''Сохраняет загруженное фото во временный каталог хранилища.
+    Возвращает подписанный токен, который принимает поле image рецепта.
+    '''
+    extension = os.path.splitext(image.name)[1].lower()
+    name = default_storage.save(
+        f'{UPLOAD_DIR}/{uuid.uuid4().hex}{extension}', image
+    )
+    return TOKEN_PREFIX + signing.dumps(
+        {'name': name, 'user': user_id}, salt=TOKEN_SALT
+    )
+
+
+def open_upload(token, user_id):
+    '''Открывает фото по токену загрузки.
+    Токен должен быть выдан тому же пользователю и не устареть.
+    В остальных случаях выбрасывает ValueError.
+    '''
+    try:
+        data = signing.loads(
+            token[len(TOKEN_PREFIX):],
+            salt=TOKEN_SALT,
+            max_age=settings.IMAGE_UPLOAD_TOKEN_MAX_AGE,
+        )
+    except signing.BadSignature:
+        raise ValueError('Неверный или устаревший токен загрузки')
+    if data['user'] != user_id or not default_storage.exists(data['name']):
+        raise ValueError('Загрузка не найдена')
+    return File(
+        default_storage.open(data['name']),
+        name=os.path.basename(data['name']),
+    )
+
+
+def prune_uploads(cutoff):
+    '''Удаляет загрузки старше cutoff: их токены уже недействительны.
+    Возвращает число удаленных файлов.
+    '''
+    if not default_storage.exists(UPLOAD_DIR):
+        return 0
+    deleted = 0
+    for name in default_storage.listdir(UPLOAD_DIR)[1]:
+        path = f'{UPLOAD_DIR}/{name}'
+        if default_storage.get_modified_time(path) < cutoff:
+            default_storage.delete(path)
+            deleted += 1
+    return deleted
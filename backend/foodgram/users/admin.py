@@ -1,20 +1,36 @@
 from django.contrib import admin
 from django.contrib.admin import register
 
+from recipes.admin import BatchDeleteAdminMixin, LargeTableAdmin
+from recipes.deletion import delete_users
 from users.models import Follow, User
 
 
 @register(User)
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(BatchDeleteAdminMixin, LargeTableAdmin):
     list_display = (
         'pk',
         'username',
         'email',
         'first_name',
         'last_name',
+        'recipes_count',
     )
     empty_value_display = 'значение отсутствует'
-    list_filter = ('username', 'email')
+    list_filter = ('is_active', 'is_staff')
+    search_fields = ('^username', '^email')
+    list_select_related = ('stats',)
+    batch_delete = staticmethod(delete_users)
 
+    @admin.display(description='Рецептов', ordering='stats__recipes_count')
+    def recipes_count(self, user):
+        stats = getattr(user, 'stats', None)
+        return stats.recipes_count if stats else 0
 
-admin.site.register(Follow)
+
+@register(Follow)
+class FollowAdmin(LargeTableAdmin):
+    list_display = ('user', 'author',)
+    list_select_related = ('user', 'author')
+    search_fields = ('^user__username', '^author__username')
+    raw_id_fields = ('user', 'author')
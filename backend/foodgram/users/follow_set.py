@@ -0,0 +1,103 @@
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+
+from foodgram.cache import (bump_versions, get_version, get_version_key,
+                            is_process_local)
+from foodgram.invalidation import bus
+from foodgram.metrics import record_cache
+
+from .models import Follow
+
+TYPECODE = 'q'
+
+
+class FollowSet:
+    '''Отсортированный массив id авторов, на которых подписан пользователь.
+    Проверка подписки - двоичный поиск по массиву.
+    '''
+
+    def __init__(self, author_ids=()):
+        self.ids = array(TYPECODE, sorted(author_ids))
+
+    @classmethod
+    def from_bytes(cls, data):
+        follow_set = cls()
+        follow_set.ids.frombytes(data)
+        return follow_set
+
+    def to_bytes(self):
+        return self.ids.tobytes()
+
+    def __contains__(self, author_id):
+        index = bisect_left(self.ids, author_id)
+        return index < len(self.ids) and self.ids[index] == author_id
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def get_key(user_id):
+    return f'follow_set:{user_id}'
+
+
+def get_follow_set(user):
+    '''Подписки пользователя из кэша, при промахе - из базы.
+    Для анонимного пользователя - пустое множество.
+    Запись хранится вместе с версией подписок пользователя, а сброс
+    меняет версию. Если сброс случится между чтением из базы и записью
+    в кэш, записанное множество уже не совпадет с версией и не будет
+    прочитано.
+    '''
+    if not user.is_authenticated:
+        return FollowSet()
+    key = get_key(user.id)
+    version_key = get_version_key(key)
+    values = cache.get_many([version_key, key])
+    version = values.get(version_key)
+    entry = values.get(key)
+    hit = version is not None and entry is not None and entry[0] == version
+    record_cache('follow_set', int(hit), int(not hit))
+    if hit:
+        return FollowSet.from_bytes(entry[1])
+    if version is None:
+        version = get_version(key)
+    follow_set = FollowSet(
+        Follow.objects.filter(user=user.id).values_list('author', flat=True)
+    )
+    cache.set(
+        key, (version, follow_set.to_bytes()), settings.FOLLOW_SET_TIMEOUT
+    )
+    return follow_set
+
+
+class FollowSetInvalidation:
+    '''Отложенный до коммита сброс кэша подписок.
+    Пользователи всей транзакции сбрасываются одним обращением к кэшу,
+    остальным процессам они сообщаются через шину сброса кэшей.
+    '''
+
+    def __init__(self):
+        self.user_ids = set()
+
+    def __call__(self):
+        evict_follow_sets(self.user_ids)
+        bus.publish('follow_set', self.user_ids)
+
+
+def evict_follow_sets(user_ids):
+    bump_versions(get_key(user_id) for user_id in user_ids)
+
+
+def evict_local_follow_sets(user_ids):
+    '''Сброс по сообщению другого процесса: с общим кэшем версии
+    подписок уже сменил отправитель.
+    '''
+    if is_process_local():
+        evict_follow_sets(user_ids)
+
+
+# Полный сброс не нужен: записи живут FOLLOW_SET_TIMEOUT.
+bus.subscribe('follow_set', evict_local_follow_sets)
@@ -0,0 +1,47 @@
+# Generated by Django 3.2.3 on 2026-10-19 11:05
+
+from django.db import migrations
+
+PREFIX_FIELDS = ('username', 'first_name', 'last_name')
+
+
+def create_trigram_index(apps, schema_editor):
+    '''Триграммный индекс создается, только если на сервере есть pg_trgm.
+    Без него поиск работает только по началу имени.
+    '''
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+        )
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX user_username_trgm_idx '
+        'ON users_user USING gin (username gin_trgm_ops)'
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX IF EXISTS user_username_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_follow_user'),
+    ]
+
+    operations = [
+        *(
+            migrations.RunSQL(
+                sql=(
+                    f'CREATE INDEX user_{field}_upper_idx '
+                    f'ON users_user (UPPER({field}) text_pattern_ops);'
+                ),
+                reverse_sql=f'DROP INDEX user_{field}_upper_idx;',
+            )
+            for field in PREFIX_FIELDS
+        ),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -48,6 +48,7 @@ class Follow(models.Model):
         related_name='follower',
         to=User,
         on_delete=models.CASCADE,
+        db_index=False,
     )
     author = models.ForeignKey(
         verbose_name='Автор рецепта',
@@ -59,6 +60,7 @@ class Follow(models.Model):
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+        # Поиск по подписчику идет по unique_follow.
         constraints = [
             UniqueConstraint(
                 fields=['user', 'author'],
@@ -0,0 +1,30 @@
+from functools import lru_cache
+
+from django.db import connection
+from django.db.models import Q
+
+PREFIX_FIELDS = ('username', 'first_name', 'last_name')
+TRIGRAM_INDEX = 'user_username_trgm_idx'
+
+
+@lru_cache(maxsize=None)
+def has_trigram_index():
+    '''Создан ли триграммный индекс: без pg_trgm миграция его пропускает.'''
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_indexes WHERE indexname = %s', [TRIGRAM_INDEX]
+        )
+        return cursor.fetchone() is not None
+
+
+def search_users(queryset, text):
+    '''Пользователи, у которых имя пользователя, имя или фамилия
+    начинаются с text (индексы user_*_upper_idx), а при наличии pg_trgm -
+    еще и с похожим на text именем пользователя (user_username_trgm_idx).
+    '''
+    condition = Q()
+    for field in PREFIX_FIELDS:
+        condition |= Q(**{f'{field}__istartswith': text})
+    if has_trigram_index():
+        condition |= Q(username__trigram_similar=text)
+    return queryset.filter(condition)